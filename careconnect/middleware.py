@@ -0,0 +1,140 @@
+# careconnect/middleware.py
+import functools
+import json
+import logging
+import time
+from asgiref.local import Local
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db.backends.utils import CursorWrapper
+from django.template.backends.django import Template
+
+logger = logging.getLogger(__name__)
+
+# Also seen by sync code the request runs through sync_to_async
+_local = Local()
+
+
+class QueryBudgetExceeded(Exception):
+    """Raised when REQUEST_METRICS_RAISE is set and a view issues more queries than its budget"""
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.queries = 0
+        self.sql_time = 0.0
+        self.template_time = 0.0
+
+
+def _timed_execute(execute_with_wrappers):
+    # Patched onto CursorWrapper rather than added with connection.execute_wrapper, whose
+    # connection is per thread: an async request runs its sync views' queries on another thread
+    @functools.wraps(execute_with_wrappers)
+    def wrapper(self, sql, params, many, executor):
+        metrics = getattr(_local, 'metrics', None)
+        if metrics is None:
+            return execute_with_wrappers(self, sql, params, many, executor)
+        start = time.perf_counter()
+        try:
+            return execute_with_wrappers(self, sql, params, many, executor)
+        finally:
+            metrics.sql_time += time.perf_counter() - start
+            metrics.queries += 1
+    wrapper._request_metrics = True
+    return wrapper
+
+
+def _timed_render(render):
+    @functools.wraps(render)
+    def wrapper(self, *args, **kwargs):
+        metrics = getattr(_local, 'metrics', None)
+        if metrics is None:
+            return render(self, *args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return render(self, *args, **kwargs)
+        finally:
+            metrics.template_time += time.perf_counter() - start
+    wrapper._request_metrics = True
+    return wrapper
+
+
+class RequestMetricsMiddleware:
+    """
+    Record query count, SQL time, template render time and wall time per request,
+    keyed by URL name. Metrics are logged as JSON, sent to staff as a Server-Timing
+    header, and checked against REQUEST_METRICS_BUDGETS.
+
+    Removed from the middleware chain entirely unless REQUEST_METRICS_ENABLED is set.
+    Runs in async chains too, so async views such as chatbot_stream are not moved
+    onto a thread. A streamed response is measured up to its first byte.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'REQUEST_METRICS_ENABLED', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+        if not getattr(Template.render, '_request_metrics', False):
+            Template.render = _timed_render(Template.render)
+        if not getattr(CursorWrapper._execute_with_wrappers, '_request_metrics', False):
+            CursorWrapper._execute_with_wrappers = _timed_execute(CursorWrapper._execute_with_wrappers)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        metrics = RequestMetrics()
+        _local.metrics = metrics
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _local.metrics = None
+        return self.finish(request, response, metrics, time.perf_counter() - start)
+
+    async def __acall__(self, request):
+        metrics = RequestMetrics()
+        _local.metrics = metrics
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _local.metrics = None
+        return self.finish(request, response, metrics, time.perf_counter() - start)
+
+    def finish(self, request, response, metrics, wall_time):
+        """Log the request's metrics, add Server-Timing for staff and check the query budget"""
+        match = getattr(request, 'resolver_match', None)
+        view_name = match.view_name if match else None
+        record = {
+            'view': view_name,
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'queries': metrics.queries,
+            'sql_ms': round(metrics.sql_time * 1000, 2),
+            'template_ms': round(metrics.template_time * 1000, 2),
+            'wall_ms': round(wall_time * 1000, 2),
+        }
+        logger.info(json.dumps(record))
+
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_staff:
+            response['Server-Timing'] = ', '.join([
+                f'sql;dur={record["sql_ms"]};desc="{metrics.queries} queries"',
+                f'tpl;dur={record["template_ms"]}',
+                f'total;dur={record["wall_ms"]}',
+            ])
+
+        budget = getattr(settings, 'REQUEST_METRICS_BUDGETS', {}).get(view_name)
+        if budget is not None and metrics.queries > budget:
+            message = f"{view_name} issued {metrics.queries} queries (budget {budget})"
+            if getattr(settings, 'REQUEST_METRICS_RAISE', False):
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+
+        return response
@@ -0,0 +1,85 @@
+# careconnect/sessions.py
+"""
+Session engine that keeps anonymous sessions in a signed cookie.
+
+Most visitors to anonymous pages such as the landing page never log in, and
+their sessions hold nothing worth a database row. With SESSION_ENGINE set to
+this module, a session lives in the session cookie itself, signed like
+django.contrib.sessions.backends.signed_cookies, until it needs the server:
+
+- once someone logs in (the session holds an authenticated user id), or
+- once its signed form outgrows SESSION_COOKIE_MAX_SIZE bytes.
+
+From then on it is stored by SESSION_SERVER_ENGINE, normally cached_db over
+the 'sessions' cache, and the cookie carries only its key. Logging out
+flushes the server copy and the visitor starts again with a cookie session.
+Signed keys contain ':' and server keys never do, which is how a cookie is
+told apart on the way in.
+
+Logging in always moves the data to a fresh server key, so a session id fixed
+before login is never reused after it.
+"""
+from importlib import import_module
+from django.conf import settings
+from django.contrib.auth import SESSION_KEY
+from django.contrib.sessions.backends.base import SessionBase
+from django.contrib.sessions.backends.signed_cookies import SessionStore as CookieStore
+
+
+def server_engine():
+    return import_module(getattr(settings, 'SESSION_SERVER_ENGINE', 'django.contrib.sessions.backends.cached_db'))
+
+
+def is_cookie_key(session_key):
+    return bool(session_key) and ':' in session_key
+
+
+class SessionStore(SessionBase):
+    def load(self):
+        if is_cookie_key(self.session_key):
+            data = CookieStore(self.session_key).load()
+            if not data:
+                # Tampered with or expired; start over
+                self._session_key = None
+            return data
+        store = server_engine().SessionStore(self.session_key)
+        data = store.load()
+        self._session_key = store.session_key
+        return data
+
+    def exists(self, session_key):
+        return not is_cookie_key(session_key) and server_engine().SessionStore().exists(session_key)
+
+    def create(self):
+        # A new session starts out as a cookie, and gets a new server key if it ever needs one
+        self._session_key = None
+        self.modified = True
+
+    def save(self, must_create=False):
+        data = self._get_session(no_load=must_create)
+        on_server = self.session_key is not None and not is_cookie_key(self.session_key)
+        if not on_server and SESSION_KEY not in data:
+            cookie = CookieStore()
+            cookie._session_cache = data
+            cookie.save()
+            if len(cookie.session_key) <= getattr(settings, 'SESSION_COOKIE_MAX_SIZE', 2048):
+                self._session_key = cookie.session_key
+                return
+
+        store = server_engine().SessionStore(self.session_key if on_server else None)
+        store._session_cache = data
+        if on_server:
+            store.save(must_create=must_create)
+        else:
+            store.create()
+        self._session_key = store.session_key
+
+    def delete(self, session_key=None):
+        if session_key is None:
+            session_key = self.session_key
+        if session_key and not is_cookie_key(session_key):
+            server_engine().SessionStore(session_key).delete()
+
+    @classmethod
+    def clear_expired(cls):
+        server_engine().SessionStore.clear_expired()
@@ -34,8 +34,81 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'careconnect.middleware.RequestMetricsMiddleware',
 ]
 
+# Request metrics (query count, SQL/template/wall time per URL name)
+# Disabled by default; the middleware removes itself when this is off
+REQUEST_METRICS_ENABLED = os.getenv('DJANGO_REQUEST_METRICS', 'False') == 'True'
+# Raise QueryBudgetExceeded instead of logging a warning (used by the test suite)
+REQUEST_METRICS_RAISE = False
+# Maximum queries per view, keyed by URL name
+REQUEST_METRICS_BUDGETS = {
+    'users:dashboard': 3,
+    'users:test_history': 5,
+    'users:test_history_page': 4,
+    'users:test_detail': 6,
+    'users:report': 8,
+    'users:admin_analytics': 8,
+    'users:mood_tracking': 5,
+    'users:mood_history': 4,
+    'users:chatbot': 10,
+    'users:chat_messages': 4,
+    'users:chat_history_page': 4,
+    'users:resource_click': 6,
+    'meditation:meditation_page': 8,
+    'games:games_list': 3,
+    'games:leaderboard': 4,
+}
+
+# Game leaderboards are served from memory; see games/leaderboards.py
+LEADERBOARD_SIZE = 10
+# Seconds between writes of daily/weekly bests to the database
+LEADERBOARD_FLUSH_INTERVAL = 30
+# Seconds before a board is reloaded to pick up scores from other processes
+LEADERBOARD_REFRESH_INTERVAL = 60
+
+# Streamed chatbot replies; see users/chat_backends.py
+# 'canned' replays the matched intent's reply, 'openai' streams a completion from the
+# OpenAI API or a compatible server at CHATBOT_OPENAI_BASE_URL
+CHATBOT_BACKEND = os.getenv('CHATBOT_BACKEND', 'canned')
+# Seconds between words of a canned reply, to stand in for a slow model
+CHATBOT_CANNED_DELAY = 0
+CHATBOT_OPENAI_MODEL = os.getenv('CHATBOT_OPENAI_MODEL', 'gpt-3.5-turbo')
+# e.g. http://127.0.0.1:8001/v1 for `manage.py chatbot_standin`; None means api.openai.com
+CHATBOT_OPENAI_BASE_URL = os.getenv('CHATBOT_OPENAI_BASE_URL') or None
+OPENAI_API_KEY = os.getenv('OPENAI_API_KEY', '')
+CHATBOT_MAX_TOKENS = 300
+# Seconds allowed to connect to the backend and between streamed chunks
+CHATBOT_BACKEND_TIMEOUT = 10
+# Seconds after which a reply is cut off
+CHATBOT_REPLY_TIMEOUT = 30
+# Pooled backend connections per process and event loop
+CHATBOT_BACKEND_MAX_CONNECTIONS = 100
+# Model replies cached per (intent, earlier severity) in each process, and for how many seconds
+CHATBOT_RESPONSE_CACHE_SIZE = 256
+CHATBOT_RESPONSE_CACHE_TTL = 60 * 60
+
+# Chatbot sidebar resources are ranked in memory; see users/resources.py
+# Seconds before the catalog is rebuilt to pick up new clicks and other processes' edits
+RESOURCE_CATALOG_REFRESH_INTERVAL = 5 * 60
+# Days of engagement rollups that click-through rates are computed over
+RESOURCE_RANKING_WINDOW_DAYS = 30
+
+# Resource clicks are buffered in memory and written in batches; see users/clicks.py
+# False writes each click as it happens
+CLICK_BUFFER_ENABLED = True
+# A batch is written once this many clicks are waiting...
+CLICK_FLUSH_BATCH_SIZE = 100
+# ...or the oldest has waited this many milliseconds
+CLICK_FLUSH_INTERVAL_MS = 1000
+# Clicks held per process before the endpoint pushes back with 429s
+CLICK_BUFFER_MAX_SIZE = 10000
+# Milliseconds a click waits for room in a full buffer
+CLICK_BUFFER_BLOCK_MS = 50
+# Directory for per-process spool files that keep unwritten clicks across crashes (None keeps them in memory only)
+CLICK_SPOOL_DIR = os.getenv('DJANGO_CLICK_SPOOL_DIR') or None
+
 ROOT_URLCONF = 'careconnect.urls'
 # Templates
 TEMPLATES = [
@@ -61,9 +134,40 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # A file (not in-memory) test database so concurrency tests can open several connections
+        'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
     }
 }
 
+# Caches
+# Session storage: 'locmem' suits a single process such as runserver; 'file' is shared by every
+# worker process on the host, which cached_db needs so a logout in one worker reaches the others
+SESSION_CACHE = os.getenv('DJANGO_SESSION_CACHE', 'file')
+CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'sessions': {
+        'locmem': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'sessions'},
+        'file': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': BASE_DIR / '.cache' / 'sessions',
+            'OPTIONS': {'MAX_ENTRIES': 50000},
+        },
+    }[SESSION_CACHE],
+}
+
+# Sessions; see careconnect/sessions.py
+# Anonymous sessions live in a signed cookie and only move to SESSION_STORAGE once someone
+# logs in or they outgrow SESSION_COOKIE_MAX_SIZE bytes
+SESSION_ENGINE = 'careconnect.sessions'
+SESSION_COOKIE_MAX_SIZE = 2048
+# 'cached_db' reads sessions from the 'sessions' cache and writes them through to django_session;
+# 'cache' keeps them in that cache only; 'db' reads and writes django_session on every request
+SESSION_STORAGE = os.getenv('DJANGO_SESSION_STORAGE', 'cached_db')
+SESSION_SERVER_ENGINE = f'django.contrib.sessions.backends.{SESSION_STORAGE}'
+SESSION_CACHE_ALIAS = 'sessions'
+# Flash messages travel in their own cookie instead of being written to the session
+MESSAGE_STORAGE = 'django.contrib.messages.storage.cookie.CookieStorage'
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator'},
@@ -86,6 +190,20 @@ STATICFILES_DIRS = [
 ]
 STATIC_ROOT = BASE_DIR / "staticfiles"  # For production, collect static files here
 
+# User uploads (coloring-game drawings and their thumbnails)
+MEDIA_URL = '/media/'
+MEDIA_ROOT = BASE_DIR / 'media'
+DRAWING_MAX_BYTES = 5 * 1024 * 1024
+DRAWING_MAX_PIXELS = 4096 * 4096  # Declared width x height; decoding costs memory per pixel
+DRAWING_THUMBNAIL_SIZE = (240, 240)
+DRAWING_THUMBNAIL_WORKERS = 2
+
+# In-game telemetry is appended to gzip segments here, one directory per day
+TELEMETRY_ROOT = BASE_DIR / 'telemetry'
+TELEMETRY_MAX_BATCH = 500
+# Segments are compacted once their hour has been closed for this long
+TELEMETRY_COMPACTION_DELAY = 60 * 60
+
 # Custom user model
 AUTH_USER_MODEL = 'users.CustomUser'
 
@@ -94,6 +212,15 @@ LOGIN_URL = 'users:login'
 LOGOUT_REDIRECT_URL = 'users:landpage'
 LOGIN_REDIRECT_URL = 'users:dashboard'  
 AUTHENTICATION_BACKENDS = [
-    'users.auth_backends.EmailAuthBackend',  # Custom authentication backend
-    'django.contrib.auth.backends.ModelBackend',  # Default backend
-]
\ No newline at end of file
+    'users.auth_backends.EmailAuthBackend',  # Email login, cached request.user, ModelBackend permissions
+    'django.contrib.auth.backends.ModelBackend',  # Keeps sessions that logged in through it valid
+]
+# request.user is served from a per-process LRU (and optionally a shared cache); see users/auth_backends.py
+AUTH_USER_CACHE_ENABLED = True
+AUTH_USER_CACHE_SIZE = 1024
+# Seconds a cached user lives: the delay before changes that skip signals apply, or changes from
+# other processes when there is no AUTH_USER_CACHE_ALIAS
+AUTH_USER_CACHE_TTL = 60
+# A CACHES alias shared by every process, e.g. a memcached or redis cache, which also carries the
+# version stamps that tell every process a user was saved; None keeps users per process
+AUTH_USER_CACHE_ALIAS = None
\ No newline at end of file
@@ -0,0 +1,42 @@
+# careconnect/testing.py
+"""
+Test helpers shared by the apps' test suites.
+"""
+import threading
+from django.db import connection
+from django.test import TransactionTestCase
+
+
+class ConcurrentTestCase(TransactionTestCase):
+    """
+    For code that touches the database from several threads at once. Each
+    thread opens its own connection, so data must be committed and the test
+    database must be a file: these tests are skipped on in-memory SQLite.
+    """
+
+    def setUp(self):
+        super().setUp()
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest('Threads cannot share an in-memory SQLite test database')
+
+    def run_concurrently(self, target, threads):
+        """Call target(index) from threads threads released together, returning the exceptions they raised"""
+        barrier = threading.Barrier(threads)
+        errors = []
+
+        def run(index):
+            try:
+                barrier.wait()
+                target(index)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                # Threads' connections are not closed by the test runner
+                connection.close()
+
+        workers = [threading.Thread(target=run, args=(i,)) for i in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        return errors
@@ -0,0 +1,240 @@
+# games/drawings.py
+"""
+Content-addressed storage for coloring-game drawings.
+
+Uploads are streamed from the request in fixed-size chunks into a temporary
+file while being hashed, so memory per upload stays constant whatever the
+image size. Uploads whose PNG header declares more than DRAWING_MAX_PIXELS are
+rejected before the rest is read, since decoding one costs memory in
+proportion to its pixels, not its bytes. The finished file is moved to drawings/<sha256>.png, or discarded
+when a file with the same hash is already stored. Thumbnails are made by a
+small thread pool after the Drawing row commits, and the per-user gallery
+(thumbnail URLs only) is cached until the user's drawings change.
+"""
+import base64
+import hashlib
+import logging
+import os
+import struct
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from .models import Drawing
+
+try:
+    from PIL import Image
+except ImportError:  # Drawings are still stored, just without thumbnails
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+GALLERY_CACHE_TIMEOUT = 60 * 60
+# A data URL header ("data:image/png;base64,") must appear within this many bytes of a JSON body
+DATA_URL_MAX_PREFIX = 1024
+
+_pool = None
+
+
+class DrawingError(ValueError):
+    """The upload is not a PNG drawing we can store"""
+
+
+class DrawingTooLarge(DrawingError):
+    """The upload is bigger than DRAWING_MAX_BYTES or DRAWING_MAX_PIXELS"""
+
+
+def _read_chunks(stream):
+    while True:
+        chunk = stream.read(CHUNK_SIZE)
+        if not chunk:
+            return
+        yield chunk
+
+
+def _decode_data_url(chunks):
+    """Stream-decode the base64 payload of a {"image": "data:image/png;base64,..."} JSON body"""
+    buffer = b''
+    for chunk in chunks:
+        buffer += chunk
+        marker = buffer.find(b'base64,')
+        if marker != -1:
+            buffer = buffer[marker + len(b'base64,'):]
+            break
+        if len(buffer) > DATA_URL_MAX_PREFIX:
+            raise DrawingError('Expected an image data URL')
+    else:
+        raise DrawingError('Expected an image data URL')
+
+    pending = b''
+    for chunk in _prepend(buffer, chunks):
+        end = chunk.find(b'"')
+        pending += chunk if end == -1 else chunk[:end]
+        # Only decode whole 4-character base64 groups
+        usable = len(pending) - len(pending) % 4
+        try:
+            yield base64.b64decode(pending[:usable], validate=True)
+        except ValueError:
+            raise DrawingError('Invalid base64 image data')
+        pending = pending[usable:]
+        if end != -1:
+            break
+    if pending:
+        raise DrawingError('Truncated base64 image data')
+
+
+def _prepend(first, chunks):
+    yield first
+    yield from chunks
+
+
+def upload_chunks(request):
+    """Yield the raw PNG bytes of a save_drawing request, either a PNG body or a JSON data URL"""
+    chunks = _read_chunks(request)
+    if request.content_type == 'application/json':
+        return _decode_data_url(chunks)
+    return chunks
+
+
+def _png_size(header):
+    """(width, height) from the IHDR chunk that starts every PNG file"""
+    if len(header) < 24 or not header.startswith(PNG_SIGNATURE) or header[12:16] != b'IHDR':
+        raise DrawingError('Drawings must be PNG images')
+    return struct.unpack('>II', header[16:24])
+
+
+def _max_pixels():
+    return getattr(settings, 'DRAWING_MAX_PIXELS', 4096 * 4096)
+
+
+def image_name(sha256):
+    return f'drawings/{sha256[:2]}/{sha256}.png'
+
+
+def thumbnail_name(sha256):
+    return f'drawings/thumbs/{sha256[:2]}/{sha256}.png'
+
+
+def _gallery_key(user_id):
+    return f'drawing_gallery:{user_id}'
+
+
+def store_drawing(user, chunks):
+    """
+    Write an uploaded drawing to disk and record it, returning (drawing, created).
+    Raises DrawingTooLarge or DrawingError without leaving anything behind.
+    """
+    max_bytes = getattr(settings, 'DRAWING_MAX_BYTES', 5 * 1024 * 1024)
+    max_pixels = _max_pixels()
+    os.makedirs(settings.MEDIA_ROOT, exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+    header = b''
+
+    handle = tempfile.NamedTemporaryFile(dir=settings.MEDIA_ROOT, prefix='upload-', delete=False)
+    try:
+        with handle:
+            for chunk in chunks:
+                size += len(chunk)
+                if size > max_bytes:
+                    raise DrawingTooLarge(f'Drawings are limited to {max_bytes // 1024} KB')
+                if len(header) < 24:
+                    header += chunk[:24 - len(header)]
+                    if len(header) == 24:
+                        width, height = _png_size(header)
+                        if width * height > max_pixels:
+                            raise DrawingTooLarge(f'Drawings are limited to {max_pixels:,} pixels')
+                digest.update(chunk)
+                handle.write(chunk)
+        width, height = _png_size(header)
+
+        sha256 = digest.hexdigest()
+        name = image_name(sha256)
+        path = default_storage.path(name)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(handle.name, path)
+    finally:
+        if os.path.exists(handle.name):
+            os.remove(handle.name)
+
+    with transaction.atomic():
+        drawing, created = Drawing.objects.get_or_create(
+            user=user,
+            sha256=sha256,
+            defaults={
+                'image': name,
+                'size': size,
+                'width': width,
+                'height': height,
+                'thumbnail': thumbnail_name(sha256) if default_storage.exists(thumbnail_name(sha256)) else '',
+            }
+        )
+        if created:
+            cache.delete(_gallery_key(user.id))
+            if not drawing.thumbnail:
+                transaction.on_commit(lambda: thumbnail_pool().submit(_thumbnail_job, sha256))
+    return drawing, created
+
+
+def thumbnail_pool():
+    global _pool
+    if _pool is None:
+        _pool = ThreadPoolExecutor(
+            max_workers=getattr(settings, 'DRAWING_THUMBNAIL_WORKERS', 2),
+            thread_name_prefix='drawing-thumbnails',
+        )
+    return _pool
+
+
+def generate_thumbnail(sha256):
+    """Make the thumbnail for a stored image and attach it to every drawing with that hash"""
+    name = thumbnail_name(sha256)
+    if Image is not None and not default_storage.exists(name):
+        path = default_storage.path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Refuse to decode anything store_drawing would have rejected
+        Image.MAX_IMAGE_PIXELS = _max_pixels()
+        with Image.open(default_storage.path(image_name(sha256))) as image:
+            image.thumbnail(getattr(settings, 'DRAWING_THUMBNAIL_SIZE', (240, 240)))
+            tmp_path = f'{path}.tmp'
+            image.save(tmp_path, format='PNG', optimize=True)
+        os.replace(tmp_path, path)
+    if not default_storage.exists(name):
+        return
+
+    drawings = Drawing.objects.filter(sha256=sha256, thumbnail='')
+    user_ids = list(drawings.values_list('user_id', flat=True))
+    drawings.update(thumbnail=name)
+    cache.delete_many([_gallery_key(user_id) for user_id in user_ids])
+
+
+def _thumbnail_job(sha256):
+    try:
+        generate_thumbnail(sha256)
+    except Exception:
+        logger.exception('Thumbnail generation failed for drawing %s', sha256)
+    finally:
+        # Pool threads get their own connection; don't leave it open between jobs
+        connection.close()
+
+
+def get_gallery(user_id):
+    """The user's drawings as [{'id', 'thumbnail', 'created_at'}], newest first; thumbnail is None while pending"""
+    gallery = cache.get(_gallery_key(user_id))
+    if gallery is None:
+        gallery = [
+            {
+                'id': drawing_id,
+                'thumbnail': default_storage.url(thumbnail) if thumbnail else None,
+                'created_at': created_at.isoformat(),
+            }
+            for drawing_id, thumbnail, created_at in Drawing.objects.filter(user_id=user_id)
+                                                                  .values_list('id', 'thumbnail', 'created_at')
+        ]
+        cache.set(_gallery_key(user_id), gallery, GALLERY_CACHE_TIMEOUT)
+    return gallery
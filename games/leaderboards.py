@@ -0,0 +1,282 @@
+# games/leaderboards.py
+"""
+In-process leaderboards for each game, all-time, daily and weekly.
+
+A board holds every player's best score in a list kept sorted by score, so
+the top N is a slice and a player's rank is a binary search. Boards are loaded
+from the database the first time they are used, updated in memory whenever a
+game beats a player's best, and reloaded after LEADERBOARD_REFRESH_INTERVAL
+seconds so scores recorded by other processes show up. Database reads and
+writes happen outside the module lock, so a board loading only holds up
+requests for that same board.
+
+All-time boards are backed by GameProgress.high_score, which is written
+atomically with every game. Daily and weekly bests are written to
+LeaderboardEntry at most every LEADERBOARD_FLUSH_INTERVAL seconds; bests not
+yet flushed when a process exits can be recovered with rebuild_leaderboards.
+"""
+import bisect
+import logging
+import threading
+import time
+from datetime import timedelta
+from functools import reduce
+from operator import or_
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Max, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from users.models import CustomUser
+from .models import GameProgress, GameSession, LeaderboardEntry
+
+PERIODS = ['all', 'day', 'week']
+
+logger = logging.getLogger(__name__)
+
+# Guards _boards and the boards in it; never held across a database query
+_lock = threading.Lock()
+_boards = {}  # (game_id, period, period_start) -> Leaderboard
+_load_locks = {}  # (game_id, period, period_start) -> Lock held while that board loads
+_last_flush = time.monotonic()
+
+
+def period_start(period, day=None):
+    """The first day of the period containing day (today by default), or None for all-time"""
+    day = day or timezone.localdate()
+    if period == 'day':
+        return day
+    if period == 'week':
+        return day - timedelta(days=day.weekday())
+    return None
+
+
+class Leaderboard:
+    def __init__(self, scores, names):
+        self.best = dict(scores)  # user_id -> best score
+        self.entries = sorted((-score, user_id) for user_id, score in self.best.items())
+        self.names = names
+        self.dirty = set()  # Users whose best has not been written to the database yet
+        self.loaded_at = time.monotonic()
+
+    def submit(self, user_id, score):
+        """Record a score, returning True if it is the user's new best"""
+        previous = self.best.get(user_id)
+        if previous is not None:
+            if score <= previous:
+                return False
+            del self.entries[bisect.bisect_left(self.entries, (-previous, user_id))]
+        bisect.insort(self.entries, (-score, user_id))
+        self.best[user_id] = score
+        self.dirty.add(user_id)
+        return True
+
+    def top(self, limit):
+        """[(rank, user_id, score)] for the best players; tied scores share a rank"""
+        rows = []
+        for index, (negative_score, user_id) in enumerate(self.entries[:limit]):
+            rank = rows[-1][0] if rows and rows[-1][2] == -negative_score else index + 1
+            rows.append((rank, user_id, -negative_score))
+        return rows
+
+    def rank(self, user_id):
+        """The user's 1-based rank, or None if they have no score on this board"""
+        score = self.best.get(user_id)
+        if score is None:
+            return None
+        return bisect.bisect_left(self.entries, (-score,)) + 1
+
+
+def _load(game_id, period, start):
+    if period == 'all':
+        rows = GameProgress.objects.filter(game_id=game_id)\
+                                   .values_list('user_id', 'user__name', 'high_score')
+    else:
+        rows = LeaderboardEntry.objects.filter(game_id=game_id, period=period, period_start=start)\
+                                       .values_list('user_id', 'user__name', 'score')
+    scores, names = {}, {}
+    for user_id, name, score in rows:
+        scores[user_id] = score
+        names[user_id] = name
+    return Leaderboard(scores, names)
+
+
+def _board(game_id, period):
+    """
+    Return the current board for a game and period, loading or refreshing it as needed.
+    Only requests for the same board wait for the load; the others keep using theirs.
+    """
+    key = (game_id, period, period_start(period))
+    refresh = getattr(settings, 'LEADERBOARD_REFRESH_INTERVAL', 60)
+    with _lock:
+        board = _boards.get(key)
+        if board is not None and time.monotonic() - board.loaded_at <= refresh:
+            return board
+        load_lock = _load_locks.setdefault(key, threading.Lock())
+
+    with load_lock:
+        with _lock:
+            board = _boards.get(key)
+            if board is not None and time.monotonic() - board.loaded_at <= refresh:
+                return board  # Loaded by another request while this one waited
+        loaded = _load(*key)
+        with _lock:
+            old = _boards.get(key)
+            if old is not None:
+                # Scores submitted since the old board was loaded may not be in the rows read
+                for user_id in old.dirty:
+                    loaded.submit(user_id, old.best[user_id])
+            _boards[key] = loaded
+            # Drop finished days and weeks once their bests are written
+            finished = [k for k, b in _boards.items() if k[1] != 'all' and k[2] != period_start(k[1]) and not b.dirty]
+            for stale in finished:
+                del _boards[stale]
+                _load_locks.pop(stale, None)
+        return loaded
+
+
+def _flush():
+    """Write dirty daily and weekly bests to LeaderboardEntry, never lowering a stored score"""
+    global _last_flush
+    with _lock:
+        _last_flush = time.monotonic()
+        pending = {
+            key: {user_id: board.best[user_id] for user_id in board.dirty}
+            for key, board in _boards.items()
+            if key[1] != 'all' and board.dirty
+        }
+        for key in pending:
+            _boards[key].dirty.clear()
+    if not pending:
+        return 0
+
+    try:
+        # Another process may have stored a higher score since this board was loaded
+        stored = LeaderboardEntry.objects.filter(reduce(or_, [
+            Q(game_id=game_id, period=period, period_start=start, user_id__in=scores)
+            for (game_id, period, start), scores in pending.items()
+        ])).values_list('game_id', 'period', 'period_start', 'user_id', 'score')
+        for game_id, period, start, user_id, score in stored:
+            scores = pending[(game_id, period, start)]
+            scores[user_id] = max(scores[user_id], score)
+
+        LeaderboardEntry.objects.bulk_create(
+            [
+                LeaderboardEntry(game_id=game_id, period=period, period_start=start, user_id=user_id, score=score)
+                for (game_id, period, start), scores in pending.items()
+                for user_id, score in scores.items()
+            ],
+            update_conflicts=True,
+            unique_fields=['game', 'period', 'period_start', 'user'],
+            update_fields=['score', 'updated_at'],
+        )
+    except Exception:
+        with _lock:
+            # Still pending; a board dropped meanwhile is recovered by rebuild_leaderboards
+            for key, scores in pending.items():
+                if key in _boards:
+                    _boards[key].dirty.update(scores)
+        raise
+    return sum(len(scores) for scores in pending.values())
+
+
+def record_score(game_id, user_id, score):
+    """
+    Fold a finished game into the game's boards; called once the game's transaction
+    commits, so a failure is logged rather than turning the saved game into an error.
+    """
+    try:
+        for period in PERIODS:
+            board = _board(game_id, period)
+            with _lock:
+                board.submit(user_id, score)
+        if time.monotonic() - _last_flush > getattr(settings, 'LEADERBOARD_FLUSH_INTERVAL', 30):
+            _flush()
+    except Exception:
+        logger.exception('Could not add score %s of user %s to the boards of game %s', score, user_id, game_id)
+
+
+def flush():
+    """Persist pending daily and weekly bests now, returning how many were written"""
+    return _flush()
+
+
+def clear_cache():
+    """Forget every in-process board without persisting it"""
+    with _lock:
+        _boards.clear()
+        _load_locks.clear()
+
+
+def get_leaderboard(game_id, period='all', user_id=None, limit=None):
+    """
+    Return {'top': [{'rank', 'user_id', 'name', 'score'}], 'me': {'rank', 'score'} or None}.
+    Names of players who joined the board since it was loaded are fetched in one query.
+    """
+    limit = limit or getattr(settings, 'LEADERBOARD_SIZE', 10)
+    board = _board(game_id, period)
+    with _lock:
+        top = board.top(limit)
+        missing = [uid for _, uid, _ in top if uid not in board.names]
+        me = None
+        if user_id is not None and user_id in board.best:
+            me = {'rank': board.rank(user_id), 'score': board.best[user_id]}
+    if missing:
+        names = dict(CustomUser.objects.filter(id__in=missing).values_list('id', 'name'))
+        with _lock:
+            board.names.update(names)
+    return {
+        'top': [
+            {'rank': rank, 'user_id': uid, 'name': board.names.get(uid), 'score': score}
+            for rank, uid, score in top
+        ],
+        'me': me,
+    }
+
+
+def rebuild():
+    """
+    Recompute GameProgress and every daily and weekly LeaderboardEntry from the
+    full GameSession history, returning (progress rows, leaderboard rows).
+    """
+    progress = GameSession.objects.values('user_id', 'game_id').annotate(
+        best=Max('score'),
+        sessions=Count('id'),
+        duration=Sum('duration'),
+    ).order_by()
+    GameProgress.objects.bulk_create(
+        [
+            GameProgress(
+                user_id=row['user_id'],
+                game_id=row['game_id'],
+                high_score=row['best'],
+                total_sessions=row['sessions'],
+                total_duration=row['duration'] or 0,
+            )
+            for row in progress
+        ],
+        batch_size=500,
+        update_conflicts=True,
+        unique_fields=['user', 'game'],
+        update_fields=['high_score', 'total_sessions', 'total_duration'],
+    )
+
+    # Daily bests in one grouped query; weekly bests are the max over each week's days
+    entries = {}
+    daily = GameSession.objects.annotate(day=TruncDate('played_at'))\
+                               .values('game_id', 'user_id', 'day')\
+                               .annotate(best=Max('score'))\
+                               .order_by()
+    for row in daily.iterator(chunk_size=2000):
+        for period in ['day', 'week']:
+            key = (row['game_id'], period, period_start(period, row['day']), row['user_id'])
+            if key not in entries or entries[key].score < row['best']:
+                entries[key] = LeaderboardEntry(
+                    game_id=key[0], period=period, period_start=key[2], user_id=key[3], score=row['best']
+                )
+
+    with transaction.atomic():
+        LeaderboardEntry.objects.all().delete()
+        LeaderboardEntry.objects.bulk_create(entries.values(), batch_size=500)
+    clear_cache()
+    return len(progress), len(entries)
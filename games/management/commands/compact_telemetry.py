@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from games.telemetry import compact
+
+class Command(BaseCommand):
+    help = 'Folds closed game telemetry segments into per-session aggregates on GameSession (run periodically)'
+
+    def handle(self, *args, **options):
+        summary = compact()
+        self.stdout.write(self.style.SUCCESS(
+            f"Compacted {summary['segments']} segments ({summary['events']} events) into "
+            f"{summary['sessions']} game sessions; {summary['unmatched']} plays had no matching session, "
+            f"{summary['skipped']} events were out of range"
+        ))
+        if summary['failed']:
+            self.stdout.write(self.style.WARNING(f"{summary['failed']} segments could not be compacted"))
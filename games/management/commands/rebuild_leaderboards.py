@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+from games.leaderboards import rebuild
+
+class Command(BaseCommand):
+    help = 'Rebuilds game progress and the daily and weekly leaderboards from the full GameSession history'
+
+    def handle(self, *args, **options):
+        progress_count, entry_count = rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt {progress_count} progress rows and {entry_count} leaderboard entries"
+        ))
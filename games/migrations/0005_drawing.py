@@ -0,0 +1,36 @@
+# Generated by Django 5.0.2 on 2026-10-17 04:41
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('games', '0004_leaderboardentry'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Drawing',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sha256', models.CharField(max_length=64)),
+                ('image', models.FileField(upload_to='')),
+                ('thumbnail', models.FileField(blank=True, upload_to='')),
+                ('size', models.PositiveIntegerField(help_text='Size in bytes')),
+                ('width', models.PositiveIntegerField(default=0)),
+                ('height', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='drawings', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['sha256'], name='games_drawi_sha256_cb2ec1_idx'), models.Index(fields=['user', 'created_at'], name='games_drawi_user_id_9a1455_idx')],
+                'unique_together': {('user', 'sha256')},
+            },
+        ),
+    ]
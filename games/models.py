@@ -1,5 +1,7 @@
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.db.models.functions import Greatest
 from django.conf import settings
+from django.utils import timezone
 
 class Game(models.Model):
     GAME_TYPES = [
@@ -32,14 +34,50 @@ class GameSession(models.Model):
     score = models.IntegerField(default=0)
     duration = models.IntegerField(default=0)  # Duration in seconds
     completed = models.BooleanField(default=False)
-    played_at = models.DateTimeField(auto_now_add=True)
+    played_at = models.DateTimeField(default=timezone.now)
+    # Client-generated id tying in-game telemetry events to this session
+    play_id = models.UUIDField(null=True, blank=True, unique=True)
+    # Telemetry aggregates, folded in by compact_telemetry
+    event_count = models.PositiveIntegerField(default=0)
+    event_counts = models.JSONField(default=dict, blank=True)  # Event type -> count
+    paused_ms = models.PositiveIntegerField(default=0)
 
     class Meta:
         ordering = ['-played_at']
+        indexes = [
+            models.Index(fields=['user', 'game', 'played_at']),
+        ]
 
     def __str__(self):
         return f"{self.user.email} - {self.game.name} ({self.played_at})"
 
+    @classmethod
+    def record(cls, user_id, game_id, score, duration=0, completed=True, play_id=None):
+        """Save a played game and fold it into the player's progress in one short transaction"""
+        try:
+            with transaction.atomic():
+                # Insert first so the hot progress row is locked only for the final UPDATE
+                session = cls.objects.create(
+                    user_id=user_id,
+                    game_id=game_id,
+                    score=score,
+                    duration=duration,
+                    completed=completed,
+                    play_id=play_id,
+                )
+                GameProgress.record_session(session)
+                from .leaderboards import record_score
+                transaction.on_commit(lambda: record_score(game_id, user_id, score))
+        except IntegrityError:
+            if play_id is None:
+                raise
+            # The client retried a play it already reported; anything else is a real error
+            existing = cls.objects.filter(play_id=play_id, user_id=user_id).first()
+            if existing is None:
+                raise
+            return existing
+        return session
+
 class GameProgress(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     game = models.ForeignKey(Game, on_delete=models.CASCADE)
@@ -50,6 +88,89 @@ class GameProgress(models.Model):
 
     class Meta:
         unique_together = ['user', 'game']
+        indexes = [
+            models.Index(fields=['game', '-high_score']),
+        ]
 
     def __str__(self):
         return f"{self.user.email} - {self.game.name} (High Score: {self.high_score})"
+
+    @classmethod
+    def record_session(cls, session):
+        """Add a game session to the (user, game) progress row with a single UPDATE, creating it if needed"""
+        progress = cls.objects.filter(user_id=session.user_id, game_id=session.game_id)
+        # update() skips auto_now, so last_played is set explicitly
+        increment = {
+            'high_score': Greatest('high_score', models.Value(session.score)),
+            'total_sessions': models.F('total_sessions') + 1,
+            'total_duration': models.F('total_duration') + session.duration,
+            'last_played': session.played_at,
+        }
+        if progress.update(**increment):
+            return
+        try:
+            with transaction.atomic():
+                cls.objects.create(
+                    user_id=session.user_id,
+                    game_id=session.game_id,
+                    high_score=session.score,
+                    total_sessions=1,
+                    total_duration=session.duration,
+                )
+        except IntegrityError:
+            # Another request created the row between our UPDATE and INSERT
+            progress.update(**increment)
+
+class LeaderboardEntry(models.Model):
+    """A player's best score for one game over a day or a week (all-time bests live on GameProgress)"""
+    PERIOD_CHOICES = [
+        ('day', 'Daily'),
+        ('week', 'Weekly'),
+    ]
+
+    game = models.ForeignKey(Game, on_delete=models.CASCADE)
+    period = models.CharField(max_length=5, choices=PERIOD_CHOICES)
+    period_start = models.DateField()  # The day, or the Monday of the week
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    score = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ['game', 'period', 'period_start', 'user']
+        indexes = [
+            models.Index(fields=['game', 'period', 'period_start', '-score']),
+        ]
+
+    def __str__(self):
+        return f"{self.user.email} - {self.game.name} {self.period} {self.period_start} ({self.score})"
+
+class Drawing(models.Model):
+    """A saved coloring-game drawing; image files are stored once per content hash"""
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='drawings')
+    sha256 = models.CharField(max_length=64)
+    image = models.FileField()
+    thumbnail = models.FileField(blank=True)  # Filled in by the background thumbnail pool
+    size = models.PositiveIntegerField(help_text='Size in bytes')
+    width = models.PositiveIntegerField(default=0)
+    height = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ['-created_at']
+        unique_together = ['user', 'sha256']
+        indexes = [
+            models.Index(fields=['sha256']),
+            models.Index(fields=['user', 'created_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.user.email} - drawing {self.sha256[:12]} ({self.created_at})"
+
+class TelemetrySegment(models.Model):
+    """A telemetry log segment that compact_telemetry has folded into GameSession"""
+    path = models.CharField(max_length=255, unique=True)  # Relative to TELEMETRY_ROOT
+    event_count = models.PositiveIntegerField(default=0)
+    compacted_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.path} ({self.event_count} events)"
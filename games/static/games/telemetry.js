@@ -0,0 +1,53 @@
+// Batches in-game events and posts them to /games/telemetry/ once per batchSize events,
+// plus whatever is left when the game finishes or the page is hidden.
+function newPlayId() {
+    if (window.crypto && crypto.randomUUID) {
+        return crypto.randomUUID();
+    }
+    return 'xxxxxxxx-xxxx-4xxx-yxxx-xxxxxxxxxxxx'.replace(/[xy]/g, function(c) {
+        const r = Math.random() * 16 | 0;
+        return (c === 'x' ? r : (r & 0x3 | 0x8)).toString(16);
+    });
+}
+
+class GameTelemetry {
+    constructor(gameId, batchSize = 20) {
+        this.gameId = gameId;
+        this.playId = newPlayId();
+        this.batchSize = batchSize;
+        this.startedAt = performance.now();
+        this.events = [];
+        window.addEventListener('pagehide', () => this.flush());
+    }
+
+    elapsed() {
+        return Math.round(performance.now() - this.startedAt);
+    }
+
+    record(type, duration) {
+        const event = {type: type, at: this.elapsed()};
+        if (duration !== undefined) {
+            event.duration = Math.round(duration);
+        }
+        this.events.push(event);
+        if (this.events.length >= this.batchSize) {
+            this.flush();
+        }
+    }
+
+    flush() {
+        if (!this.events.length) return;
+        const events = this.events;
+        this.events = [];
+        fetch('/games/telemetry/', {
+            method: 'POST',
+            keepalive: true,
+            headers: {
+                'Content-Type': 'application/json',
+                'X-CSRFToken': document.querySelector('[name=csrfmiddlewaretoken]').value
+            },
+            body: JSON.stringify({game_id: this.gameId, play_id: this.playId, events: events})
+        })
+        .catch(error => console.error('Error sending telemetry:', error));
+    }
+}
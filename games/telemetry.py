@@ -0,0 +1,216 @@
+# games/telemetry.py
+"""
+Append-only log of fine-grained in-game events (breath cycles, strokes, pauses).
+
+The telemetry endpoint validates a batch of events and appends it to a gzip
+segment as a single compressed member, without touching the database.
+Segments live in TELEMETRY_ROOT/<YYYY-MM-DD>/<HH>-<host>-<pid>.jsonl.gz: every
+process writes its own file and starts a new one each hour, so a segment is
+never written to again once its hour is over.
+
+compact_telemetry folds closed segments into the telemetry aggregates on
+GameSession, matched by the client-generated play_id. Each folded segment is
+recorded in TelemetrySegment in the same transaction, so reruns never count
+an event twice. The segments themselves are left in place as the raw log.
+"""
+import gzip
+import json
+import logging
+import os
+import socket
+import threading
+import uuid
+from collections import Counter
+from datetime import datetime, timedelta
+from django.conf import settings
+from django.db import DataError, IntegrityError, transaction
+from django.utils import timezone
+from .models import GameSession, TelemetrySegment
+
+EVENT_TYPES = {
+    'breath_cycle', 'stroke', 'color_change', 'brush_change', 'clear',
+    'match', 'miss', 'pause', 'resume',
+}
+SEGMENT_SUFFIX = '.jsonl.gz'
+# A day: far longer than any play, and small enough for every integer column
+MAX_EVENT_MS = 24 * 60 * 60 * 1000
+MAX_GAME_ID = 2 ** 31 - 1
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+
+
+class TelemetryError(ValueError):
+    """A telemetry batch that does not match the expected shape"""
+
+
+def parse_play_id(value):
+    """The UUID a client generated for one play of a game, or None if missing or malformed"""
+    try:
+        return uuid.UUID(str(value))
+    except ValueError:
+        return None
+
+
+def _milliseconds(event, field):
+    value = event.get(field, 0)
+    # NaN fails both comparisons, so it is rejected here too
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not 0 <= value <= MAX_EVENT_MS:
+        raise TelemetryError(f'{field} must be between 0 and {MAX_EVENT_MS} milliseconds')
+    return int(value)
+
+
+def _in_range(event):
+    """Whether an event read back from a segment can be folded in (older segments were validated less strictly)"""
+    duration = event.get('duration', 0)
+    return (
+        event.get('type') in EVENT_TYPES
+        and isinstance(duration, int) and not isinstance(duration, bool) and 0 <= duration <= MAX_EVENT_MS
+    )
+
+
+def parse_batch(data):
+    """
+    Validate a {'game_id', 'play_id', 'events': [{'type', 'at', 'duration'}]} payload,
+    where at and duration are milliseconds since the start of play, and return
+    (game_id, play_id, events).
+    """
+    if not isinstance(data, dict):
+        raise TelemetryError('Expected a JSON object')
+    try:
+        game_id = int(data.get('game_id'))
+    except (OverflowError, TypeError, ValueError):
+        raise TelemetryError('game_id is required')
+    if not 0 < game_id <= MAX_GAME_ID:
+        raise TelemetryError('game_id is out of range')
+    play_id = parse_play_id(data.get('play_id'))
+    if play_id is None:
+        raise TelemetryError('play_id must be a UUID')
+
+    events = data.get('events')
+    max_batch = getattr(settings, 'TELEMETRY_MAX_BATCH', 500)
+    if not isinstance(events, list) or not events:
+        raise TelemetryError('events must be a non-empty list')
+    if len(events) > max_batch:
+        raise TelemetryError(f'At most {max_batch} events per batch')
+
+    parsed = []
+    for event in events:
+        if not isinstance(event, dict) or not isinstance(event.get('type'), str) or event['type'] not in EVENT_TYPES:
+            raise TelemetryError(f"Unknown event type {event.get('type') if isinstance(event, dict) else event!r}")
+        parsed.append({
+            'type': event['type'],
+            'at': _milliseconds(event, 'at'),
+            'duration': _milliseconds(event, 'duration'),
+        })
+    return game_id, play_id, parsed
+
+
+def _segment_name(now):
+    host = socket.gethostname().replace(os.sep, '_')
+    return os.path.join(f'{now:%Y-%m-%d}', f'{now:%H}-{host}-{os.getpid()}{SEGMENT_SUFFIX}')
+
+
+def append_events(user_id, game_id, play_id, events, now=None):
+    """Append one batch to this process's current segment as a single gzip member"""
+    now = timezone.localtime(now)
+    lines = ''.join(
+        json.dumps({'user': user_id, 'game': game_id, 'play': str(play_id), **event}) + '\n'
+        for event in events
+    )
+    member = gzip.compress(lines.encode())
+    path = os.path.join(settings.TELEMETRY_ROOT, _segment_name(now))
+    with _lock:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'ab') as handle:
+            handle.write(member)
+
+
+def closed_segments(now=None):
+    """Relative paths of segments whose hour ended at least TELEMETRY_COMPACTION_DELAY seconds ago"""
+    now = timezone.localtime(now)
+    cutoff = now - timedelta(seconds=getattr(settings, 'TELEMETRY_COMPACTION_DELAY', 60 * 60))
+    root = settings.TELEMETRY_ROOT
+    if not os.path.isdir(root):
+        return []
+
+    segments = []
+    for day in sorted(os.listdir(root)):
+        for name in sorted(os.listdir(os.path.join(root, day))):
+            if not name.endswith(SEGMENT_SUFFIX):
+                continue
+            try:
+                hour = datetime.strptime(f'{day} {name[:2]}', '%Y-%m-%d %H')
+            except ValueError:
+                continue
+            if timezone.make_aware(hour) + timedelta(hours=1) <= cutoff:
+                segments.append(os.path.join(day, name))
+    return segments
+
+
+def _read_segment(path):
+    with gzip.open(os.path.join(settings.TELEMETRY_ROOT, path), 'rt') as handle:
+        for line in handle:
+            if line.strip():
+                yield json.loads(line)
+
+
+def _compact_segment(path):
+    """Fold one segment into GameSession, returning (events, sessions updated, unmatched plays, skipped events)"""
+    totals = {}  # (play_id, user_id) -> [event count, Counter by type, paused ms]
+    event_count = skipped = 0
+    for event in _read_segment(path):
+        event_count += 1
+        if not _in_range(event):
+            skipped += 1
+            continue
+        key = (event['play'], event['user'])
+        total = totals.setdefault(key, [0, Counter(), 0])
+        total[0] += 1
+        total[1][event['type']] += 1
+        if event['type'] == 'pause':
+            total[2] += event.get('duration', 0)
+
+    with transaction.atomic():
+        # Claim the segment first: a concurrent compaction of the same file fails here and rolls back
+        TelemetrySegment.objects.create(path=path, event_count=event_count)
+        sessions = list(GameSession.objects.filter(play_id__in={play for play, _ in totals}))
+        updated = []
+        for session in sessions:
+            total = totals.pop((str(session.play_id), session.user_id), None)
+            if total is None:
+                continue
+            count, by_type, paused_ms = total
+            session.event_count += count
+            session.event_counts = dict(Counter(session.event_counts) + by_type)
+            session.paused_ms += paused_ms
+            updated.append(session)
+        GameSession.objects.bulk_update(updated, ['event_count', 'event_counts', 'paused_ms'])
+    # Whatever is left had no finished GameSession (abandoned plays) or a mismatched user
+    return event_count, len(updated), len(totals), skipped
+
+
+def compact(now=None):
+    """Fold every closed, not yet compacted segment into GameSession and return a summary"""
+    candidates = closed_segments(now)
+    done = set(TelemetrySegment.objects.filter(path__in=candidates).values_list('path', flat=True))
+    summary = {'segments': 0, 'events': 0, 'sessions': 0, 'unmatched': 0, 'skipped': 0, 'failed': 0}
+    for path in candidates:
+        if path in done:
+            continue
+        try:
+            events, sessions, unmatched, skipped = _compact_segment(path)
+        except IntegrityError:
+            continue  # Compacted by another run in the meantime
+        except (DataError, OverflowError):
+            # Left for a later run; the segments behind it are still folded in
+            logger.exception('Could not compact telemetry segment %s', path)
+            summary['failed'] += 1
+            continue
+        summary['segments'] += 1
+        summary['events'] += events
+        summary['sessions'] += sessions
+        summary['unmatched'] += unmatched
+        summary['skipped'] += skipped
+    return summary
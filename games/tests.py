@@ -1,3 +1,439 @@
-from django.test import TestCase
+import base64
+import json
+import os
+import random
+import shutil
+import struct
+import tempfile
+import uuid
+import zlib
+from datetime import timedelta
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, OperationalError, connection
+from django.test.utils import CaptureQueriesContext
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from careconnect.testing import ConcurrentTestCase
+from users.models import CustomUser
+from . import drawings, leaderboards, telemetry
+from .models import Drawing, Game, GameProgress, GameSession, LeaderboardEntry, TelemetrySegment
 
-# Create your tests here.
+
+def create_game():
+    return Game.objects.create(name='Breathing', description='', game_type='breathing', difficulty='easy', instructions='')
+
+
+def make_png(width, height, seed=0):
+    """An RGB PNG of random pixels, which compresses poorly and so comes out large"""
+    rng = random.Random(seed)
+    raw = b''.join(b'\x00' + rng.randbytes(width * 3) for _ in range(height))
+
+    def chunk(tag, data):
+        return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data))
+
+    header = struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)
+    return drawings.PNG_SIGNATURE + chunk(b'IHDR', header) + chunk(b'IDAT', zlib.compress(raw)) + chunk(b'IEND', b'')
+
+
+class GameProgressTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user('player@example.com', 'Player', 'password')
+        cls.game = create_game()
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def test_complete_game_records_session_and_progress(self):
+        for score in [40, 100, 70]:
+            response = self.client.post(
+                reverse('games:complete_game'),
+                data=json.dumps({'game_id': self.game.id, 'score': score}),
+                content_type='application/json'
+            )
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(GameSession.objects.filter(user=self.user, game=self.game).count(), 3)
+        progress = GameProgress.objects.get(user=self.user, game=self.game)
+        self.assertEqual((progress.high_score, progress.total_sessions), (100, 3))
+
+    def test_save_game_session_uses_the_same_progress_path(self):
+        response = self.client.post(reverse('games:save_game_session'), {
+            'game_id': self.game.id, 'score': 30, 'duration': 90, 'completed': 'true'
+        })
+        self.assertEqual(response.json()['status'], 'success')
+        GameSession.record(self.user.id, self.game.id, score=10, duration=60)
+        progress = GameProgress.objects.get(user=self.user, game=self.game)
+        self.assertEqual((progress.high_score, progress.total_sessions, progress.total_duration), (30, 2, 150))
+
+    def test_progress_update_is_a_single_statement(self):
+        GameSession.record(self.user.id, self.game.id, score=10)
+        # Savepoint, session INSERT, progress UPDATE, release
+        with self.assertNumQueries(4):
+            GameSession.record(self.user.id, self.game.id, score=20)
+
+
+class ConcurrentGameProgressTests(ConcurrentTestCase):
+    """Hundreds of completions racing on the same (user, game) row must all be counted"""
+
+    threads = 8
+    games_per_thread = 25
+
+    def setUp(self):
+        super().setUp()
+        leaderboards.clear_cache()
+
+    def test_concurrent_completions_are_all_counted(self):
+        user = CustomUser.objects.create_user('racer@example.com', 'Racer', 'password')
+        game = create_game()
+
+        def play(thread_index):
+            for i in range(self.games_per_thread):
+                GameSession.record(user.id, game.id, score=thread_index * 100 + i, duration=2)
+
+        self.assertEqual(self.run_concurrently(play, self.threads), [])
+        total = self.threads * self.games_per_thread
+        self.assertEqual(GameSession.objects.filter(user=user, game=game).count(), total)
+        progress = GameProgress.objects.get(user=user, game=game)
+        self.assertEqual(progress.total_sessions, total)
+        self.assertEqual(progress.total_duration, total * 2)
+        self.assertEqual(progress.high_score, (self.threads - 1) * 100 + self.games_per_thread - 1)
+
+
+class LeaderboardStructureTests(SimpleTestCase):
+    def test_top_and_rank_with_ties(self):
+        board = leaderboards.Leaderboard({1: 50, 2: 80, 3: 80, 4: 10}, {})
+        self.assertEqual(board.top(3), [(1, 2, 80), (1, 3, 80), (3, 1, 50)])
+        self.assertEqual([board.rank(user_id) for user_id in [1, 2, 3, 4, 5]], [3, 1, 1, 4, None])
+
+    def test_only_new_bests_move_a_player(self):
+        board = leaderboards.Leaderboard({1: 50, 2: 80}, {})
+        self.assertFalse(board.submit(1, 40))
+        self.assertTrue(board.submit(1, 90))
+        self.assertTrue(board.submit(3, 60))
+        self.assertEqual(board.top(5), [(1, 1, 90), (2, 2, 80), (3, 3, 60)])
+        self.assertEqual(board.dirty, {1, 3})
+
+
+class LeaderboardTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.game = create_game()
+        cls.players = [
+            CustomUser.objects.create_user(f'p{i}@example.com', f'Player {i}', 'password') for i in range(3)
+        ]
+
+    def setUp(self):
+        leaderboards.clear_cache()
+
+    def play(self, player, score):
+        with self.captureOnCommitCallbacks(execute=True):
+            GameSession.record(player.id, self.game.id, score=score)
+
+    def test_boards_follow_new_high_scores(self):
+        for player, score in zip(self.players, [30, 90, 60]):
+            self.play(player, score)
+        self.play(self.players[0], 95)
+
+        board = leaderboards.get_leaderboard(self.game.id, 'all', user_id=self.players[2].id)
+        self.assertEqual([(row['name'], row['score']) for row in board['top']],
+                         [('Player 0', 95), ('Player 1', 90), ('Player 2', 60)])
+        self.assertEqual(board['me'], {'rank': 3, 'score': 60})
+        self.assertEqual(leaderboards.get_leaderboard(self.game.id, 'week')['top'][0]['score'], 95)
+
+    def test_warm_board_reads_do_not_query(self):
+        self.play(self.players[0], 10)
+        leaderboards.get_leaderboard(self.game.id, 'day')
+        with self.assertNumQueries(0):
+            leaderboards.get_leaderboard(self.game.id, 'day', user_id=self.players[0].id)
+
+    def test_flush_persists_daily_and_weekly_bests(self):
+        self.play(self.players[0], 40)
+        self.play(self.players[0], 70)
+        self.assertEqual(leaderboards.flush(), 2)
+        self.assertEqual(
+            set(LeaderboardEntry.objects.values_list('period', 'score')), {('day', 70), ('week', 70)}
+        )
+        # A fresh process loads the persisted board
+        leaderboards.clear_cache()
+        self.assertEqual(leaderboards.get_leaderboard(self.game.id, 'day')['top'][0]['score'], 70)
+
+    def test_board_failure_does_not_fail_the_saved_game(self):
+        load = leaderboards._load
+
+        def broken(*key):
+            raise OperationalError('database is locked')
+        leaderboards._load = broken
+        self.addCleanup(setattr, leaderboards, '_load', load)
+
+        self.client.force_login(self.players[0])
+        with self.assertLogs('games.leaderboards', 'ERROR'), self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('games:complete_game'), data=json.dumps(
+                {'game_id': self.game.id, 'score': 40}
+            ), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(GameSession.objects.filter(user=self.players[0]).exists())
+
+    def test_boards_load_outside_the_global_lock(self):
+        load, locked = leaderboards._load, []
+
+        def checked(*key):
+            free = leaderboards._lock.acquire(blocking=False)
+            if free:
+                leaderboards._lock.release()
+            locked.append(not free)
+            return load(*key)
+        leaderboards._load = checked
+        self.addCleanup(setattr, leaderboards, '_load', load)
+
+        self.play(self.players[0], 40)
+        self.assertEqual(locked, [False] * len(leaderboards.PERIODS))
+        self.assertEqual(leaderboards.get_leaderboard(self.game.id, 'day')['top'][0]['score'], 40)
+
+    def test_rebuild_from_session_history(self):
+        now = timezone.now()
+        for days_ago, score in [(0, 20), (1, 80), (15, 100)]:
+            GameSession.objects.create(
+                user=self.players[1], game=self.game, score=score, played_at=now - timedelta(days=days_ago)
+            )
+        progress_count, _ = leaderboards.rebuild()
+        self.assertEqual(progress_count, 1)
+        self.assertEqual(GameProgress.objects.get(user=self.players[1], game=self.game).high_score, 100)
+        self.assertEqual(leaderboards.get_leaderboard(self.game.id, 'all')['top'][0]['score'], 100)
+        self.assertEqual(leaderboards.get_leaderboard(self.game.id, 'day')['top'][0]['score'], 20)
+
+    def test_leaderboard_view(self):
+        self.play(self.players[0], 25)
+        self.client.force_login(self.players[0])
+        url = reverse('games:leaderboard', kwargs={'game_id': self.game.id})
+        response = self.client.get(url, {'period': 'day'})
+        self.assertEqual(response.json()['me'], {'rank': 1, 'score': 25})
+        self.assertEqual(self.client.get(url, {'period': 'month'}).status_code, 400)
+
+
+class DrawingStorageTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user('artist@example.com', 'Artist', 'password')
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.media_root = media_root
+        self.client.force_login(self.user)
+        cache.clear()
+
+    def upload(self, png):
+        return self.client.post(reverse('games:save_drawing'), data=png, content_type='image/png')
+
+    def stored_files(self):
+        return sorted(
+            os.path.relpath(os.path.join(root, name), self.media_root)
+            for root, _, names in os.walk(self.media_root) for name in names
+        )
+
+    def test_stores_by_content_hash_and_deduplicates(self):
+        png = make_png(40, 30)
+        first = self.upload(png).json()['drawing']
+        second = self.upload(png).json()['drawing']
+        self.assertEqual((first['duplicate'], second['duplicate']), (False, True))
+        self.assertEqual(first['id'], second['id'])
+
+        drawing = Drawing.objects.get(user=self.user)
+        self.assertEqual((drawing.width, drawing.height, drawing.size), (40, 30, len(png)))
+        self.assertEqual(self.stored_files(), [drawings.image_name(drawing.sha256)])
+
+    def test_legacy_data_url_upload_is_decoded_in_chunks(self):
+        # Large enough that the base64 text spans many read chunks
+        png = make_png(250, 250)
+        self.assertGreater(len(png), drawings.CHUNK_SIZE * 2)
+        response = self.client.post(
+            reverse('games:save_drawing'),
+            data=json.dumps({'image': 'data:image/png;base64,' + base64.b64encode(png).decode()}),
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 200)
+        drawing = Drawing.objects.get(user=self.user)
+        with open(os.path.join(self.media_root, drawing.image.name), 'rb') as handle:
+            self.assertEqual(handle.read(), png)
+
+    def test_rejects_oversized_and_non_png_uploads(self):
+        with override_settings(DRAWING_MAX_BYTES=1024):
+            self.assertEqual(self.upload(make_png(100, 100)).status_code, 413)
+        self.assertEqual(self.upload(b'GIF89a not a png at all').status_code, 400)
+        self.assertFalse(Drawing.objects.exists())
+        self.assertEqual(self.stored_files(), [])
+
+    def test_rejects_pixel_bombs_by_their_header(self):
+        # A tiny file whose IHDR declares 20000 x 20000 pixels
+        header = struct.pack('>IIBBBBB', 20000, 20000, 8, 2, 0, 0, 0)
+        bomb = drawings.PNG_SIGNATURE + struct.pack('>I', len(header)) + b'IHDR' + header + b'\x00' * 4
+        response = self.upload(bomb)
+        self.assertEqual(response.status_code, 413)
+        self.assertIn('pixels', response.json()['message'])
+        with override_settings(DRAWING_MAX_PIXELS=30 * 30):
+            self.assertEqual(self.upload(make_png(40, 30)).status_code, 413)
+        self.assertFalse(Drawing.objects.exists())
+        self.assertEqual(self.stored_files(), [])
+
+    def test_gallery_serves_cached_thumbnails(self):
+        if drawings.Image is None:
+            self.skipTest('Pillow is not installed')
+        with self.captureOnCommitCallbacks() as callbacks:
+            sha256 = self.upload(make_png(600, 400)).json()['drawing']['sha256']
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(self.client.get(reverse('games:drawing_gallery')).json()['drawings'][0]['thumbnail'], None)
+
+        drawings.generate_thumbnail(sha256)
+        gallery = self.client.get(reverse('games:drawing_gallery')).json()['drawings']
+        self.assertTrue(gallery[0]['thumbnail'].endswith(drawings.thumbnail_name(sha256)))
+        with drawings.Image.open(os.path.join(self.media_root, drawings.thumbnail_name(sha256))) as thumbnail:
+            self.assertLessEqual(max(thumbnail.size), 240)
+        with self.assertNumQueries(0):
+            drawings.get_gallery(self.user.id)
+
+
+class TelemetryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user('breather@example.com', 'Breather', 'password')
+        cls.game = create_game()
+
+    def setUp(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        settings_override = override_settings(TELEMETRY_ROOT=root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.client.force_login(self.user)
+
+    def post_batch(self, payload):
+        return self.client.post(reverse('games:telemetry'), data=json.dumps(payload), content_type='application/json')
+
+    def segments(self):
+        return [
+            os.path.relpath(os.path.join(directory, name), settings.TELEMETRY_ROOT)
+            for directory, _, names in os.walk(settings.TELEMETRY_ROOT) for name in names
+        ]
+
+    def test_batch_is_appended_without_touching_game_tables(self):
+        play_id = str(uuid.uuid4())
+        events = [{'type': 'breath_cycle', 'at': i * 12000, 'duration': 12000} for i in range(5)]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.post_batch({'game_id': self.game.id, 'play_id': play_id, 'events': events})
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json()['accepted'], 5)
+        self.assertFalse([query for query in queries if 'games_' in query['sql']])
+
+        # A second batch lands in the same segment as another gzip member
+        self.post_batch({'game_id': self.game.id, 'play_id': play_id, 'events': events[:2]})
+        [segment] = self.segments()
+        self.assertEqual(len(list(telemetry._read_segment(segment))), 7)
+
+    def test_rejects_malformed_batches(self):
+        play_id = str(uuid.uuid4())
+        for payload in [
+            {'game_id': self.game.id, 'play_id': 'not-a-uuid', 'events': [{'type': 'stroke'}]},
+            {'game_id': self.game.id, 'play_id': play_id, 'events': [{'type': 'teleport'}]},
+            {'game_id': self.game.id, 'play_id': play_id, 'events': [{'type': 'pause', 'duration': -5}]},
+            {'game_id': self.game.id, 'play_id': play_id, 'events': [{'type': 'stroke'}] * 501},
+            {'game_id': self.game.id, 'play_id': play_id, 'events': [{'type': ['stroke']}]},
+            {'game_id': self.game.id, 'play_id': play_id, 'events': [{'type': {'stroke': 1}}]},
+            {'game_id': self.game.id, 'play_id': play_id, 'events': [{'type': 'stroke', 'at': float('inf')}]},
+            {'game_id': self.game.id, 'play_id': play_id, 'events': [{'type': 'pause', 'duration': float('nan')}]},
+            {'game_id': float('inf'), 'play_id': play_id, 'events': [{'type': 'stroke'}]},
+            {'game_id': 2 ** 40, 'play_id': play_id, 'events': [{'type': 'stroke'}]},
+            {'game_id': self.game.id, 'play_id': play_id, 'events': [{'type': 'pause', 'duration': 1e300}]},
+            {'game_id': self.game.id, 'play_id': play_id, 'events': [{'type': 'stroke', 'at': 10 ** 30}]},
+        ]:
+            self.assertEqual(self.post_batch(payload).status_code, 400)
+        self.assertEqual(self.segments(), [])
+
+    def test_compaction_folds_closed_segments_once(self):
+        play_id = uuid.uuid4()
+        session = GameSession.record(self.user.id, self.game.id, score=100, play_id=play_id)
+        two_hours_ago = timezone.now() - timedelta(hours=2)
+        telemetry.append_events(self.user.id, self.game.id, play_id, [
+            {'type': 'breath_cycle', 'at': 0, 'duration': 12000},
+            {'type': 'pause', 'at': 12000, 'duration': 3000},
+            {'type': 'breath_cycle', 'at': 15000, 'duration': 12000},
+        ], now=two_hours_ago)
+        # Still being written this hour, so left for a later run
+        telemetry.append_events(self.user.id, self.game.id, play_id, [{'type': 'resume', 'at': 15000, 'duration': 0}])
+
+        self.assertEqual(telemetry.compact()['events'], 3)
+        self.assertEqual(telemetry.compact()['segments'], 0)
+        session.refresh_from_db()
+        self.assertEqual(session.event_count, 3)
+        self.assertEqual(session.event_counts, {'breath_cycle': 2, 'pause': 1})
+        self.assertEqual(session.paused_ms, 3000)
+        self.assertEqual(TelemetrySegment.objects.count(), 1)
+
+    def test_out_of_range_events_do_not_block_compaction(self):
+        play_id = uuid.uuid4()
+        session = GameSession.record(self.user.id, self.game.id, score=100, play_id=play_id)
+        three_hours_ago = timezone.now() - timedelta(hours=3)
+        # Written before durations were bounded, so never validated against MAX_EVENT_MS
+        telemetry.append_events(self.user.id, self.game.id, play_id, [
+            {'type': 'pause', 'at': 0, 'duration': 10 ** 300},
+            {'type': 'pause', 'at': 0, 'duration': 2000},
+        ], now=three_hours_ago)
+        telemetry.append_events(self.user.id, self.game.id, play_id, [{'type': 'stroke', 'at': 0, 'duration': 0}],
+                                now=three_hours_ago + timedelta(hours=1))
+
+        summary = telemetry.compact()
+        self.assertEqual((summary['segments'], summary['skipped'], summary['failed']), (2, 1, 0))
+        session.refresh_from_db()
+        self.assertEqual((session.event_count, session.paused_ms), (2, 2000))
+
+    def test_failed_segment_does_not_block_later_ones(self):
+        session = GameSession.record(self.user.id, self.game.id, score=100, play_id=uuid.uuid4())
+        three_hours_ago = timezone.now() - timedelta(hours=3)
+        for hour in range(2):
+            telemetry.append_events(self.user.id, self.game.id, session.play_id,
+                                    [{'type': 'stroke', 'at': 0, 'duration': 0}],
+                                    now=three_hours_ago + timedelta(hours=hour))
+        [first, _] = telemetry.closed_segments()
+
+        compact_segment = telemetry._compact_segment
+
+        def failing(path):
+            if path == first:
+                raise OverflowError('Python int too large to convert to SQLite INTEGER')
+            return compact_segment(path)
+        telemetry._compact_segment = failing
+        self.addCleanup(setattr, telemetry, '_compact_segment', compact_segment)
+
+        with self.assertLogs('games.telemetry', 'ERROR'):
+            summary = telemetry.compact()
+        self.assertEqual((summary['segments'], summary['failed']), (1, 1))
+        self.assertFalse(TelemetrySegment.objects.filter(path=first).exists())
+
+    def test_events_for_another_users_play_are_ignored(self):
+        other = CustomUser.objects.create_user('other@example.com', 'Other', 'password')
+        play_id = uuid.uuid4()
+        session = GameSession.record(other.id, self.game.id, score=10, play_id=play_id)
+        telemetry.append_events(self.user.id, self.game.id, play_id, [{'type': 'stroke', 'at': 0, 'duration': 0}],
+                                now=timezone.now() - timedelta(hours=2))
+        self.assertEqual(telemetry.compact()['unmatched'], 1)
+        session.refresh_from_db()
+        self.assertEqual(session.event_count, 0)
+
+    def test_retried_completion_is_recorded_once(self):
+        payload = {'game_id': self.game.id, 'score': 100, 'play_id': str(uuid.uuid4())}
+        for _ in range(2):
+            self.client.post(reverse('games:complete_game'), data=json.dumps(payload), content_type='application/json')
+        self.assertEqual(GameSession.objects.filter(user=self.user).count(), 1)
+        self.assertEqual(GameProgress.objects.get(user=self.user, game=self.game).total_sessions, 1)
+
+    def test_play_id_of_another_user_is_not_a_retry(self):
+        other = CustomUser.objects.create_user('copycat@example.com', 'Copycat', 'password')
+        play_id = uuid.uuid4()
+        GameSession.record(other.id, self.game.id, score=10, play_id=play_id)
+        with self.assertRaises(IntegrityError):
+            GameSession.record(self.user.id, self.game.id, score=99, play_id=play_id)
+        self.assertFalse(GameSession.objects.filter(user=self.user).exists())
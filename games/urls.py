@@ -6,6 +6,10 @@ app_name = 'games'
 urlpatterns = [
     path('', views.games_list, name='games_list'),
     path('<int:game_id>/play/', views.play_game, name='play_game'),
+    path('<int:game_id>/leaderboard/', views.leaderboard, name='leaderboard'),
     path('complete/', views.complete_game, name='complete_game'),
+    path('save-session/', views.save_game_session, name='save_game_session'),
+    path('telemetry/', views.telemetry, name='telemetry'),
     path('save-drawing/', views.save_drawing, name='save_drawing'),
+    path('drawings/', views.drawing_gallery, name='drawing_gallery'),
 ] 
\ No newline at end of file
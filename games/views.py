@@ -1,9 +1,14 @@
+import json
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.http import JsonResponse
 from django.utils import timezone
 from django.http import Http404
+from django.views.decorators.http import require_POST
 from .models import Game, GameSession, GameProgress
+from .drawings import DrawingError, DrawingTooLarge, get_gallery, store_drawing, upload_chunks
+from .leaderboards import PERIODS, get_leaderboard
+from .telemetry import append_events, parse_batch, parse_play_id
 from django.db.models import Avg, Count, Sum
 
 # Create your views here.
@@ -35,28 +40,17 @@ def complete_game(request):
     if request.method == 'POST':
         import json
         data = json.loads(request.body)
-        game_id = data.get('game_id')
-        score = data.get('score')
+        game = get_object_or_404(Game, id=data.get('game_id'))
         
-        # Create a game session record
-        game = get_object_or_404(Game, id=game_id)
-        GameSession.objects.create(
-            user=request.user,
-            game=game,
-            score=score,
-            completed_at=timezone.now()
+        # Record the session and update the user's progress
+        GameSession.record(
+            request.user.id,
+            game.id,
+            score=int(data.get('score') or 0),
+            duration=int(data.get('duration') or 0),
+            play_id=parse_play_id(data.get('play_id')),
         )
         
-        # Update user progress
-        progress, created = GameProgress.objects.get_or_create(
-            user=request.user,
-            game=game,
-            defaults={'total_score': 0, 'sessions_count': 0}
-        )
-        progress.total_score += score
-        progress.sessions_count += 1
-        progress.save()
-        
         return JsonResponse({'status': 'success'})
     return JsonResponse({'status': 'error'}, status=400)
 
@@ -67,39 +61,34 @@ def save_game_session(request):
             data = request.POST
             game = get_object_or_404(Game, id=data.get('game_id'))
             
-            # Create game session
-            session = GameSession.objects.create(
-                user=request.user,
-                game=game,
+            # Record the session and update the user's progress
+            GameSession.record(
+                request.user.id,
+                game.id,
                 score=int(data.get('score', 0)),
                 duration=int(data.get('duration', 0)),
-                completed=data.get('completed', False) == 'true'
-            )
-            
-            # Update or create game progress
-            progress, created = GameProgress.objects.get_or_create(
-                user=request.user,
-                game=game,
-                defaults={
-                    'high_score': session.score,
-                    'total_sessions': 1,
-                    'total_duration': session.duration
-                }
+                completed=data.get('completed', False) == 'true',
+                play_id=parse_play_id(data.get('play_id'))
             )
             
-            if not created:
-                if session.score > progress.high_score:
-                    progress.high_score = session.score
-                progress.total_sessions += 1
-                progress.total_duration += session.duration
-                progress.save()
-            
             return JsonResponse({'status': 'success'})
         except Exception as e:
             return JsonResponse({'status': 'error', 'message': str(e)})
     
     return JsonResponse({'status': 'error', 'message': 'Invalid request method'})
 
+@login_required
+@require_POST
+def telemetry(request):
+    # Events are only appended to the telemetry log here; compact_telemetry folds them into GameSession
+    try:
+        game_id, play_id, events = parse_batch(json.loads(request.body))
+    except ValueError as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+    
+    append_events(request.user.id, game_id, play_id, events)
+    return JsonResponse({'status': 'success', 'accepted': len(events)}, status=202)
+
 @login_required
 def game_stats(request):
     user_progress = GameProgress.objects.filter(user=request.user)
@@ -115,17 +104,36 @@ def game_stats(request):
     return JsonResponse(stats)
 
 @login_required
+def leaderboard(request, game_id):
+    game = get_object_or_404(Game, id=game_id)
+    period = request.GET.get('period', 'all')
+    if period not in PERIODS:
+        return JsonResponse({'status': 'error', 'message': f'period must be one of {", ".join(PERIODS)}'}, status=400)
+    
+    board = get_leaderboard(game.id, period, user_id=request.user.id)
+    return JsonResponse({'game': game.id, 'period': period, **board})
+
+@login_required
+@require_POST
 def save_drawing(request):
-    if request.method == 'POST':
-        try:
-            import json
-            data = json.loads(request.body)
-            image_data = data.get('image')
-            
-            # Here you would typically save the drawing data
-            # For now, we'll just return success
-            
-            return JsonResponse({'status': 'success'})
-        except Exception as e:
-            return JsonResponse({'status': 'error', 'message': str(e)})
-    return JsonResponse({'status': 'error'}, status=400)
+    # The PNG is streamed to disk in chunks rather than read into memory
+    try:
+        drawing, created = store_drawing(request.user, upload_chunks(request))
+    except DrawingTooLarge as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=413)
+    except DrawingError as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+    
+    return JsonResponse({
+        'status': 'success',
+        'drawing': {
+            'id': drawing.id,
+            'sha256': drawing.sha256,
+            'size': drawing.size,
+            'duplicate': not created,
+        }
+    })
+
+@login_required
+def drawing_gallery(request):
+    return JsonResponse({'drawings': get_gallery(request.user.id)})
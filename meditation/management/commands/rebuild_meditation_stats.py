@@ -0,0 +1,9 @@
+from django.core.management.base import BaseCommand
+from meditation.models import MeditationUserStats
+
+class Command(BaseCommand):
+    help = 'Rebuilds the per-user meditation totals and streaks from the full MeditationSession history'
+
+    def handle(self, *args, **options):
+        user_count = MeditationUserStats.rebuild()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt meditation stats for {user_count} users"))
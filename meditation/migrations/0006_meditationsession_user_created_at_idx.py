@@ -0,0 +1,19 @@
+# Generated by Django 5.0.2 on 2026-10-17 04:29
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('meditation', '0005_alter_meditationsession_options_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='meditationsession',
+            index=models.Index(fields=['user', 'created_at'], name='meditation__user_id_f6cc6b_idx'),
+        ),
+    ]
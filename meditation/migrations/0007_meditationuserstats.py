@@ -0,0 +1,27 @@
+# Generated by Django 5.0.2 on 2026-10-17 04:34
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('meditation', '0006_meditationsession_user_created_at_idx'),
+        ('users', '0022_default_timestamps'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MeditationUserStats',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='meditation_stats', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('total_minutes', models.PositiveIntegerField(default=0)),
+                ('total_sessions', models.PositiveIntegerField(default=0)),
+                ('current_streak', models.PositiveIntegerField(default=0)),
+                ('longest_streak', models.PositiveIntegerField(default=0)),
+                ('last_session_date', models.DateField(blank=True, null=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.2 on 2026-10-17 04:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('meditation', '0007_meditationuserstats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='meditationsession',
+            name='sittings',
+            field=models.PositiveIntegerField(default=1, help_text='Meditations folded into this day'),
+        ),
+    ]
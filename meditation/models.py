@@ -1,43 +1,115 @@
 # meditation\models.py
-from django.db import models
-from django.utils.timezone import timedelta, timezone
+from datetime import timedelta
 from django.conf import settings
+from django.db import models, transaction
+from django.db.models.functions import Greatest
+from django.utils import timezone
 
 class MeditationSession(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='meditation_sessions')
     duration = models.IntegerField(help_text='Duration in minutes')
+    sittings = models.PositiveIntegerField(default=1, help_text='Meditations folded into this day')
     date = models.DateField()
     created_at = models.DateTimeField(auto_now_add=True, null=True)  # Allow null temporarily for migration
     
     class Meta:
         ordering = ['-date', '-created_at']
         unique_together = ['user', 'date']
+        indexes = [
+            models.Index(fields=['user', 'created_at']),
+        ]
     
     def __str__(self):
         return f"{self.user.username}'s meditation session on {self.date}"
 
+    @classmethod
+    def add_sitting(cls, user_id, duration, day, now=None):
+        """
+        Add one sitting to the user's row for the day: an insert-if-missing and one UPDATE.
+        bulk_create(update_conflicts=True) can only overwrite columns with the new row's
+        values, not add to them, so the increment is a separate UPDATE with F() and
+        concurrent submissions from several tabs or devices all land.
+        """
+        from users.reports import touch_report
+        with transaction.atomic():
+            cls.objects.bulk_create(
+                [cls(user_id=user_id, duration=0, sittings=0, date=day, created_at=now or timezone.now())],
+                ignore_conflicts=True,
+            )
+            cls.objects.filter(user_id=user_id, date=day).update(
+                duration=models.F('duration') + duration,
+                sittings=models.F('sittings') + 1,
+            )
+            # Neither write sends post_save, so move the report stamp here
+            touch_report(user_id)
+
+class MeditationUserStats(models.Model):
+    """Running per-user meditation totals and streaks, so pages never scan MeditationSession"""
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, primary_key=True, related_name='meditation_stats')
+    total_minutes = models.PositiveIntegerField(default=0)
+    total_sessions = models.PositiveIntegerField(default=0)
+    current_streak = models.PositiveIntegerField(default=0)  # Consecutive days ending on last_session_date
+    longest_streak = models.PositiveIntegerField(default=0)
+    last_session_date = models.DateField(null=True, blank=True)
+
+    def streak_on(self, day):
+        """The streak as seen on the given day: it only counts while it includes that day"""
+        return self.current_streak if self.last_session_date == day else 0
+
+    @classmethod
+    def record_session(cls, user_id, duration, day):
+        """Fold one meditation session into the user's stats row with a single UPDATE"""
+        cls.objects.get_or_create(user_id=user_id)
+        # Sessions on or before the last recorded day leave the streak alone
+        streak = models.Case(
+            models.When(last_session_date__gte=day, then=models.F('current_streak')),
+            models.When(last_session_date=day - timedelta(days=1), then=models.F('current_streak') + 1),
+            default=models.Value(1),
+        )
+        cls.objects.filter(user_id=user_id).update(
+            total_minutes=models.F('total_minutes') + duration,
+            total_sessions=models.F('total_sessions') + 1,
+            current_streak=streak,
+            longest_streak=Greatest('longest_streak', streak),
+            last_session_date=models.Case(
+                models.When(last_session_date__gte=day, then=models.F('last_session_date')),
+                default=models.Value(day),
+            ),
+        )
+
+    @classmethod
+    def rebuild(cls):
+        """Recompute every user's stats from the full session history, returning the row count"""
+        stats = {}
+        sessions = MeditationSession.objects.order_by('user_id', 'date')\
+                                            .values_list('user_id', 'date', 'duration', 'sittings')
+        for user_id, day, duration, sittings in sessions.iterator(chunk_size=2000):
+            row = stats.get(user_id)
+            if row is None:
+                row = stats[user_id] = cls(user_id=user_id)
+            row.total_minutes += duration
+            row.total_sessions += sittings
+            if row.last_session_date == day:
+                continue
+            if row.last_session_date == day - timedelta(days=1):
+                row.current_streak += 1
+            else:
+                row.current_streak = 1
+            row.longest_streak = max(row.longest_streak, row.current_streak)
+            row.last_session_date = day
+
+        with transaction.atomic():
+            cls.objects.all().delete()
+            cls.objects.bulk_create(stats.values(), batch_size=500)
+        return len(stats)
+
+
 def get_user_stats(user):
     """ Fetch meditation stats for a user. """
-    sessions = MeditationSession.objects.filter(user=user)
-    
-    total_time = sum(session.duration for session in sessions)
-    total_sessions = sessions.count()
-    
-    # Calculate streak
-    today = timezone.now().date()
-    streak = 0
-    last_date = today
-    
-    # Get all unique dates with sessions
-    session_dates = set(session.date for session in sessions)
-    
-    # Check consecutive days starting from today
-    while last_date in session_dates:
-        streak += 1
-        last_date -= timedelta(days=1)
-
+    stats = MeditationUserStats.objects.filter(user=user).first() or MeditationUserStats(user=user)
     return {
-        "total_time": total_time,
-        "total_sessions": total_sessions,
-        "streak": streak
+        "total_time": stats.total_minutes,
+        "total_sessions": stats.total_sessions,
+        "streak": stats.streak_on(timezone.localdate()),
+        "longest_streak": stats.longest_streak,
     }
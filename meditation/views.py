@@ -4,33 +4,22 @@ from django.contrib.auth.decorators import login_required
 from django.http import JsonResponse
 from django.views.decorators.http import require_POST
 from django.utils import timezone
-from datetime import timedelta
-from .models import MeditationSession
-from django.db.models import Sum
+from django.db import transaction
+from .models import MeditationSession, MeditationUserStats, get_user_stats
 import json
 
 @login_required
 def meditation_page(request):
     # Get user's meditation statistics
-    total_meditation = MeditationSession.objects.filter(user=request.user).aggregate(total=Sum('duration'))['total'] or 0
-    total_sessions = MeditationSession.objects.filter(user=request.user).count()
-    
-    # Calculate meditation streak
-    today = timezone.now().date()
-    streak = 0
-    current_date = today
-    
-    while MeditationSession.objects.filter(user=request.user, created_at__date=current_date).exists():
-        streak += 1
-        current_date -= timedelta(days=1)
+    stats = get_user_stats(request.user)
     
     # Get recent sessions
     recent_sessions = MeditationSession.objects.filter(user=request.user).order_by('-created_at')[:10]
     
     context = {
-        'total_meditation': total_meditation,
-        'total_sessions': total_sessions,
-        'meditation_streak': streak,
+        'total_meditation': stats['total_time'],
+        'total_sessions': stats['total_sessions'],
+        'meditation_streak': stats['streak'],
         'recent_sessions': recent_sessions,
     }
     
@@ -46,22 +35,20 @@ def save_session(request):
         if not duration:
             return JsonResponse({'status': 'error', 'message': 'Duration is required'}, status=400)
         
+        duration = int(duration)
         now = timezone.now()
-        session = MeditationSession.objects.create(
-            user=request.user,
-            duration=duration,
-            date=now.date(),
-            created_at=now
-        )
+        today = timezone.localdate(now)
+        with transaction.atomic():
+            # A second meditation on the same day is added to that day's session
+            MeditationSession.add_sitting(request.user.id, duration, today, now)
+            MeditationUserStats.record_session(request.user.id, duration, today)
         
-        # Return more detailed response for debugging
         return JsonResponse({
             'status': 'success',
             'session': {
-                'id': session.id,
-                'duration': session.duration,
-                'date': session.date.strftime('%Y-%m-%d'),
-                'created_at': session.created_at.strftime('%Y-%m-%d %H:%M:%S')
+                'duration': duration,
+                'date': today.strftime('%Y-%m-%d'),
+                'created_at': timezone.localtime(now).strftime('%Y-%m-%d %H:%M:%S')
             }
         })
     except Exception as e:
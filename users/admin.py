@@ -24,8 +24,8 @@ class CustomUserAdmin(UserAdmin):
 
 @admin.register(MentalHealthTest)
 class MentalHealthTestAdmin(admin.ModelAdmin):
-    list_display = ('user', 'test_type', 'score', 'category', 'date_taken')
-    list_filter = ('test_type', 'category', 'date_taken')
+    list_display = ('user', 'test_type', 'score', 'severity', 'caution', 'date_taken')
+    list_filter = ('test_type', 'severity', 'caution', 'recommendation_type', 'date_taken')
     search_fields = ('user__email', 'user__name')
     ordering = ('-date_taken',)
 
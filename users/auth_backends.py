@@ -1,19 +1,196 @@
 # users/auth_backends.py
-from django.contrib.auth.backends import BaseBackend
+"""
+Email authentication, with request.user served from a cache.
+
+AuthenticationMiddleware resolves request.user through get_user on every
+authenticated request. EmailAuthBackend keeps the field values of recently
+seen users in a per-process LRU of AUTH_USER_CACHE_SIZE entries and, when
+AUTH_USER_CACHE_ALIAS names one of CACHES, in that shared cache too, both for
+AUTH_USER_CACHE_TTL seconds. A warm request builds request.user from the
+cached values without a query. Every call returns a new instance, so
+per-request state such as the permission cache is never shared.
+
+The password hash is never cached. Entries hold get_session_auth_hash()
+instead, which is all session verification needs, and the rebuilt user
+loads its password from the database if anything reads it.
+
+Saving or deleting a user drops their entry (see users/signals.py) and, with
+a shared cache, moves a version stamp kept there. Every process checks its
+local entry against that stamp, so is_active, is_staff and is_superuser
+changes apply on the next request in every process. Permissions are not
+cached here: ModelBackend still loads a user's group and user permissions
+once per request when a view checks one. Changes that skip signals, such as
+queryset.update(), and, without a shared cache, changes saved by other
+processes show up within AUTH_USER_CACHE_TTL.
+"""
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.db import router
+from django.dispatch import receiver
 from .models import CustomUser
 
-class EmailAuthBackend(BaseBackend):
-    def authenticate(self, request, email=None, password=None, **kwargs):
+# What a cached user is rebuilt from, in the order CustomUser's constructor takes it; never the password
+USER_FIELDS = [field.attname for field in CustomUser._meta.concrete_fields if field.attname != 'password']
+CACHED_KEYS = USER_FIELDS + ['session_auth_hash']
+
+_user_cache = None
+
+
+class UserCache:
+    """
+    {user id: field values} in a thread-safe LRU whose entries expire ttl seconds
+    after they were stored, backed by an optional shared Django cache that also
+    holds each user's version stamp.
+    """
+
+    def __init__(self, max_size=1024, ttl=60, alias=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.shared = caches[alias] if alias else None
+        self._entries = OrderedDict()  # user id -> (expires_at, version, values), least recently used first
+        self._lock = threading.Lock()
+        self.hits = self.shared_hits = self.misses = 0
+
+    @staticmethod
+    def key(user_id):
+        return f'auth-user:{user_id}'
+
+    @staticmethod
+    def version_key(user_id):
+        return f'auth-user-version:{user_id}'
+
+    def get(self, user_id):
+        """
+        (values, version), where values is None on a miss. Load the user after
+        this call and pass version to set(), so a save that lands in between
+        leaves the new entry already stale.
+        """
+        version = self.shared.get(self.version_key(user_id)) if self.shared is not None else None
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] > time.monotonic() and entry[1] == version:
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return entry[2], version
+            self._entries.pop(user_id, None)
+        cached = self.shared.get(self.key(user_id)) if self.shared is not None else None
+        if cached is not None and cached[0] == version and list(cached[1]) == CACHED_KEYS:
+            self._store(user_id, version, cached[1])
+            self.shared_hits += 1
+            return cached[1], version
+        self.misses += 1
+        return None, version
+
+    def set(self, user_id, values, version=None):
+        self._store(user_id, version, values)
+        if self.shared is not None:
+            self.shared.set(self.key(user_id), (version, values), self.ttl)
+
+    def _store(self, user_id, version, values):
+        if not self.max_size:
+            return
+        with self._lock:
+            self._entries[user_id] = (time.monotonic() + self.ttl, version, values)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+        if self.shared is not None:
+            # Other processes see the new stamp and drop their local entries; it only needs to
+            # outlive entries stored under the old one, which expire within ttl
+            self.shared.set(self.version_key(user_id), time.time_ns(), self.ttl)
+            self.shared.delete(self.key(user_id))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.shared_hits = self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.shared_hits + self.misses
+            return {
+                'size': len(self._entries),
+                'hits': self.hits,
+                'shared_hits': self.shared_hits,
+                'misses': self.misses,
+                'hit_rate': (self.hits + self.shared_hits) / lookups if lookups else 0.0,
+            }
+
+
+def get_user_cache():
+    """The process's user cache, or None when AUTH_USER_CACHE_ENABLED is off"""
+    global _user_cache
+    if not getattr(settings, 'AUTH_USER_CACHE_ENABLED', True):
+        return None
+    if _user_cache is None:
+        _user_cache = UserCache(
+            max_size=getattr(settings, 'AUTH_USER_CACHE_SIZE', 1024),
+            ttl=getattr(settings, 'AUTH_USER_CACHE_TTL', 60),
+            alias=getattr(settings, 'AUTH_USER_CACHE_ALIAS', None),
+        )
+    return _user_cache
+
+
+def invalidate_user(user_id):
+    """Drop a user from the cache so the next request reloads them"""
+    cache = get_user_cache()
+    if cache is not None:
+        cache.delete(user_id)
+
+
+@receiver(setting_changed)
+def _reset_user_cache(setting, **kwargs):
+    global _user_cache
+    if setting.startswith('AUTH_USER_CACHE') or setting == 'CACHES':
+        _user_cache = None
+
+
+class EmailAuthBackend(ModelBackend):
+    """
+    Authenticates by email, passed as email (the login page) or username (the
+    admin login form), and resolves request.user through the user cache.
+    Permission checks are ModelBackend's.
+    """
+
+    def authenticate(self, request, email=None, password=None, username=None, **kwargs):
+        email = email or username or kwargs.get(CustomUser.USERNAME_FIELD)
+        if email is None or password is None:
+            return None
         try:
-            user = CustomUser.objects.get(email=email)
-            if user.check_password(password):
-                return user
+            user = CustomUser._default_manager.get_by_natural_key(email)
         except CustomUser.DoesNotExist:
+            # Hash anyway, so response times do not reveal which emails have accounts
+            CustomUser().set_password(password)
             return None
+        if user.check_password(password) and self.user_can_authenticate(user):
+            return user
         return None
 
     def get_user(self, user_id):
-        try:
-            return CustomUser.objects.get(pk=user_id)
-        except CustomUser.DoesNotExist:
-            return None
\ No newline at end of file
+        user_id = CustomUser._meta.pk.to_python(user_id)
+        cache = get_user_cache()
+        values, version = cache.get(user_id) if cache is not None else (None, None)
+        if values is not None:
+            # password stays deferred, so reading it loads it from the database
+            user = CustomUser.from_db(router.db_for_read(CustomUser), USER_FIELDS,
+                                      [values[name] for name in USER_FIELDS])
+            user._session_auth_hash = values['session_auth_hash']
+        else:
+            try:
+                user = CustomUser._default_manager.get(pk=user_id)
+            except CustomUser.DoesNotExist:
+                return None
+            if cache is not None:
+                values = {name: getattr(user, name) for name in USER_FIELDS}
+                values['session_auth_hash'] = user.get_session_auth_hash()
+                cache.set(user_id, values, version)
+        return user if self.user_can_authenticate(user) else None
@@ -1,20 +0,0 @@
-from django.contrib.auth.backends import BaseBackend
-from users.models import CustomUser
-
-class EmailAuthBackend(BaseBackend):
-    """Authenticate users using email instead of username."""
-
-    def authenticate(self, request, username=None, password=None, **kwargs):
-        try:
-            user = CustomUser.objects.get(email=username)
-            if user.check_password(password):
-                return user
-        except CustomUser.DoesNotExist:
-            return None
-        return None
-
-    def get_user(self, user_id):
-        try:
-            return CustomUser.objects.get(pk=user_id)
-        except CustomUser.DoesNotExist:
-            return None
@@ -0,0 +1,279 @@
+# users/chat_backends.py
+"""
+Pluggable generators for the chatbot's streamed replies.
+
+CHATBOT_BACKEND picks where reply text comes from:
+
+- 'canned' (the default) replays the matched intent's reply word by word,
+  optionally paced by CHATBOT_CANNED_DELAY to stand in for a slow model.
+- 'openai' streams a completion through the pinned openai client, from the
+  OpenAI API or any compatible server at CHATBOT_OPENAI_BASE_URL (such as
+  the one `manage.py chatbot_standin` runs).
+
+Backends are async generators, so a reply that takes seconds to generate holds
+no worker thread. The openai backend keeps one pooled HTTP client per event
+loop, bounds every connect and read by CHATBOT_BACKEND_TIMEOUT, and closes the
+upstream response as soon as the caller stops iterating, e.g. because the
+browser disconnected. Crisis messages always get the vetted canned reply, and
+any backend failure before the first chunk falls back to it too.
+
+Model replies are cached per (intent, severity earlier in the session, the
+user's message with case, punctuation and spacing normalized), in an LRU with
+a TTL. A model reply can repeat what the user wrote, so it is only ever served
+again for the same words, never to someone who wrote something else. Crisis
+turns never touch the cache, and canned replies need none: their chunks are
+precomputed on each Intent.
+"""
+import asyncio
+import logging
+import re
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from contextlib import aclosing
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+try:
+    import httpx
+    from openai import AsyncOpenAI, OpenAIError
+except ImportError:  # Only the canned backend is available
+    httpx = AsyncOpenAI = None
+    OpenAIError = Exception
+
+logger = logging.getLogger(__name__)
+
+SYSTEM_PROMPT = (
+    "You are CareConnect's supportive mental wellness assistant. Reply warmly and briefly, "
+    "suggest one practical coping step, and encourage professional help when distress is high. "
+    "The user's message reads as {intent} with {severity} severity. A suitable reply would be:\n\n{reply}"
+)
+CONTEXT_PROMPT = "\n\nEarlier in this chat the user's distress was {context}."
+WORD_RE = re.compile(r'\w+')
+
+_backend = None
+_response_cache = None
+
+
+class BackendError(Exception):
+    """The reply backend could not produce a reply"""
+
+
+class ResponseCache:
+    """
+    Thread-safe LRU of finished replies, as lists of chunks. Entries expire ttl
+    seconds after they were stored; hits, misses and evictions are counted.
+    """
+
+    def __init__(self, max_size=256, ttl=60 * 60):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires_at, chunks), least recently used first
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= time.monotonic():
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, chunks):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, list(chunks))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+
+class CannedBackend:
+    """Streams the intent's canned reply, a word at a time"""
+    # Nothing to save by caching a reply that is already precomputed
+    cacheable = False
+
+    def __init__(self, delay=0):
+        self.delay = delay
+
+    async def stream(self, message, intent, context=None):
+        for chunk in intent.chunks:
+            if self.delay:
+                await asyncio.sleep(self.delay)
+            yield chunk
+
+
+class OpenAIBackend:
+    """Streams a chat completion from the OpenAI API or a compatible server"""
+    cacheable = True
+
+    def __init__(self, model, api_key='', base_url=None, timeout=10, max_connections=100, max_tokens=300):
+        if AsyncOpenAI is None:
+            raise BackendError('The openai package is not installed')
+        self.model = model
+        self.api_key = api_key or 'unused'  # Local stand-in servers ignore the key
+        self.base_url = base_url
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.max_tokens = max_tokens
+        # httpx clients are bound to the event loop they first run on
+        self._clients = weakref.WeakKeyDictionary()
+
+    def client(self):
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None:
+            http_client = httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=self.max_connections,
+                                    max_keepalive_connections=self.max_connections),
+                timeout=httpx.Timeout(self.timeout),
+            )
+            client = AsyncOpenAI(api_key=self.api_key, base_url=self.base_url, http_client=http_client,
+                                 max_retries=0, timeout=self.timeout)
+            self._clients[loop] = client
+        return client
+
+    async def stream(self, message, intent, context=None):
+        prompt = SYSTEM_PROMPT.format(intent=intent.name, severity=intent.severity, reply=intent.message)
+        if context:
+            prompt += CONTEXT_PROMPT.format(context=context)
+        try:
+            stream = await self.client().chat.completions.create(
+                model=self.model,
+                messages=[
+                    {'role': 'system', 'content': prompt},
+                    {'role': 'user', 'content': message},
+                ],
+                max_tokens=self.max_tokens,
+                stream=True,
+            )
+        except (OpenAIError, httpx.HTTPError) as exc:
+            raise BackendError(str(exc)) from exc
+
+        try:
+            async for chunk in stream:
+                text = chunk.choices[0].delta.content if chunk.choices else None
+                if text:
+                    yield text
+        except (OpenAIError, httpx.HTTPError) as exc:
+            raise BackendError(str(exc)) from exc
+        finally:
+            # Give the pooled connection back, even when the caller was cancelled mid-stream
+            await stream.response.aclose()
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        name = getattr(settings, 'CHATBOT_BACKEND', 'canned')
+        if name == 'canned':
+            _backend = CannedBackend(delay=getattr(settings, 'CHATBOT_CANNED_DELAY', 0))
+        elif name == 'openai':
+            _backend = OpenAIBackend(
+                model=getattr(settings, 'CHATBOT_OPENAI_MODEL', 'gpt-3.5-turbo'),
+                api_key=getattr(settings, 'OPENAI_API_KEY', ''),
+                base_url=getattr(settings, 'CHATBOT_OPENAI_BASE_URL', None),
+                timeout=getattr(settings, 'CHATBOT_BACKEND_TIMEOUT', 10),
+                max_connections=getattr(settings, 'CHATBOT_BACKEND_MAX_CONNECTIONS', 100),
+                max_tokens=getattr(settings, 'CHATBOT_MAX_TOKENS', 300),
+            )
+        else:
+            raise BackendError(f'Unknown CHATBOT_BACKEND {name!r}')
+    return _backend
+
+
+def get_response_cache():
+    global _response_cache
+    if _response_cache is None:
+        _response_cache = ResponseCache(
+            max_size=getattr(settings, 'CHATBOT_RESPONSE_CACHE_SIZE', 256),
+            ttl=getattr(settings, 'CHATBOT_RESPONSE_CACHE_TTL', 60 * 60),
+        )
+    return _response_cache
+
+
+@receiver(setting_changed)
+def _reset_backend(setting, **kwargs):
+    global _backend, _response_cache
+    if setting.startswith('CHATBOT_') or setting == 'OPENAI_API_KEY':
+        # Cached replies belong to the backend that produced them
+        _backend = _response_cache = None
+
+
+def normalize_message(message):
+    """The words of message, lowercased and single-spaced, for the reply cache key"""
+    return ' '.join(WORD_RE.findall(message.lower()))
+
+
+def uses_response_cache():
+    """Whether replies depend on severity context, so callers know to look it up"""
+    return get_backend().cacheable
+
+
+async def stream_reply(message, intent, context=None):
+    """
+    Yield the reply to message in chunks, given the severity earlier in the session as
+    context. Stops quietly at CHATBOT_REPLY_TIMEOUT seconds, and falls back to the canned
+    reply if the backend fails before producing anything.
+    """
+    if intent.name == 'crisis':
+        # Always the vetted reply: never generated, never cached
+        for chunk in intent.chunks:
+            yield chunk
+        return
+
+    backend = get_backend()
+    cache = get_response_cache() if backend.cacheable else None
+    key = (intent.name, context, normalize_message(message))
+    if cache is not None:
+        cached = cache.get(key)
+        if cached is not None:
+            for chunk in cached:
+                yield chunk
+            return
+
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + getattr(settings, 'CHATBOT_REPLY_TIMEOUT', 30)
+    produced = []
+    try:
+        async with aclosing(backend.stream(message, intent, context)) as chunks:
+            async for text in chunks:
+                produced.append(text)
+                yield text
+                if loop.time() > deadline:
+                    logger.warning('Chatbot reply cut off after CHATBOT_REPLY_TIMEOUT')
+                    return
+    except BackendError:
+        logger.exception('Chatbot backend failed')
+        if produced:
+            return
+        for chunk in intent.chunks:
+            yield chunk
+        return
+    # Only complete replies are cached; a cancelled stream never gets here
+    if cache is not None and produced:
+        cache.set(key, produced)
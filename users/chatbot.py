@@ -0,0 +1,221 @@
+# users/chatbot.py
+"""
+Intent table and matcher behind the support chatbot.
+
+Each intent declares its keywords, the distress level it sets on the chat
+session and its canned reply once, in priority order. The matcher compiles
+every keyword into one regular expression at import and finds all intents
+present in a message in a single pass; the highest-priority intent wins,
+falling back to DEFAULT_INTENT.
+
+Keywords match at the start of a word and may run on ('thank' matches
+'thanks', 'panic' matches 'panicking'); words listed under whole_words must
+match exactly. Unlike plain substring checks, 'hi' no longer fires inside
+'this' or 'with'.
+
+Everything a rule-based reply needs (the response dict and the chunks a
+streamed reply is sent in) is built once per intent at import, so a turn
+only has to match.
+"""
+import re
+
+_WORD_CHAR = re.compile(r'\w')
+# A word with the whitespace around it; streamed replies are sent a chunk at a time
+_CHUNK = re.compile(r'\s*\S+\s*')
+
+# Highest distress level of each severity in the intent table; anything above is severe
+SEVERITY_LEVELS = [(4, 'mild'), (7, 'moderate')]
+SEVERITIES = ['mild', 'moderate', 'severe']
+
+
+class Intent:
+    def __init__(self, name, distress_level, severity, message, keywords=(), whole_words=()):
+        self.name = name
+        self.distress_level = distress_level
+        self.severity = severity
+        self.message = message
+        self.keywords = tuple(keywords)
+        self.whole_words = tuple(whole_words)
+        self.chunks = tuple(_CHUNK.findall(message))
+        # Shared by every turn with this intent; treat as read-only
+        self.response = {
+            'message': message,
+            'severity': severity,
+            'intent': name,
+            'distress_level': distress_level,
+        }
+
+    def __repr__(self):
+        return f'<Intent {self.name}>'
+
+
+def _trie_pattern(terms):
+    """
+    An alternation of terms factored by common prefix ('pa(?:nic(?: attack)?|...)'), so
+    the regex engine follows one branch per character instead of trying every term in
+    turn. Optional suffixes are greedy, so the longest term at a position is preferred.
+    """
+    trie = {}
+    for term in terms:
+        node = trie
+        for char in term:
+            node = node.setdefault(char, {})
+        node[''] = {}
+
+    def build(node):
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ''
+        terminal = '' in node
+        if len(branches) == 1 and not terminal:
+            return branches[0]
+        group = '(?:' + '|'.join(branches) + ')'
+        return group + '?' if terminal else group
+
+    return build(trie)
+
+
+class IntentMatcher:
+    """Finds every intent whose keywords occur in a message using one compiled regex"""
+
+    def __init__(self, intents, default):
+        self.intents = list(intents)  # Highest priority first
+        self.default = default
+        self.priority = {intent.name: rank for rank, intent in enumerate(self.intents)}
+        self.by_name = {intent.name: intent for intent in self.intents}
+        keywords, words = {}, {}
+        for intent in self.intents:
+            for keyword in intent.keywords:
+                keywords.setdefault(keyword, set()).add(intent.name)
+            for word in intent.whole_words:
+                words.setdefault(word, set()).add(intent.name)
+        # The regex reports only the longest term at each position, so fold in the shorter terms it hides
+        self.keyword_intents = {term: self._covered(term, keywords, words, False) for term in keywords}
+        self.word_intents = {term: self._covered(term, keywords, words, True) for term in words}
+
+        # A zero-width lookahead reports a match at every word start, so overlapping keywords are all found
+        self.pattern = re.compile(
+            rf'(?=\b(?:({_trie_pattern(self.keyword_intents)})|({_trie_pattern(self.word_intents)})\b))'
+        )
+
+    @staticmethod
+    def _covered(term, keywords, words, is_word):
+        """Intents of every term that also matches wherever term matches"""
+        names = set()
+        for other, intents in keywords.items():
+            if term.startswith(other):
+                names |= intents
+        for other, intents in words.items():
+            if other == term and is_word or (
+                len(term) > len(other) and term.startswith(other) and not _WORD_CHAR.match(term, len(other))
+            ):
+                names |= intents
+        return names
+
+    @staticmethod
+    def normalize(message):
+        return message.lower().replace('\u2019', "'")
+
+    def find(self, message):
+        """Names of every intent present in the message"""
+        found = set()
+        for match in self.pattern.finditer(self.normalize(message)):
+            keyword, word = match.groups()
+            found |= self.keyword_intents[keyword] if keyword else self.word_intents[word]
+        return found
+
+    def resolve(self, message):
+        """The highest-priority intent present in the message, or the default"""
+        found = self.find(message)
+        if not found:
+            return self.default
+        return self.by_name[min(found, key=self.priority.__getitem__)]
+
+
+# Highest priority first
+INTENTS = [
+    # Crisis intervention - immediate response, always the top priority
+    Intent(
+        'crisis', 10, 'severe',
+        keywords=['suicide', 'kill myself', 'end my life', 'want to die', 'hurt myself', 'self harm', 'better off dead'],
+        message="I'm very concerned about what you've shared. Your life has value and there are people who want to help right now. Please reach out immediately:\n\n **Crisis Resources:**\n• National Suicide Prevention Lifeline: **988**\n• Crisis Text Line: Text **HOME to 741741**\n• Emergency Services: **911**\n\nYou don't have to go through this alone. Would you like me to help you find local mental health resources?",
+    ),
+    Intent(
+        'anxiety', 7, 'moderate',
+        keywords=['anxious', 'panic', 'worried', 'nervous', 'scared', 'fear', 'anxiety attack', 'panic attack'],
+        message="I understand you're feeling anxious. Anxiety can be overwhelming, but there are effective ways to manage it:\n\n **Try this breathing technique:**\n• Breathe in for 4 counts\n• Hold for 4 counts\n• Breathe out for 6 counts\n• Repeat 5 times\n\n **Grounding technique (5-4-3-2-1):**\n• 5 things you can see\n• 4 things you can touch\n• 3 things you can hear\n• 2 things you can smell\n• 1 thing you can taste\n\nWould you like me to guide you through one of these techniques?",
+    ),
+    # 'tired' and "can't sleep" also appear under sleep; depression outranks it
+    Intent(
+        'depression', 6, 'moderate',
+        keywords=['depressed', 'sad', 'hopeless', 'empty', 'worthless', 'tired', 'no energy', "can't sleep", 'sleeping too much'],
+        message="I hear that you're going through a difficult time. Depression can make everything feel harder, but you're not alone in this:\n\n **Small steps that can help:**\n• Try to maintain a regular sleep schedule\n• Get some sunlight or fresh air if possible\n• Reach out to a trusted friend or family member\n• Consider gentle movement like a short walk\n• Practice self-compassion - be kind to yourself\n\n **Professional support:** If these feelings persist, talking to a mental health professional can be very helpful.\n\nWhat feels most manageable for you right now?",
+    ),
+    Intent(
+        'stress', 5, 'moderate',
+        keywords=['stressed', 'overwhelmed', 'pressure', 'burnout', 'exhausted', 'too much', "can't cope"],
+        message="Stress can feel overwhelming, but there are ways to manage it effectively:\n\n⚡ **Quick stress relief:**\n• Take 5 deep breaths\n• Do a 2-minute body scan\n• Step outside for fresh air\n• Listen to calming music\n\n📝 **Longer-term strategies:**\n• Break large tasks into smaller steps\n• Set boundaries and say no when needed\n• Practice regular self-care\n• Consider time management techniques\n\nWhat's contributing most to your stress right now? Sometimes talking through it can help.",
+    ),
+    Intent(
+        'sleep', 4, 'mild',
+        keywords=["can't sleep", 'insomnia', 'tired', 'exhausted', 'sleep problems', 'staying awake'],
+        message='Sleep problems can really affect how we feel. Here are some strategies that might help:\n\n🌙 **Sleep hygiene tips:**\n• Keep a consistent sleep schedule\n• Avoid screens 1 hour before bed\n• Create a relaxing bedtime routine\n• Keep your bedroom cool and dark\n• Avoid caffeine after 2 PM\n\n🧘 **Relaxation techniques:**\n• Progressive muscle relaxation\n• Guided meditation\n• Deep breathing exercises\n• Gentle stretching\n\nHow long have you been having trouble sleeping?',
+    ),
+    Intent(
+        'relationship', 4, 'mild',
+        keywords=['lonely', 'alone', 'relationship', 'friends', 'family problems', 'isolated', 'social'],
+        message="Relationships and social connections are so important for our wellbeing. It sounds like this is on your mind:\n\n🤝 **Building connections:**\n• Reach out to one person today, even briefly\n• Join activities or groups that interest you\n• Practice active listening in conversations\n• Be patient with yourself - relationships take time\n\n💭 **If you're feeling lonely:**\n• Remember that many people feel this way\n• Consider volunteering or helping others\n• Try online communities with shared interests\n• Professional counseling can help with social skills\n\nWhat kind of connection are you looking for right now?",
+    ),
+    Intent(
+        'work', 4, 'mild',
+        keywords=['work', 'homework', 'job', 'school', 'study', 'exam', 'deadline', 'boss', 'colleague', 'performance'],
+        message="Work and school stress is very common. Let's think about some strategies:\n\n📊 **Managing workload:**\n• Prioritize tasks by importance and urgency\n• Break large projects into smaller steps\n• Take regular breaks (even 5-10 minutes helps)\n• Communicate with supervisors about realistic expectations\n\n⚖️ **Work-life balance:**\n• Set boundaries between work and personal time\n• Practice saying no to non-essential tasks\n• Make time for activities you enjoy\n• Consider if perfectionism is adding pressure\n\nWhat aspect of work/school is most challenging for you?",
+    ),
+    Intent(
+        'mental_health', 2, 'mild',
+        keywords=['therapy', 'counseling', 'mental health', 'wellbeing', 'self care', 'meditation', 'mindfulness'],
+        message="It's wonderful that you're thinking about your mental health! Taking care of your mental wellbeing is just as important as physical health:\n\n🌱 **Self-care basics:**\n• Regular exercise (even light walking)\n• Nutritious meals and staying hydrated\n• Adequate sleep (7-9 hours for most adults)\n• Social connections and support\n\n🧘 **Mental wellness practices:**\n• Mindfulness and meditation\n• Journaling or creative expression\n• Setting healthy boundaries\n• Professional therapy when needed\n\nWhat aspect of mental health would you like to explore further?",
+    ),
+    # 'hi' and 'hey' only as whole words, so 'this' or 'which' are not greetings
+    Intent(
+        'greeting', 1, 'mild',
+        keywords=['hello', 'good morning', 'good afternoon', 'good evening'],
+        whole_words=['hi', 'hey'],
+        message="Hello! I'm glad you're here. I'm your mental health support assistant, and I'm here to listen and help in whatever way I can.\n\n💙 **I can help with:**\n• Stress and anxiety management\n• Coping strategies and techniques\n• Information about mental health resources\n• Just being someone to talk to\n\nWhat's on your mind today? Feel free to share whatever you're comfortable with.",
+    ),
+    Intent(
+        'breathing', 3, 'mild',
+        keywords=['breathing', 'breathe', 'breath'],
+        message='Great choice! Breathing exercises are very effective for managing stress and anxiety.\n\n🌬️ **4-7-8 Breathing:**\n1. Breathe in through your nose for 4 counts\n2. Hold your breath for 7 counts\n3. Exhale through your mouth for 8 counts\n4. Repeat 3-4 times\n\n📦 **Box Breathing:**\n1. Breathe in for 4 counts\n2. Hold for 4 counts\n3. Breathe out for 4 counts\n4. Hold for 4 counts\n\nTry whichever feels more comfortable for you.',
+    ),
+    Intent(
+        'journal', 3, 'mild',
+        keywords=['journal', 'writing', 'write', 'express', 'thoughts', 'feelings'],
+        message="Journaling is an excellent way to process your thoughts and emotions. Here are some prompts to get you started:\n\n📝 **Daily Reflection:**\n• How am I feeling right now?\n• What's one thing that went well today?\n• What's challenging me, and how can I address it?\n\n🙏 **Gratitude Practice:**\n• Write down 3 things you're grateful for\n• Include why each one matters to you\n\n🧩 **Problem-Solving:**\n• Describe a current challenge\n• List 3 possible solutions\n• Choose one small step to try",
+    ),
+    Intent(
+        'positive', 1, 'mild',
+        keywords=['better', 'good', 'happy', 'grateful', 'thank'],
+        message="I'm so glad to hear you're feeling better! It's wonderful that you're taking care of your mental health.\n\n✨ **To Maintain Positive Momentum:**\n• Continue the practices that are helping\n• Notice and celebrate small wins\n• Build a toolkit of coping strategies\n• Stay connected with supportive people\n\nWhat's been most helpful for you recently?",
+    ),
+]
+
+DEFAULT_INTENT = Intent('default', 2, 'mild', message="Thank you for sharing that with me. I'm here to listen and support you through whatever you're experiencing.\n\n🤗 **Remember:**\n• Your feelings are valid\n• It's okay to not be okay sometimes\n• Seeking help is a sign of strength\n• You don't have to face challenges alone\n\nIs there something specific you'd like to talk about or explore? I'm here to help in whatever way feels most useful to you right now.")
+
+MATCHER = IntentMatcher(INTENTS, DEFAULT_INTENT)
+
+
+def match_intent(message):
+    """The intent that should answer a chat message"""
+    return MATCHER.resolve(message)
+
+
+def severity_for_level(distress_level):
+    """The severity a session's distress level falls in, or None before the first turn"""
+    if distress_level is None:
+        return None
+    for upper, severity in SEVERITY_LEVELS:
+        if distress_level <= upper:
+            return severity
+    return 'severe'
+
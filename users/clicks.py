@@ -0,0 +1,357 @@
+# users/clicks.py
+"""
+Write-behind buffer for ResourceClick and sidebar impression analytics.
+
+resource_click hands each click to an in-process buffer and returns without
+touching the database. A background thread writes buffered clicks with one
+bulk_create once CLICK_FLUSH_BATCH_SIZE are waiting or the oldest has waited
+CLICK_FLUSH_INTERVAL_MS, so analytics take the SQLite write lock once per
+batch instead of once per click.
+
+The buffer holds at most CLICK_BUFFER_MAX_SIZE clicks. When it is full (the
+database has been unavailable for a while) adding a click waits up to
+CLICK_BUFFER_BLOCK_MS for room and then raises ClickBufferFull, which the
+view turns into a 429 so clients back off.
+
+With CLICK_SPOOL_DIR set, every accepted click is also appended to a
+per-process spool file before it is acknowledged. A flush moves the spool
+aside first and deletes it once the batch is committed. A process starting a
+buffer loads every spool on its host not held by a running process, its own
+pid's included, since a restarted container often gets the pid back. A crash
+between committing a batch and deleting its spool leaves clicks on disk that
+were already written; recovered clicks are checked against ResourceClick and
+only the missing ones are inserted. So are clicks put back after a failed
+flush, which may have been written in part. Buffers flush everything on interpreter
+exit.
+
+The same buffer counts sidebar impressions for the engagement rollups (see
+users/engagement.py). Those are only counters, added to the rollup rows at
+each flush and never spooled.
+"""
+import atexit
+import glob
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import IntegrityError, connection
+from django.dispatch import receiver
+from django.utils import timezone
+from .models import Resource, ResourceClick, ResourceEngagementRollup
+
+logger = logging.getLogger(__name__)
+
+SPOOL_SUFFIX = '.jsonl'
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+class ClickBufferFull(Exception):
+    """The buffer stayed full for CLICK_BUFFER_BLOCK_MS"""
+
+
+def _pid_running(pid):
+    if os.name != 'posix':
+        return True  # No safe liveness check; leave the spool alone
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class ClickBuffer:
+    def __init__(self, batch_size=100, interval_ms=1000, max_size=10000, block_ms=50, spool_dir=None,
+                 start_thread=True):
+        self.batch_size = batch_size
+        self.interval = interval_ms / 1000
+        self.max_size = max_size
+        self.block = block_ms / 1000
+        self.spool_dir = spool_dir
+        self.pending = []  # Click dicts, oldest first
+        self.impressions = Counter()  # (date, resource_id, intent, severity) -> sidebar impressions
+        self.oldest_at = None  # When the oldest pending click or impression arrived (monotonic)
+        self.flushed = 0
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()  # One flush at a time
+        self._closed = False
+        self._spool = None
+        self._spool_files = []  # Moved-aside spools whose clicks are all still pending
+        self._spool_seq = 0
+        self._thread = None
+
+        if spool_dir:
+            os.makedirs(spool_dir, exist_ok=True)
+            host = socket.gethostname().replace(os.sep, '_')
+            self.spool_path = os.path.join(spool_dir, f'clicks-{host}-{os.getpid()}{SPOOL_SUFFIX}')
+            self._recover_spools(host)
+            self._spool = open(self.spool_path, 'a')
+        if start_thread:
+            self._thread = threading.Thread(target=self._run, name='click-buffer', daemon=True)
+            self._thread.start()
+
+    def add(self, user_id, resource_id, chat_session_id=None, intent='', severity='', clicked_at=None):
+        """Buffer one click, raising ClickBufferFull if there is no room within CLICK_BUFFER_BLOCK_MS"""
+        click = {
+            'user_id': user_id,
+            'resource_id': resource_id,
+            'chat_session_id': chat_session_id,
+            'intent': intent,
+            'severity': severity,
+            'clicked_at': (clicked_at or timezone.now()).isoformat(),
+        }
+        with self._cond:
+            deadline = time.monotonic() + self.block
+            while len(self.pending) >= self.max_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or self._closed:
+                    raise ClickBufferFull(f'{len(self.pending)} clicks waiting to be written')
+                self._cond.wait(remaining)
+            if self._spool is not None:
+                self._spool.write(json.dumps(click) + '\n')
+                self._spool.flush()
+            self._started()
+            self.pending.append(click)
+            if len(self.pending) >= self.batch_size:
+                self._cond.notify_all()
+
+    def add_impressions(self, resource_ids, intent='', severity='', day=None):
+        """Count one sidebar impression for each resource; never blocks"""
+        day = day or timezone.localdate()
+        with self._cond:
+            self._started()
+            for resource_id in resource_ids:
+                self.impressions[(day, resource_id, intent, severity)] += 1
+
+    def _started(self):
+        if not self.pending and not self.impressions:
+            # Starts the flusher's CLICK_FLUSH_INTERVAL_MS countdown
+            self.oldest_at = time.monotonic()
+            self._cond.notify_all()
+
+    def _due(self):
+        return (self.pending or self.impressions) and (
+            len(self.pending) >= self.batch_size or time.monotonic() - self.oldest_at >= self.interval
+        )
+
+    def _run(self):
+        try:
+            while True:
+                with self._cond:
+                    while not self._closed and not self._due():
+                        timeout = None
+                        if self.pending or self.impressions:
+                            timeout = max(0, self.oldest_at + self.interval - time.monotonic())
+                        self._cond.wait(timeout)
+                    if self._closed:
+                        return
+                try:
+                    self.flush()
+                except Exception:
+                    logger.exception('Flushing resource clicks failed; retrying')
+                    time.sleep(self.interval)
+        finally:
+            # This thread has its own database connection
+            connection.close()
+
+    def flush(self):
+        """Write every pending click and impression, returning how many clicks were written"""
+        with self._flush_lock:
+            with self._cond:
+                clicks, self.pending = self.pending, []
+                impressions, self.impressions = self.impressions, Counter()
+                spool_files = self._spool_files
+                self._spool_files = []
+                if self._spool is not None and clicks:
+                    # New clicks go to a fresh spool while this batch is written
+                    self._spool.close()
+                    self._spool_seq += 1
+                    aside = f'{self.spool_path}.{self._spool_seq}.flushing'
+                    os.replace(self.spool_path, aside)
+                    spool_files.append(aside)
+                    self._spool = open(self.spool_path, 'a')
+                self._cond.notify_all()
+
+            written = 0
+            try:
+                if clicks:
+                    written = self._write(clicks)
+                for path in spool_files:
+                    os.remove(path)
+                clicks, spool_files = [], []
+                if impressions:
+                    self._write_impressions(impressions)
+            except Exception:
+                with self._cond:
+                    # Put back whatever was not written, in front of anything that arrived meanwhile.
+                    # The per-row fallback may have saved some before failing, so they are checked like recovered ones
+                    self.pending = [dict(click, recovered=True) for click in clicks] + self.pending
+                    self.impressions.update(impressions)
+                    self.oldest_at = time.monotonic()
+                    self._spool_files = spool_files + self._spool_files
+                raise
+            finally:
+                self.flushed += written
+            return written
+
+    @staticmethod
+    def _write(clicks):
+        clicks = ClickBuffer._unwritten(clicks)
+        rows = [ResourceClick(**{field: value for field, value in click.items() if field != 'recovered'})
+                for click in clicks]
+        try:
+            ResourceClick.objects.bulk_create(rows)
+            return len(rows)
+        except IntegrityError:
+            # A resource or session was deleted since the click; keep the rest of the batch
+            written = 0
+            for row in rows:
+                try:
+                    row.save(force_insert=True)
+                    written += 1
+                except IntegrityError:
+                    logger.warning('Dropping click on missing resource or session: resource %s', row.resource_id)
+            return written
+
+    @staticmethod
+    def _unwritten(clicks):
+        """Parse clicked_at, dropping recovered or re-queued clicks that an earlier flush already wrote"""
+        clicks = [dict(click, clicked_at=datetime.fromisoformat(click['clicked_at'])) for click in clicks]
+        recovered = [click for click in clicks if click.get('recovered')]
+        if not recovered:
+            return clicks
+        written = set()
+        for start in range(0, len(recovered), 500):
+            batch = recovered[start:start + 500]
+            written.update(ResourceClick.objects.filter(
+                clicked_at__in={click['clicked_at'] for click in batch}
+            ).values_list('user_id', 'resource_id', 'clicked_at'))
+        return [click for click in clicks if not (
+            click.get('recovered') and (click['user_id'], click['resource_id'], click['clicked_at']) in written
+        )]
+
+    @staticmethod
+    def _write_impressions(impressions):
+        # Skip resources deleted since their sidebar rendered
+        existing = set(Resource.objects.filter(id__in={key[1] for key in impressions}).values_list('id', flat=True))
+        ResourceEngagementRollup.add_counts('impressions', {
+            key: count for key, count in impressions.items() if key[1] in existing
+        })
+
+    def _recover_spools(self, host):
+        """Queue the clicks of spools left behind on this host by this pid or processes that have exited"""
+        prefix = os.path.join(self.spool_dir, f'clicks-{host}-')
+        own = []
+        left = []
+        for path in sorted(glob.glob(glob.escape(prefix) + '*')):
+            pid = path[len(prefix):].split('.', 1)[0]
+            if not pid.isdigit():
+                continue
+            if int(pid) == os.getpid():
+                # Left by an earlier process that had this pid; only one buffer runs per process
+                own.append(path)
+            elif not _pid_running(int(pid)):
+                left.append(path)
+        # Claimed names must not land on an own-pid spool that is still waiting to be claimed
+        for path in own:
+            seq = path[len(self.spool_path) + 1:].split('.', 1)[0]
+            if seq.isdigit():
+                self._spool_seq = max(self._spool_seq, int(seq))
+
+        for path in own + left:
+            # Claim the file first, so two processes starting together cannot both load it
+            self._spool_seq += 1
+            claimed = f'{self.spool_path}.{self._spool_seq}.flushing'
+            try:
+                os.replace(path, claimed)
+            except FileNotFoundError:
+                continue
+            with open(claimed) as handle:
+                clicks = [dict(json.loads(line), recovered=True) for line in handle if line.strip()]
+            if clicks and not self.pending:
+                self.oldest_at = time.monotonic()
+            self.pending.extend(clicks)
+            # Deleted by the flush that writes these clicks
+            self._spool_files.append(claimed)
+            logger.info('Recovered %d resource clicks from %s', len(clicks), path)
+
+    def close(self):
+        """Stop the flusher and write whatever is still buffered"""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        try:
+            self.flush()
+        except Exception:
+            logger.exception('Could not flush %d resource clicks on shutdown', len(self.pending))
+        if self._spool is not None:
+            self._spool.close()
+            if not self.pending and os.path.exists(self.spool_path) and not os.path.getsize(self.spool_path):
+                os.remove(self.spool_path)
+
+
+def get_buffer():
+    global _buffer
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                _buffer = ClickBuffer(
+                    batch_size=getattr(settings, 'CLICK_FLUSH_BATCH_SIZE', 100),
+                    interval_ms=getattr(settings, 'CLICK_FLUSH_INTERVAL_MS', 1000),
+                    max_size=getattr(settings, 'CLICK_BUFFER_MAX_SIZE', 10000),
+                    block_ms=getattr(settings, 'CLICK_BUFFER_BLOCK_MS', 50),
+                    spool_dir=getattr(settings, 'CLICK_SPOOL_DIR', None),
+                )
+                atexit.register(_buffer.close)
+    return _buffer
+
+
+def record_click(user_id, resource_id, chat_session_id=None, intent='', severity=''):
+    """Log a resource click: buffered when CLICK_BUFFER_ENABLED, otherwise written straight away"""
+    if not getattr(settings, 'CLICK_BUFFER_ENABLED', True):
+        ResourceClick.objects.create(user_id=user_id, resource_id=resource_id,
+                                     chat_session_id=chat_session_id, intent=intent, severity=severity)
+        return
+    get_buffer().add(user_id, resource_id, chat_session_id, intent, severity)
+
+
+def record_impressions(resources, intent='', severity=''):
+    """Count a sidebar rendering of resources, ranked for intent at a session's severity, towards their rollups"""
+    resource_ids = [resource.id if isinstance(resource, Resource) else resource['id'] for resource in resources]
+    if not resource_ids:
+        return
+    if not getattr(settings, 'CLICK_BUFFER_ENABLED', True):
+        ResourceEngagementRollup.add_counts('impressions', {
+            (timezone.localdate(), resource_id, intent, severity): 1 for resource_id in resource_ids
+        })
+        return
+    get_buffer().add_impressions(resource_ids, intent, severity)
+
+
+def shutdown():
+    """Flush and stop the current buffer, if one was started"""
+    global _buffer
+    with _buffer_lock:
+        buffer, _buffer = _buffer, None
+    if buffer is not None:
+        atexit.unregister(buffer.close)
+        buffer.close()
+
+
+@receiver(setting_changed)
+def _reset_buffer(setting, **kwargs):
+    if setting.startswith('CLICK_'):
+        shutdown()
@@ -0,0 +1,112 @@
+# users/engagement.py
+"""
+Per-resource engagement rollups: sidebar impressions, clicks and click-through.
+
+ResourceEngagementRollup keeps a row per (day, resource, intent, severity),
+where intent is the chatbot intent the sidebar was ranked for and severity is
+the chat session's: that of its distress level so far or, before the first
+turn, of the test recommendation it was opened from. Severity is recorded with
+each impression as the sidebar renders, and the page sends it back with each
+click so resource_click needs no lookup. Staff analytics and the resource
+ranker read these rows instead of scanning ResourceClick.
+
+Impressions are counted in memory as sidebars render and added to the rows
+whenever the click buffer flushes (see users/clicks.py); no row is written per
+impression. Clicks are folded in by roll_up_clicks, run periodically by
+roll_up_resource_engagement: it reads only clicks past the id stored in
+RollupWatermark and advances the mark in the same transaction that adds their
+counts, so each click is counted once however often the job runs.
+"""
+from datetime import timedelta
+from django.db import transaction
+from django.db.models import Count, F, Max, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from .chatbot import severity_for_level
+from .models import ResourceClick, ResourceEngagementRollup, RollupWatermark
+
+CLICKS_WATERMARK = 'resource_clicks'
+
+# A recommendation's severity holds the instrument's clinical label ('Moderately Severe', 'High stress', ...),
+# so the rollups go by the kind of help it recommends instead
+SEVERITY_BY_RECOMMENDATION = {
+    'self_care': 'mild',
+    'chatbot': 'moderate',
+    'counselor': 'severe',
+}
+
+
+def severity_for_session(session):
+    """The severity a chat session's sidebar is shown at, or '' if it has neither a distress level nor a recommendation"""
+    if session is None:
+        return ''
+    severity = severity_for_level(session.distress_level)
+    if severity is None and session.test_recommendation_id:
+        severity = SEVERITY_BY_RECOMMENDATION.get(session.test_recommendation.recommendation_type)
+    return severity or ''
+
+
+def roll_up_clicks(batch_size=10000):
+    """Fold clicks newer than the watermark into the rollups and return a summary"""
+    summary = {'clicks': 0, 'rows': 0, 'batches': 0}
+    while True:
+        watermark, _ = RollupWatermark.objects.get_or_create(name=CLICKS_WATERMARK)
+        newer = ResourceClick.objects.filter(id__gt=watermark.last_id)
+        batch_end = list(newer.order_by('id').values_list('id', flat=True)[batch_size - 1:batch_size])
+        last_id = batch_end[0] if batch_end else newer.aggregate(last_id=Max('id'))['last_id']
+        if last_id is None:
+            break
+
+        rows = newer.filter(id__lte=last_id).annotate(day=TruncDate('clicked_at'))\
+                    .values('day', 'resource_id', 'intent', 'severity')\
+                    .annotate(clicks=Count('id'))\
+                    .order_by()
+        counts = {(row['day'], row['resource_id'], row['intent'], row['severity']): row['clicks'] for row in rows}
+        with transaction.atomic():
+            # Moving the mark first means a concurrent run that read the same batch adds nothing
+            moved = RollupWatermark.objects.filter(name=CLICKS_WATERMARK, last_id=watermark.last_id)\
+                                           .update(last_id=last_id)
+            if not moved:
+                continue
+            ResourceEngagementRollup.add_counts('clicks', counts)
+        summary['clicks'] += sum(counts.values())
+        summary['rows'] += len(counts)
+        summary['batches'] += 1
+    summary['watermark'] = RollupWatermark.objects.get(name=CLICKS_WATERMARK).last_id
+    return summary
+
+
+def rebuild_clicks(batch_size=10000):
+    """Recount every click from scratch; impressions are kept, having no raw rows to recount"""
+    with transaction.atomic():
+        ResourceEngagementRollup.objects.update(clicks=0)
+        RollupWatermark.objects.update_or_create(name=CLICKS_WATERMARK, defaults={'last_id': 0})
+    return roll_up_clicks(batch_size)
+
+
+def recent(days):
+    """Rollup rows for the last days days, today included"""
+    return ResourceEngagementRollup.objects.filter(date__gt=timezone.localdate() - timedelta(days=days))
+
+
+def resource_summary(days=30):
+    """Impressions, clicks and CTR of each resource over the last days days, best CTR first"""
+    rows = recent(days).values('resource_id', title=F('resource__title'), resource_type=F('resource__resource_type'))\
+                       .annotate(impressions=Sum('impressions'), clicks=Sum('clicks'))\
+                       .order_by()
+    summary = [dict(row, ctr=row['clicks'] / row['impressions'] if row['impressions'] else 0.0) for row in rows]
+    summary.sort(key=lambda row: (-row['ctr'], -row['clicks'], row['resource_id']))
+    return summary
+
+
+def severity_summary(days=30):
+    """{severity: {'impressions', 'clicks', 'ctr'}} over the last days days"""
+    rows = recent(days).values('severity').annotate(impressions=Sum('impressions'), clicks=Sum('clicks')).order_by()
+    return {
+        row['severity']: {
+            'impressions': row['impressions'],
+            'clicks': row['clicks'],
+            'ctr': row['clicks'] / row['impressions'] if row['impressions'] else 0.0,
+        }
+        for row in rows
+    }
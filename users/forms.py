@@ -2,6 +2,7 @@
 from django import forms
 from django.contrib.auth.forms import UserCreationForm
 from .models import CustomUser, MentalHealthTest, MoodEntry
+from .scoring import get_instrument
 
 
 class CustomUserCreationForm(UserCreationForm):
@@ -93,12 +94,31 @@ class MoodEntryForm(forms.ModelForm):
 
 # Standardized Mental Health Assessment Forms
 
-class PHQ9Form(forms.Form):
+class AssessmentForm(forms.Form):
+    """Base form for questionnaires scored through the instrument registry"""
+    instrument_code = None
+
+    @property
+    def instrument(self):
+        return get_instrument(self.instrument_code)
+
+    def get_responses(self):
+        return [self.cleaned_data.get(field, 0) for field in self.instrument.fields]
+
+    def calculate_score(self):
+        """Calculate the total score, applying the instrument's reverse scoring"""
+        if not self.is_valid():
+            return None
+        return self.instrument.score(self.get_responses())
+
+
+class PHQ9Form(AssessmentForm):
     """
     Patient Health Questionnaire-9 (PHQ-9) for depression screening
     9 questions with 4-point scale: 0=Not at all, 1=Several days, 2=More than half the days, 3=Nearly every day
     """
     
+    instrument_code = 'PHQ-9'
     CHOICES = [
         (0, 'Not at all'),
         (1, 'Several days'),
@@ -153,23 +173,15 @@ class PHQ9Form(forms.Form):
         widget=forms.RadioSelect(attrs={'class': 'form-radio'})
     )
     
-    def calculate_score(self):
-        """Calculate total PHQ-9 score"""
-        if not self.is_valid():
-            return None
-        
-        score = 0
-        for i in range(1, 10):  # q1 to q9
-            score += int(self.cleaned_data.get(f'q{i}', 0))
-        return score
 
 
-class GAD7Form(forms.Form):
+class GAD7Form(AssessmentForm):
     """
     Generalized Anxiety Disorder 7-item scale (GAD-7)
     7 questions with 4-point scale: 0=Not at all, 1=Several days, 2=More than half the days, 3=Nearly every day
     """
     
+    instrument_code = 'GAD-7'
     CHOICES = [
         (0, 'Not at all'),
         (1, 'Several days'),
@@ -214,24 +226,16 @@ class GAD7Form(forms.Form):
         widget=forms.RadioSelect(attrs={'class': 'form-radio'})
     )
     
-    def calculate_score(self):
-        """Calculate total GAD-7 score"""
-        if not self.is_valid():
-            return None
-        
-        score = 0
-        for i in range(1, 8):  # q1 to q7
-            score += int(self.cleaned_data.get(f'q{i}', 0))
-        return score
 
 
-class PSS10Form(forms.Form):
+class PSS10Form(AssessmentForm):
     """
     Perceived Stress Scale 10-item version (PSS-10)
     10 questions with 5-point scale: 0=Never, 1=Almost never, 2=Sometimes, 3=Fairly often, 4=Very often
     Note: Questions 4, 5, 7, 8 are reverse-scored
     """
     
+    instrument_code = 'PSS'
     CHOICES = [
         (0, 'Never'),
         (1, 'Almost never'),
@@ -291,24 +295,3 @@ class PSS10Form(forms.Form):
         choices=CHOICES,
         widget=forms.RadioSelect(attrs={'class': 'form-radio'})
     )
-    
-    def calculate_score(self):
-        """Calculate total PSS-10 score with reverse scoring for questions 4, 5, 7, 8"""
-        if not self.is_valid():
-            return None
-        
-        score = 0
-        reverse_questions = [4, 5, 7, 8]  # Questions that need reverse scoring
-        
-        for i in range(1, 11):  # q1 to q10
-            raw_score = int(self.cleaned_data.get(f'q{i}', 0))
-            
-            if i in reverse_questions:
-                # Reverse score: 0->4, 1->3, 2->2, 3->1, 4->0
-                score += (4 - raw_score)
-            else:
-                score += raw_score
-                
-        return score
-
-
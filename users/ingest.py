@@ -0,0 +1,246 @@
+# users/ingest.py
+"""
+Bulk ingestion of historical assessments from partner clinics.
+
+Rows are read from CSV or JSONL, validated and scored a chunk at a time through
+the instrument registry, and written with bulk_create in one transaction per
+chunk. MentalHealthTest.save() side effects are replaced by set-based work:
+recommendations are bulk inserted alongside the tests and the analytics rollups
+are rebuilt once at the end.
+"""
+import csv
+import json
+import time
+from datetime import datetime
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from .models import CustomUser, DailyTestRollup, IngestCheckpoint, MentalHealthTest, TestRecommendation
+from .reports import touch_reports
+from .scoring import get_instrument
+
+DEFAULT_CHUNK_SIZE = 5000
+
+
+class IngestResult:
+    def __init__(self):
+        self.created = 0
+        self.skipped = 0
+        self.resumed_from = 0
+        self.errors = []
+        self.elapsed = 0.0
+
+    @property
+    def rate(self):
+        """Tests created per minute"""
+        return self.created / self.elapsed * 60 if self.elapsed else 0
+
+
+class MalformedRow:
+    """Stands in for a line that is not valid JSON, so it is reported as a bad row with its line number"""
+
+    def __init__(self, error):
+        self.error = error
+
+
+def read_rows(path):
+    """Yield rows from a .csv or .jsonl file: dicts, or whatever else a JSONL line holds, or MalformedRow"""
+    with open(path, newline='', encoding='utf-8') as handle:
+        if path.endswith('.csv'):
+            yield from csv.DictReader(handle)
+        else:
+            for line in handle:
+                if line.strip():
+                    try:
+                        yield json.loads(line)
+                    except ValueError as e:
+                        yield MalformedRow(f'Invalid JSON: {e}')
+
+
+def _parse_date_taken(value):
+    if value in (None, ''):
+        return timezone.now()
+    if isinstance(value, datetime):
+        parsed = value
+    elif isinstance(value, str):
+        parsed = parse_datetime(value)
+        if parsed is None:
+            day = parse_date(value)
+            if day is None:
+                raise ValueError(f'Invalid date_taken {value!r}')
+            parsed = datetime(day.year, day.month, day.day)
+    else:
+        raise ValueError(f'Invalid date_taken {value!r}')
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+def _responses(row, instrument):
+    """Item responses from either a 'responses' list or q1..qN columns, or None if absent"""
+    if row.get('responses') is not None:
+        return row['responses']
+    if all(row.get(field) not in (None, '') for field in instrument.fields):
+        return [row[field] for field in instrument.fields]
+    return None
+
+
+def _row_user_id(row):
+    """The row's user_id as an int, None if it has none, or the raw value if it is not a number"""
+    user_id = row.get('user_id')
+    if user_id in (None, ''):
+        return None
+    try:
+        return int(user_id)
+    except (TypeError, ValueError):
+        return user_id
+
+
+def _resolve_users(chunk):
+    """({email: user id}, {user ids that exist}) for the users a chunk refers to"""
+    chunk = [row for row in chunk if isinstance(row, dict)]
+    emails = {str(row.get('email') or '').lower() for row in chunk if _row_user_id(row) is None}
+    emails.discard('')
+    users_by_email = {}
+    if emails:
+        users_by_email = {
+            email.lower(): user_id
+            for email, user_id in CustomUser.objects.filter(email__in=emails).values_list('email', 'id')
+        }
+    ids = {user_id for user_id in map(_row_user_id, chunk) if isinstance(user_id, int)}
+    existing_ids = set(CustomUser.objects.filter(id__in=ids).values_list('id', flat=True)) if ids else set()
+    return users_by_email, existing_ids
+
+
+def _build_chunk(rows, users_by_email, existing_ids, result, first_line):
+    """Validate and score one chunk of rows, returning unsaved MentalHealthTest objects"""
+    tests = []
+    pending = {}  # instrument code -> [(test, responses)]
+
+    for offset, row in enumerate(rows):
+        line = first_line + offset
+        try:
+            if isinstance(row, MalformedRow):
+                raise ValueError(row.error)
+            if not isinstance(row, dict):
+                raise ValueError(f'Expected a JSON object, got {type(row).__name__}')
+            instrument = get_instrument(row.get('test_type'))
+            if instrument is None:
+                raise ValueError(f"Unknown test type {row.get('test_type')!r}")
+
+            user_id = _row_user_id(row)
+            if user_id is None:
+                user_id = users_by_email.get(str(row.get('email') or '').lower())
+            elif user_id not in existing_ids:
+                # SQLite would only reject the foreign key at commit, failing the whole chunk
+                user_id = None
+            if user_id is None:
+                raise ValueError(f"Unknown user {row.get('user_id') or row.get('email')!r}")
+
+            test = MentalHealthTest(
+                user_id=user_id,
+                test_type=instrument.code,
+                date_taken=_parse_date_taken(row.get('date_taken')),
+            )
+            item9 = row.get('phq9_item9_score')
+            test.phq9_item9_score = int(item9) if item9 not in (None, '') else None
+
+            responses = _responses(row, instrument)
+            if responses is not None:
+                responses = instrument.validate(responses)
+                if instrument.code == 'PHQ-9' and test.phq9_item9_score is None:
+                    test.phq9_item9_score = responses[8]
+                pending.setdefault(instrument.code, []).append((test, responses))
+            else:
+                score = int(row.get('score'))
+                if not 0 <= score <= instrument.max_score:
+                    raise ValueError(f'{instrument.code} score must be between 0 and {instrument.max_score}')
+                test.score = score
+                test.severity = instrument.severity(score)
+            tests.append(test)
+        except (TypeError, ValueError) as e:
+            result.skipped += 1
+            result.errors.append((line, str(e)))
+
+    # Score every response vector of an instrument in one vectorized call
+    for code, items in pending.items():
+        scores, severities = get_instrument(code).score_batch([responses for _, responses in items])
+        for (test, _), score, severity in zip(items, scores, severities):
+            test.score = score
+            test.severity = severity
+
+    for test in tests:
+        test.apply_category()
+        test.recommendation_type = test.get_recommendation_type(test.severity)
+        test.caution = test.compute_caution(test.severity)
+    return tests
+
+
+def _write_chunk(tests, checkpoint, rows_done):
+    """Write a chunk's tests and advance the checkpoint in one transaction, so a crash can never split them"""
+    with transaction.atomic():
+        if checkpoint:
+            IngestCheckpoint.objects.update_or_create(name=checkpoint, defaults={'rows_done': rows_done})
+        MentalHealthTest.objects.bulk_create(tests)
+        TestRecommendation.objects.bulk_create([
+            TestRecommendation(
+                test=test,
+                severity=test.severity,
+                recommendation_type=test.recommendation_type
+            )
+            for test in tests
+        ])
+
+
+def _load_checkpoint(checkpoint):
+    if not checkpoint:
+        return 0
+    return IngestCheckpoint.objects.filter(name=checkpoint).values_list('rows_done', flat=True).first() or 0
+
+
+def bulk_ingest_tests(rows, chunk_size=DEFAULT_CHUNK_SIZE, checkpoint=None, rebuild_rollups=True, progress=None):
+    """
+    Ingest an iterable of row dicts (see read_rows) and return an IngestResult.
+
+    Each row needs test_type, either email or user_id, and either item responses
+    (a 'responses' list or q1..qN) or a precomputed score. date_taken and
+    phq9_item9_score are optional. When checkpoint names the import, the number of
+    rows committed so far is stored in IngestCheckpoint with every chunk and a
+    rerun under the same name skips them.
+    progress, if given, is called with the running IngestResult after each chunk.
+    """
+    result = IngestResult()
+    rows_done = _load_checkpoint(checkpoint)
+    result.resumed_from = rows_done
+    start = time.perf_counter()
+
+    rows = iter(rows)
+    for _ in range(rows_done):
+        if next(rows, None) is None:
+            break
+
+    touched_users = set()
+    while True:
+        chunk = [row for _, row in zip(range(chunk_size), rows)]
+        if not chunk:
+            break
+
+        users_by_email, existing_ids = _resolve_users(chunk)
+        tests = _build_chunk(chunk, users_by_email, existing_ids, result, rows_done + 1)
+        rows_done += len(chunk)
+        if tests or checkpoint:
+            _write_chunk(tests, checkpoint, rows_done)
+            touched_users.update(test.user_id for test in tests)
+        result.created += len(tests)
+        result.elapsed = time.perf_counter() - start
+        if progress:
+            progress(result)
+
+    # Invalidate cached reports with one statement rather than once per test
+    if touched_users:
+        touch_reports(touched_users)
+    if rebuild_rollups and result.created:
+        DailyTestRollup.rebuild()
+
+    result.elapsed = time.perf_counter() - start
+    return result
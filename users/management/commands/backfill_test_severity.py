@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from users.models import MentalHealthTest
+
+class Command(BaseCommand):
+    help = 'Backfills stored severity, recommendation type and caution flag on existing tests'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Tests updated per transaction')
+        parser.add_argument('--all', action='store_true', help='Recompute every test, not only those missing a severity')
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        tests = MentalHealthTest.objects.only('id', 'test_type', 'score', 'phq9_item9_score', 'severity')
+        if not options['all']:
+            tests = tests.filter(severity='')
+
+        updated = 0
+        last_id = 0
+        while True:
+            # Walk the table by primary key so each chunk is an indexed range scan
+            chunk = list(tests.filter(id__gt=last_id).order_by('id')[:chunk_size])
+            if not chunk:
+                break
+            for test in chunk:
+                test.apply_severity()
+            with transaction.atomic():
+                MentalHealthTest.objects.bulk_update(chunk, ['severity', 'recommendation_type', 'caution'])
+            updated += len(chunk)
+            last_id = chunk[-1].id
+            self.stdout.write(f"Updated {updated} tests")
+
+        self.stdout.write(self.style.SUCCESS(f"Successfully backfilled {updated} tests"))
@@ -0,0 +1,55 @@
+import random
+import time
+from django.core.management.base import BaseCommand
+from users.chatbot import DEFAULT_INTENT, INTENTS, MATCHER
+
+SAMPLE_MESSAGES = [
+    "I've been feeling anxious about work",
+    "I can't sleep lately and I'm so tired",
+    "I'm so stressed with exams and deadlines",
+    "Can you help me with breathing exercises?",
+    "I want to journal my thoughts",
+    "I feel lonely since moving to a new city",
+    "Thanks, that helps a lot",
+    "Honestly I don't know how to describe what's going on, it's been a long week",
+]
+
+
+def substring_intent(message):
+    """The previous routing: one substring scan per keyword, first matching intent wins"""
+    message_lower = message.lower()
+    for intent in INTENTS:
+        if any(keyword in message_lower for keyword in intent.keywords + intent.whole_words):
+            return intent
+    return DEFAULT_INTENT
+
+
+class Command(BaseCommand):
+    help = 'Compares sequential substring scans with the compiled intent matcher for chatbot messages'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=200000)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        messages = [rng.choice(SAMPLE_MESSAGES) for _ in range(options['messages'])]
+        count = len(messages)
+
+        start = time.perf_counter()
+        for message in messages:
+            substring_intent(message)
+        substring_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for message in messages:
+            MATCHER.resolve(message)
+        compiled_time = time.perf_counter() - start
+
+        keywords = sum(len(intent.keywords) + len(intent.whole_words) for intent in INTENTS)
+        self.stdout.write(
+            f'{count} messages, {keywords} keywords | substring scans {substring_time:.3f}s '
+            f'({count / substring_time:,.0f}/s) | compiled {compiled_time:.3f}s '
+            f'({count / compiled_time:,.0f}/s) | {substring_time / compiled_time:.1f}x'
+        )
+        self.stdout.write(self.style.SUCCESS('Intent matcher benchmark complete'))
@@ -0,0 +1,95 @@
+import statistics
+import threading
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection
+from users.chatbot import match_intent
+from users.models import ChatMessage, ChatSession, CustomUser
+from .benchmark_views import percentile
+from .generate_load_data import CHAT_LINES, LOAD_EMAIL_DOMAIN
+
+
+def legacy_turn(user_id, session_id, message):
+    """The previous write path: lookup, two single-row inserts and a full-row save, each autocommitted"""
+    session = ChatSession.objects.filter(user_id=user_id, ended_at__isnull=True).first()
+    if not session:
+        session = ChatSession.objects.create(user_id=user_id)
+    ChatMessage.objects.create(session=session, message_type='user', content=message)
+    intent = match_intent(message)
+    ChatMessage.objects.create(session=session, message_type='system', content=intent.message)
+    session.distress_level = intent.distress_level
+    session.save()
+
+
+def single_transaction_turn(user_id, session_id, message):
+    """The current write path, with the session id already cached"""
+    intent = match_intent(message)
+    ChatSession.record_turn(session_id, user_id, message, intent.message, intent.distress_level)
+
+
+class Command(BaseCommand):
+    help = 'Measures chatbot turn write latency with concurrent writers, before and after the single-transaction path'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--writers', type=int, default=8, help='Concurrent threads, one user each')
+        parser.add_argument('--turns', type=int, default=50, help='Turns per writer')
+
+    def handle(self, *args, **options):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            raise CommandError('Lock contention needs a file database')
+        users = list(CustomUser.objects.filter(email__endswith=f'@{LOAD_EMAIL_DOMAIN}')
+                     .values_list('id', flat=True)[:options['writers']])
+        if len(users) < options['writers']:
+            raise CommandError(f"Need {options['writers']} users; run generate_load_data first")
+
+        sessions = {}
+        for user_id in users:
+            session = ChatSession.objects.filter(user_id=user_id, ended_at__isnull=True).first()
+            sessions[user_id] = (session or ChatSession.objects.create(user_id=user_id)).id
+        first_message_id = (ChatMessage.objects.order_by('-id').values_list('id', flat=True).first() or 0) + 1
+
+        try:
+            for label, turn in [('legacy', legacy_turn), ('single transaction', single_transaction_turn)]:
+                self.run(label, turn, sessions, options['turns'])
+        finally:
+            # Drop the messages the benchmark wrote
+            ChatMessage.objects.filter(id__gte=first_message_id, session_id__in=sessions.values()).delete()
+        self.stdout.write(self.style.SUCCESS('Chatbot write benchmark complete'))
+
+    def run(self, label, turn, sessions, turns):
+        timings, errors = [], []
+        lock = threading.Lock()
+        barrier = threading.Barrier(len(sessions))
+
+        def writer(index, user_id):
+            try:
+                barrier.wait()
+                for i in range(turns):
+                    message = CHAT_LINES[(index + i) % len(CHAT_LINES)]
+                    start = time.perf_counter()
+                    try:
+                        turn(user_id, sessions[user_id], message)
+                    except OperationalError as exc:  # "database is locked" after the busy timeout
+                        with lock:
+                            errors.append(exc)
+                        continue
+                    with lock:
+                        timings.append(time.perf_counter() - start)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=writer, args=(index, user_id)) for index, user_id in enumerate(sessions)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        if not timings:
+            raise CommandError(f'{label}: every turn failed ({errors[0]})')
+        self.stdout.write(
+            f'{label:20} {len(timings)} turns in {elapsed:.2f}s ({len(timings) / elapsed:,.0f}/s) | '
+            f'p50 {statistics.median(timings) * 1000:.2f}ms  p95 {percentile(timings, 95) * 1000:.2f}ms  '
+            f'max {max(timings) * 1000:.2f}ms | lock errors {len(errors)}'
+        )
@@ -0,0 +1,43 @@
+import random
+import time
+from django.core.management.base import BaseCommand
+from users.scoring import INSTRUMENTS, np
+
+class Command(BaseCommand):
+    help = 'Compares per-row and batch scoring throughput for each assessment instrument'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=100000, help='Response vectors scored per instrument')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rows = options['rows']
+        rng = random.Random(options['seed'])
+        if np is None:
+            self.stdout.write(self.style.WARNING('NumPy is not installed; batch scoring falls back to the per-row path'))
+
+        for code, instrument in INSTRUMENTS.items():
+            responses = [
+                [rng.randint(0, instrument.max_response) for _ in range(instrument.items)]
+                for _ in range(rows)
+            ]
+
+            start = time.perf_counter()
+            row_scores = [instrument.score(row) for row in responses]
+            row_severities = [instrument.severity(score) for score in row_scores]
+            row_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            batch_scores, batch_severities = instrument.score_batch(responses)
+            batch_time = time.perf_counter() - start
+
+            if row_scores != batch_scores or row_severities != batch_severities:
+                self.stdout.write(self.style.ERROR(f'{code}: batch results differ from per-row results'))
+                continue
+
+            self.stdout.write(
+                f'{code}: {rows} rows | per-row {row_time:.3f}s ({rows / row_time:,.0f}/s) | '
+                f'batch {batch_time:.3f}s ({rows / batch_time:,.0f}/s) | {row_time / batch_time:.1f}x'
+            )
+
+        self.stdout.write(self.style.SUCCESS('Scoring benchmark complete'))
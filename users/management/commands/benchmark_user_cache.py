@@ -0,0 +1,73 @@
+import statistics
+import time
+from django.contrib.auth import get_backends
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from users.auth_backends import EmailAuthBackend, get_user_cache
+from users.models import CustomUser
+from .benchmark_views import percentile
+from .generate_load_data import LOAD_EMAIL_DOMAIN
+
+USER_TABLE = f'"{CustomUser._meta.db_table}"'
+
+
+class Command(BaseCommand):
+    help = 'Measures request.user resolution with and without the cached EmailAuthBackend.get_user'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='users:dashboard', help='URL name to request as a logged-in user')
+        parser.add_argument('--requests', type=int, default=200)
+        parser.add_argument('--users', type=int, default=50, help='Distinct users to resolve with get_user')
+
+    def handle(self, *args, **options):
+        backend = next((backend for backend in get_backends() if isinstance(backend, EmailAuthBackend)), None)
+        if backend is None:
+            raise CommandError('users.auth_backends.EmailAuthBackend is not in AUTHENTICATION_BACKENDS')
+        user_ids = list(CustomUser.objects.filter(email__endswith=f'@{LOAD_EMAIL_DOMAIN}')
+                        .order_by('id').values_list('id', flat=True)[:options['users']])
+        if not user_ids:
+            raise CommandError('No load users; run generate_load_data first')
+
+        for label, enabled in [('uncached', False), ('cached', True)]:
+            with override_settings(AUTH_USER_CACHE_ENABLED=enabled):
+                self.run_get_user(label, backend, user_ids, options['requests'])
+                self.run_requests(label, CustomUser.objects.get(id=user_ids[0]), options['url'], options['requests'])
+                if enabled:
+                    stats = get_user_cache().stats()
+                    self.stdout.write(f"{'':10} cache: {stats['hits']} hits, {stats['misses']} misses, "
+                                      f"{stats['hit_rate']:.1%} hit rate")
+        self.stdout.write(self.style.SUCCESS('User cache benchmark complete'))
+
+    def run_get_user(self, label, backend, user_ids, lookups):
+        timings = []
+        with CaptureQueriesContext(connection) as queries:
+            for i in range(lookups):
+                start = time.perf_counter()
+                backend.get_user(user_ids[i % len(user_ids)])
+                timings.append(time.perf_counter() - start)
+        self.stdout.write(
+            f"{label:10} get_user x{lookups}: {len(queries)} queries | "
+            f"p50 {statistics.median(timings) * 1000:.3f}ms  p95 {percentile(timings, 95) * 1000:.3f}ms"
+        )
+
+    def run_requests(self, label, user, url_name, requests):
+        client = Client(HTTP_HOST='localhost')
+        client.force_login(user)
+        url = reverse(url_name)
+        client.get(url)  # Warm up templates, and the cache when it is on
+        timings, user_queries, total_queries = [], 0, 0
+        for _ in range(requests):
+            with CaptureQueriesContext(connection) as queries:
+                start = time.perf_counter()
+                client.get(url)
+                timings.append(time.perf_counter() - start)
+            total_queries += len(queries)
+            user_queries += sum(USER_TABLE in query['sql'] for query in queries)
+        self.stdout.write(
+            f"{label:10} GET {url} x{requests}: {total_queries / requests:.1f} queries/request, "
+            f"{user_queries / requests:.1f} on {USER_TABLE} | "
+            f"p50 {statistics.median(timings) * 1000:.2f}ms  p95 {percentile(timings, 95) * 1000:.2f}ms"
+        )
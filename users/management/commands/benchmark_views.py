@@ -0,0 +1,203 @@
+import json
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import URLPattern, get_resolver, reverse
+from games.models import Game
+from users import clicks
+from users.models import CustomUser, MentalHealthTest, Resource
+from .generate_load_data import LOAD_EMAIL_DOMAIN
+
+BENCHMARK_NAMESPACES = ['users', 'meditation', 'games']
+
+# Buffered clicks are only written when the run ends, inside its transaction
+CLICK_FLUSH_DEFERRED_MS = 24 * 60 * 60 * 1000
+
+# A 1x1 PNG for the drawing upload endpoint
+SAMPLE_PNG = 'iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAIAAACQd1PeAAAADElEQVR4nGP4z8AAAAMBAQDJ/pLvAAAAAElFTkSuQmCC'
+
+# How to call each endpoint: HTTP method, JSON/form payload and URL kwargs.
+# Anything not listed is fetched with a plain GET.
+REQUEST_SPECS = {
+    'users:chatbot:post': {'name': 'users:chatbot', 'method': 'post', 'data': {'message': "I'm feeling anxious about work"},
+                           'headers': {'HTTP_X_REQUESTED_WITH': 'XMLHttpRequest'}},
+    'users:chatbot_stream': {'method': 'post', 'data': {'message': "I'm feeling anxious about work"}},
+    'users:resource_click': {'method': 'post', 'kwargs': lambda ctx: {'resource_id': ctx['resource_id']}},
+    'users:test_detail': {'kwargs': lambda ctx: {'pk': ctx['test_id']}},
+    'users:end_chat_session': {'method': 'post'},
+    'users:logout': {'method': 'post', 'fresh_login': True},
+    'meditation:save_session': {'method': 'post', 'json': {'duration': 10}},
+    'games:play_game': {'kwargs': lambda ctx: {'game_id': ctx['game_id']}},
+    'games:leaderboard': {'kwargs': lambda ctx: {'game_id': ctx['game_id']}},
+    'games:complete_game': {'method': 'post', 'json': lambda ctx: {'game_id': ctx['game_id'], 'score': 50}},
+    'games:save_game_session': {'method': 'post', 'data': lambda ctx: {'game_id': ctx['game_id'], 'score': 50,
+                                                                        'duration': 60, 'completed': 'true'}},
+    'games:telemetry': {'method': 'post', 'json': lambda ctx: {
+        'game_id': ctx['game_id'], 'play_id': '6f1c1d3e-2b7a-4c55-9d3e-0a4b5c6d7e8f',
+        'events': [{'type': 'stroke', 'at': i * 100} for i in range(20)],
+    }},
+    'games:save_drawing': {'method': 'post', 'json': {'image': 'data:image/png;base64,' + SAMPLE_PNG}},
+}
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+class Command(BaseCommand):
+    help = ('Benchmarks every users, meditation and games URL and records p50/p95 latency and query counts. '
+            'Every write is rolled back, so repeated runs see the same data.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--email', help='User to benchmark as (defaults to the generate_load_data staff user)')
+        parser.add_argument('--iterations', type=int, default=20)
+        parser.add_argument('--output', default='bench_baseline.json', help='Where to write the results')
+        parser.add_argument('--compare', help='Earlier baseline to compare against')
+        parser.add_argument('--threshold', type=float, default=20.0,
+                            help='Percent p95 slowdown that counts as a regression')
+        parser.add_argument('--min-delta-ms', type=float, default=2.0,
+                            help='Ignore p95 slowdowns smaller than this, which are mostly noise')
+
+    def handle(self, *args, **options):
+        email = options['email'] or f'load0@{LOAD_EMAIL_DOMAIN}'
+        user = CustomUser.objects.filter(email=email).first()
+        if user is None:
+            raise CommandError(f"User {email} not found; run generate_load_data first or pass --email")
+
+        test = MentalHealthTest.objects.filter(user=user).only('id').first()
+        context = {
+            'test_id': test.id if test else 0,
+            'resource_id': Resource.objects.values_list('id', flat=True).first() or 0,
+            'game_id': Game.objects.values_list('id', flat=True).first() or 0,
+        }
+
+        # Broken endpoints are reported by status code rather than logged tracebacks
+        request_logger = logging.getLogger('django.request')
+        previous_level = request_logger.level
+        request_logger.setLevel(logging.CRITICAL)
+        try:
+            with tempfile.TemporaryDirectory() as scratch:
+                results = self.run_isolated(user, context, options['iterations'], scratch)
+        finally:
+            request_logger.setLevel(previous_level)
+
+        baseline = {
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'iterations': options['iterations'],
+            'results': results,
+        }
+        with open(options['output'], 'w') as handle:
+            json.dump(baseline, handle, indent=2)
+        self.stdout.write(self.style.SUCCESS(f"Wrote {len(results)} endpoint results to {options['output']}"))
+
+        if options['compare']:
+            self.compare(options['compare'], results, options['threshold'], options['min_delta_ms'])
+
+    def run_isolated(self, user, context, iterations, scratch):
+        """
+        Run every request inside one transaction that is rolled back afterwards, with
+        uploads and telemetry going to scratch, so the data the next run benchmarks
+        against is the same as this one's.
+        """
+        isolated = override_settings(
+            MEDIA_ROOT=os.path.join(scratch, 'media'),
+            TELEMETRY_ROOT=os.path.join(scratch, 'telemetry'),
+            CLICK_SPOOL_DIR=None,
+            # Flushed on this thread's connection at the end, never by the background thread
+            CLICK_FLUSH_BATCH_SIZE=sys.maxsize,
+            CLICK_FLUSH_INTERVAL_MS=CLICK_FLUSH_DEFERRED_MS,
+        )
+        with isolated, transaction.atomic():
+            try:
+                client = Client(HTTP_HOST='localhost', raise_request_exception=False)
+                client.force_login(user)
+                return self.run_all(client, user, context, iterations)
+            finally:
+                clicks.shutdown()
+                transaction.set_rollback(True)
+
+    def run_all(self, client, user, context, iterations):
+        results = {}
+        for key, spec in self.request_specs():
+            timings, queries, statuses = [], [], set()
+            for _ in range(iterations):
+                request_client = client
+                if spec.get('fresh_login'):
+                    request_client = Client(HTTP_HOST='localhost', raise_request_exception=False)
+                    request_client.force_login(user)
+                elapsed, query_count, status = self.run_request(request_client, spec, context)
+                timings.append(elapsed)
+                queries.append(query_count)
+                statuses.add(status)
+
+            results[key] = {
+                'p50_ms': round(statistics.median(timings) * 1000, 2),
+                'p95_ms': round(percentile(timings, 95) * 1000, 2),
+                'queries': max(queries),
+                'status': sorted(statuses),
+            }
+            self.stdout.write(
+                f"{key:32} p50 {results[key]['p50_ms']:8.2f}ms  p95 {results[key]['p95_ms']:8.2f}ms  "
+                f"queries {results[key]['queries']:3}  status {results[key]['status']}"
+            )
+        return results
+
+    def request_specs(self):
+        """Yield (key, spec) for every named URL in the benchmarked namespaces"""
+        resolver = get_resolver()
+        for namespace in BENCHMARK_NAMESPACES:
+            _, app_resolver = resolver.namespace_dict[namespace]
+            for pattern in app_resolver.url_patterns:
+                if not isinstance(pattern, URLPattern) or not pattern.name:
+                    continue
+                key = f'{namespace}:{pattern.name}'
+                yield key, dict(REQUEST_SPECS.get(key, {}), name=key)
+                if f'{key}:post' in REQUEST_SPECS:
+                    yield f'{key}:post', REQUEST_SPECS[f'{key}:post']
+
+    def run_request(self, client, spec, context):
+        kwargs = spec.get('kwargs', lambda ctx: {})(context)
+        url = reverse(spec['name'], kwargs=kwargs)
+        method = getattr(client, spec.get('method', 'get'))
+        request_kwargs = dict(spec.get('headers', {}))
+        if 'json' in spec:
+            payload = spec['json'](context) if callable(spec['json']) else spec['json']
+            request_kwargs.update(data=json.dumps(payload), content_type='application/json')
+        elif 'data' in spec:
+            request_kwargs['data'] = spec['data'](context) if callable(spec['data']) else spec['data']
+
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            response = method(url, **request_kwargs)
+            elapsed = time.perf_counter() - start
+        return elapsed, len(queries), response.status_code
+
+    def compare(self, path, results, threshold, min_delta_ms):
+        with open(path) as handle:
+            previous = json.load(handle)['results']
+
+        regressions = []
+        for key, current in results.items():
+            before = previous.get(key)
+            if before is None:
+                continue
+            delta = current['p95_ms'] - before['p95_ms']
+            if before['p95_ms'] and delta > min_delta_ms and delta / before['p95_ms'] * 100 > threshold:
+                regressions.append(f"{key}: p95 {before['p95_ms']}ms -> {current['p95_ms']}ms")
+            if current['queries'] > before['queries']:
+                regressions.append(f"{key}: queries {before['queries']} -> {current['queries']}")
+
+        if regressions:
+            for line in regressions:
+                self.stdout.write(self.style.ERROR(line))
+            raise CommandError(f"{len(regressions)} regressions against {path}")
+        self.stdout.write(self.style.SUCCESS(f"No regressions against {path}"))
@@ -0,0 +1,45 @@
+import os
+from django.core.management.base import BaseCommand, CommandError
+from users.ingest import DEFAULT_CHUNK_SIZE, bulk_ingest_tests, read_rows
+
+class Command(BaseCommand):
+    help = 'Bulk imports historical assessments from a CSV or JSONL file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV or JSONL file of assessments')
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help='Rows written per transaction')
+        parser.add_argument('--checkpoint', help='Name progress is recorded under (defaults to the absolute path)')
+        parser.add_argument('--no-checkpoint', action='store_true', help='Do not record or resume progress')
+        parser.add_argument('--skip-rollups', action='store_true', help='Do not rebuild analytics rollups afterwards')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if not os.path.exists(path):
+            raise CommandError(f"File not found: {path}")
+
+        checkpoint = None
+        if not options['no_checkpoint']:
+            checkpoint = options['checkpoint'] or os.path.abspath(path)
+
+        def progress(result):
+            self.stdout.write(f"Imported {result.created} tests ({result.rate:,.0f} tests/min)")
+
+        result = bulk_ingest_tests(
+            read_rows(path),
+            chunk_size=options['chunk_size'],
+            checkpoint=checkpoint,
+            rebuild_rollups=not options['skip_rollups'],
+            progress=progress,
+        )
+
+        if result.resumed_from:
+            self.stdout.write(f"Resumed after {result.resumed_from} rows recorded for {checkpoint}")
+        for line, error in result.errors[:20]:
+            self.stdout.write(self.style.WARNING(f"Row {line}: {error}"))
+        if len(result.errors) > 20:
+            self.stdout.write(self.style.WARNING(f"... and {len(result.errors) - 20} more invalid rows"))
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Successfully imported {result.created} tests, skipped {result.skipped} "
+            f"in {result.elapsed:.1f}s ({result.rate:,.0f} tests/min)"
+        ))
@@ -0,0 +1,91 @@
+import asyncio
+import json
+import re
+import time
+import uuid
+from django.core.management.base import BaseCommand
+from users.chatbot import match_intent
+
+
+async def _read_request(reader):
+    """(method, path, body) of the next HTTP/1.1 request on a keep-alive connection, or None at EOF"""
+    head = await reader.readuntil(b'\r\n\r\n')
+    request_line, *header_lines = head.decode('latin1').split('\r\n')
+    headers = {}
+    for line in header_lines:
+        name, _, value = line.partition(':')
+        headers[name.strip().lower()] = value.strip()
+    body = await reader.readexactly(int(headers.get('content-length', 0)))
+    method, path, _ = request_line.split(' ', 2)
+    return method, path, body
+
+
+def _chunk(data):
+    return f'{len(data):x}\r\n'.encode() + data + b'\r\n'
+
+
+class Command(BaseCommand):
+    help = 'Runs a local OpenAI-compatible server that streams canned chatbot replies, for development and load tests'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8001)
+        parser.add_argument('--delay', type=float, default=0.05, help='Seconds between streamed words')
+
+    def handle(self, *args, **options):
+        self.delay = options['delay']
+        try:
+            asyncio.run(self.serve(options['host'], options['port']))
+        except KeyboardInterrupt:
+            pass
+
+    async def serve(self, host, port):
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        self.stdout.write(self.style.SUCCESS(
+            f'Stand-in chatbot backend on http://{host}:{port}/v1 '
+            f'(set CHATBOT_BACKEND=openai CHATBOT_OPENAI_BASE_URL=http://{host}:{port}/v1)'
+        ))
+        async with server:
+            await server.serve_forever()
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    method, path, body = await _read_request(reader)
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    return
+                if method == 'POST' and path.rstrip('/').endswith('/chat/completions'):
+                    await self.stream_completion(writer, json.loads(body or b'{}'))
+                else:
+                    writer.write(b'HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\n\r\n')
+                    await writer.drain()
+        except ConnectionError:
+            pass  # The client went away mid-reply
+        finally:
+            writer.close()
+
+    async def stream_completion(self, writer, payload):
+        messages = payload.get('messages') or [{}]
+        reply = match_intent(messages[-1].get('content', '')).message
+        completion_id = f'chatcmpl-{uuid.uuid4().hex}'
+        created = int(time.time())
+
+        def event(delta, finish_reason=None):
+            data = {
+                'id': completion_id, 'object': 'chat.completion.chunk', 'created': created,
+                'model': payload.get('model', 'standin'),
+                'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}],
+            }
+            return _chunk(f'data: {json.dumps(data)}\n\n'.encode())
+
+        writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\n'
+                     b'Transfer-Encoding: chunked\r\nConnection: keep-alive\r\n\r\n')
+        writer.write(event({'role': 'assistant', 'content': ''}))
+        for word in re.findall(r'\s*\S+\s*', reply):
+            await asyncio.sleep(self.delay)
+            writer.write(event({'content': word}))
+            await writer.drain()
+        writer.write(event({}, 'stop'))
+        writer.write(_chunk(b'data: [DONE]\n\n') + _chunk(b''))
+        await writer.drain()
@@ -0,0 +1,235 @@
+import random
+import time
+from collections import Counter
+from datetime import timedelta
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from games.leaderboards import rebuild as rebuild_leaderboards
+from games.models import Game, GameSession
+from meditation.models import MeditationSession, MeditationUserStats
+from users.chatbot import severity_for_level
+from users.engagement import roll_up_clicks
+from users.ingest import bulk_ingest_tests
+from users.models import (
+    ChatMessage, ChatSession, CustomUser, MoodEntry, Resource, ResourceClick, ResourceEngagementRollup,
+)
+from users.resources import INTENT_RESOURCE_TYPES
+from users.scoring import INSTRUMENTS
+
+LOAD_EMAIL_DOMAIN = 'load.careconnect.test'
+LOAD_PASSWORD = 'loadtest-password'
+
+CHAT_LINES = [
+    "Hi there",
+    "I've been feeling anxious about work",
+    "I can't sleep lately",
+    "I'm so stressed with exams",
+    "Can you help me with breathing exercises?",
+    "I want to journal my thoughts",
+    "I feel lonely",
+    "Thanks, that helps",
+]
+
+
+class Command(BaseCommand):
+    help = 'Fills the database with synthetic users and activity for load testing and benchmarks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--days', type=int, default=180, help='History window to spread activity over')
+        parser.add_argument('--tests-per-user', type=int, default=20)
+        parser.add_argument('--mood-rate', type=float, default=0.7, help='Share of days with a mood entry')
+        parser.add_argument('--meditation-rate', type=float, default=0.5, help='Share of days with a meditation')
+        parser.add_argument('--game-sessions-per-user', type=int, default=30)
+        parser.add_argument('--chat-sessions-per-user', type=int, default=5)
+        parser.add_argument('--messages-per-session', type=int, default=12)
+        parser.add_argument('--clicks-per-user', type=int, default=10)
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.now = timezone.now()
+        self.days = options['days']
+        start = time.perf_counter()
+
+        if not Game.objects.exists():
+            call_command('loaddata', 'initial_games', verbosity=0)
+        if not Resource.objects.exists():
+            call_command('create_resources', stdout=self.stdout)
+
+        users = self.create_users(options['users'])
+        self.create_tests(users, options['tests_per_user'])
+        self.create_mood_entries(users, options['mood_rate'])
+        self.create_meditation_sessions(users, options['meditation_rate'])
+        self.create_game_sessions(users, options['game_sessions_per_user'])
+        sessions = self.create_chat(users, options['chat_sessions_per_user'], options['messages_per_session'])
+        self.create_resource_clicks(users, sessions, options['clicks_per_user'])
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Generated load data for {len(users)} users in {time.perf_counter() - start:.1f}s "
+            f"(log in as load0@{LOAD_EMAIL_DOMAIN} / {LOAD_PASSWORD}, a staff account)"
+        ))
+
+    def random_time(self):
+        return self.now - timedelta(seconds=self.rng.randrange(self.days * 86400))
+
+    def bulk_create(self, model, objects):
+        model.objects.bulk_create(objects, batch_size=self.batch_size)
+        self.stdout.write(f"Created {len(objects)} {model.__name__} rows")
+
+    def create_users(self, count):
+        offset = CustomUser.objects.filter(email__endswith=f'@{LOAD_EMAIL_DOMAIN}').count()
+        password = make_password(LOAD_PASSWORD)
+        users = [
+            CustomUser(
+                email=f'load{i}@{LOAD_EMAIL_DOMAIN}',
+                name=f'Load User {i}',
+                password=password,
+                is_staff=(i == 0),
+                is_superuser=(i == 0),
+            )
+            for i in range(offset, offset + count)
+        ]
+        self.bulk_create(CustomUser, users)
+        return list(CustomUser.objects.filter(email__in=[user.email for user in users]).only('id'))
+
+    def create_tests(self, users, per_user):
+        instruments = list(INSTRUMENTS.values())
+
+        def rows():
+            for user in users:
+                for _ in range(per_user):
+                    instrument = self.rng.choice(instruments)
+                    yield {
+                        'user_id': user.id,
+                        'test_type': instrument.code,
+                        'responses': [self.rng.randint(0, instrument.max_response) for _ in range(instrument.items)],
+                        'date_taken': self.random_time(),
+                    }
+
+        result = bulk_ingest_tests(rows(), chunk_size=self.batch_size)
+        self.stdout.write(f"Created {result.created} MentalHealthTest rows")
+
+    def create_mood_entries(self, users, rate):
+        moods = [choice for choice, _ in MoodEntry.MOOD_CHOICES]
+        levels = [choice for choice, _ in MoodEntry.SYMPTOM_CHOICES]
+        today = timezone.localdate()
+        entries = []
+        for user in users:
+            for day in range(self.days):
+                if self.rng.random() >= rate:
+                    continue
+                entries.append(MoodEntry(
+                    user_id=user.id,
+                    date=today - timedelta(days=day),
+                    mood=self.rng.choice(moods),
+                    anxiety_level=self.rng.choice(levels),
+                    depression_level=self.rng.choice(levels),
+                    stress_level=self.rng.choice(levels),
+                    energy_level=self.rng.choice(levels),
+                    sleep_hours=round(self.rng.uniform(4, 10) * 2) / 2,
+                    exercise_minutes=self.rng.choice([0, 10, 20, 30, 45, 60]),
+                    social_interaction=self.rng.random() < 0.6,
+                ))
+        self.bulk_create(MoodEntry, entries)
+
+    def create_meditation_sessions(self, users, rate):
+        today = timezone.localdate()
+        sessions = []
+        for user in users:
+            for day in range(self.days):
+                if self.rng.random() >= rate:
+                    continue
+                date = today - timedelta(days=day)
+                sessions.append(MeditationSession(
+                    user_id=user.id,
+                    duration=self.rng.choice([5, 10, 15]),
+                    date=date,
+                    created_at=self.now - timedelta(days=day),
+                ))
+        self.bulk_create(MeditationSession, sessions)
+        MeditationUserStats.rebuild()
+
+    def create_game_sessions(self, users, per_user):
+        games = list(Game.objects.only('id'))
+        sessions = []
+        for user in users:
+            for _ in range(per_user):
+                sessions.append(GameSession(
+                    user_id=user.id,
+                    game_id=self.rng.choice(games).id,
+                    score=self.rng.randint(0, 1000),
+                    duration=self.rng.randint(30, 900),
+                    completed=self.rng.random() < 0.8,
+                    played_at=self.random_time(),
+                ))
+        self.bulk_create(GameSession, sessions)
+        # Progress rows and leaderboards are derived from the session history
+        rebuild_leaderboards()
+
+    def create_chat(self, users, per_user, messages_per_session):
+        sessions = []
+        for user in users:
+            for i in range(per_user):
+                started_at = self.random_time()
+                sessions.append(ChatSession(
+                    user_id=user.id,
+                    started_at=started_at,
+                    # Leave each user's last session open, as an active chat
+                    ended_at=started_at + timedelta(minutes=20) if i < per_user - 1 else None,
+                    distress_level=self.rng.randint(1, 10),
+                ))
+        self.bulk_create(ChatSession, sessions)
+
+        messages = []
+        for session in sessions:
+            for i in range(messages_per_session):
+                messages.append(ChatMessage(
+                    session_id=session.id,
+                    message_type='user' if i % 2 == 0 else 'system',
+                    content=self.rng.choice(CHAT_LINES),
+                    timestamp=session.started_at + timedelta(seconds=30 * i),
+                ))
+        self.bulk_create(ChatMessage, messages)
+        return sessions
+
+    def create_resource_clicks(self, users, sessions, per_user):
+        resources = list(Resource.objects.values_list('id', 'resource_type'))
+        # Clicks come from sidebars ranked for an intent that suits the resource's type
+        intents_by_type = {}
+        for intent, types in INTENT_RESOURCE_TYPES.items():
+            for resource_type in types:
+                intents_by_type.setdefault(resource_type, []).append(intent)
+        sessions_by_user = {}
+        for session in sessions:
+            sessions_by_user.setdefault(session.user_id, []).append(session)
+
+        clicks = []
+        for user in users:
+            user_sessions = sessions_by_user.get(user.id, [])
+            for _ in range(per_user):
+                session = self.rng.choice(user_sessions) if user_sessions else None
+                resource_id, resource_type = self.rng.choice(resources)
+                clicks.append(ResourceClick(
+                    user_id=user.id,
+                    resource_id=resource_id,
+                    chat_session_id=session.id if session else None,
+                    intent=self.rng.choice(intents_by_type.get(resource_type, ['default'])),
+                    severity=(severity_for_level(session.distress_level) or '') if session else '',
+                    clicked_at=session.started_at + timedelta(minutes=5) if session else self.random_time(),
+                ))
+        self.bulk_create(ResourceClick, clicks)
+
+        # Each click came from one of several sidebars showing the resource
+        impressions = Counter()
+        for click in clicks:
+            day = timezone.localdate(click.clicked_at)
+            impressions[(day, click.resource_id, click.intent, click.severity)] += \
+                self.rng.randint(3, 20)
+        ResourceEngagementRollup.add_counts('impressions', impressions)
+        summary = roll_up_clicks()
+        self.stdout.write(f"Rolled up {summary['clicks']} clicks into {len(impressions)} ResourceEngagementRollup rows")
@@ -0,0 +1,27 @@
+import time
+from django.contrib.sessions.models import Session
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+class Command(BaseCommand):
+    help = 'Deletes expired django_session rows in small batches so the write lock is never held for long (run periodically)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500, help='Sessions deleted per transaction')
+        parser.add_argument('--pause', type=float, default=0.0,
+                            help='Seconds to sleep between chunks, letting other writers in')
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        expired = Session.objects.filter(expire_date__lt=now)
+        purged = chunks = 0
+        while True:
+            keys = list(expired.values_list('session_key', flat=True)[:options['chunk_size']])
+            if not keys:
+                break
+            purged += Session.objects.filter(session_key__in=keys).delete()[0]
+            chunks += 1
+            if options['pause']:
+                time.sleep(options['pause'])
+        # Cached copies expire from the session cache on their own
+        self.stdout.write(self.style.SUCCESS(f"Purged {purged} expired sessions in {chunks} chunks"))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+from users.models import DailyTestRollup
+
+class Command(BaseCommand):
+    help = 'Rebuilds the daily analytics rollups from the full MentalHealthTest history'
+
+    def handle(self, *args, **options):
+        rollup_count, user_count = DailyTestRollup.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt {rollup_count} daily rollups covering {user_count} users"
+        ))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from users.engagement import rebuild_clicks, roll_up_clicks
+
+class Command(BaseCommand):
+    help = 'Folds resource clicks logged since the last run into the engagement rollups (run periodically)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true',
+                            help='Recount every click from scratch instead of only new ones')
+        parser.add_argument('--batch-size', type=int, default=10000, help='Clicks folded in per transaction')
+
+    def handle(self, *args, **options):
+        roll_up = rebuild_clicks if options['rebuild'] else roll_up_clicks
+        summary = roll_up(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Rolled up {summary['clicks']} clicks into {summary['rows']} rollup rows "
+            f"in {summary['batches']} batches; watermark at click {summary['watermark']}"
+        ))
@@ -0,0 +1,30 @@
+# Generated by Django 5.0.2 on 2026-10-17 04:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0016_mentalhealthtest_phq9_item9_score'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyTestRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('test_type', models.CharField(choices=[('PHQ-9', 'PHQ-9 (Depression)'), ('GAD-7', 'GAD-7 (Anxiety)'), ('PSS', 'PSS (Perceived Stress)')], max_length=10)),
+                ('test_count', models.PositiveIntegerField(default=0)),
+                ('score_sum', models.BigIntegerField(default=0)),
+                ('score_sq_sum', models.BigIntegerField(default=0)),
+                ('user_count', models.PositiveIntegerField(default=0)),
+                ('new_user_count', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'ordering': ['-date', 'test_type'],
+                'unique_together': {('date', 'test_type')},
+            },
+        ),
+    ]
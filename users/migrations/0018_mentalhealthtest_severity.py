@@ -0,0 +1,40 @@
+# Generated by Django 5.0.2 on 2026-10-17 04:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0017_dailytestrollup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mentalhealthtest',
+            name='caution',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='mentalhealthtest',
+            name='recommendation_type',
+            field=models.CharField(blank=True, max_length=20),
+        ),
+        migrations.AddField(
+            model_name='mentalhealthtest',
+            name='severity',
+            field=models.CharField(blank=True, max_length=20),
+        ),
+        migrations.AddIndex(
+            model_name='mentalhealthtest',
+            index=models.Index(fields=['severity', 'test_type', 'date_taken'], name='users_menta_severit_c024d3_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='mentalhealthtest',
+            index=models.Index(fields=['recommendation_type', 'date_taken'], name='users_menta_recomme_f745f7_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='mentalhealthtest',
+            index=models.Index(fields=['caution', 'date_taken'], name='users_menta_caution_c058cd_idx'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.0.2 on 2026-10-17 04:26
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0018_mentalhealthtest_severity'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='mentalhealthtest',
+            name='date_taken',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
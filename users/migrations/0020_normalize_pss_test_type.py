@@ -0,0 +1,38 @@
+# Generated by Django 5.0.2 on 2026-10-17 04:29
+
+from django.db import migrations
+from django.db.models import F
+
+
+def normalize_pss(apps, schema_editor):
+    """Tests taken through the PSS-10 form were stored as 'PSS-10' instead of the 'PSS' choice"""
+    MentalHealthTest = apps.get_model('users', 'MentalHealthTest')
+    DailyTestRollup = apps.get_model('users', 'DailyTestRollup')
+
+    MentalHealthTest.objects.filter(test_type='PSS-10').update(test_type='PSS')
+
+    # Fold 'PSS-10' rollup rows into the matching 'PSS' rows
+    for legacy in DailyTestRollup.objects.filter(test_type='PSS-10'):
+        rollup, created = DailyTestRollup.objects.get_or_create(date=legacy.date, test_type='PSS')
+        DailyTestRollup.objects.filter(pk=rollup.pk).update(
+            test_count=F('test_count') + legacy.test_count,
+            score_sum=F('score_sum') + legacy.score_sum,
+            score_sq_sum=F('score_sq_sum') + legacy.score_sq_sum,
+            # A user who took both forms that day is one user, so count them again rather than adding
+            user_count=MentalHealthTest.objects.filter(test_type='PSS', date_taken__date=legacy.date)
+                                               .values('user_id').distinct().count(),
+            # A user's first test was under one of the two names, never both
+            new_user_count=F('new_user_count') + legacy.new_user_count,
+        )
+        legacy.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0019_alter_mentalhealthtest_date_taken'),
+    ]
+
+    operations = [
+        migrations.RunPython(normalize_pss, migrations.RunPython.noop),
+    ]
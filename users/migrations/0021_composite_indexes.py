@@ -0,0 +1,29 @@
+# Generated by Django 5.0.2 on 2026-10-17 04:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0020_normalize_pss_test_type'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='chatsession',
+            index=models.Index(fields=['user', 'ended_at'], name='users_chats_user_id_f969bd_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='mentalhealthtest',
+            index=models.Index(fields=['user', 'date_taken'], name='users_menta_user_id_e665e8_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='mentalhealthtest',
+            index=models.Index(fields=['test_type', 'date_taken'], name='users_menta_test_ty_a8f5bc_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='resourceclick',
+            index=models.Index(fields=['resource', 'clicked_at'], name='users_resou_resourc_102846_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.0.2 on 2026-10-17 04:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0023_chatmessage_ordering'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='chatmessage',
+            index=models.Index(fields=['session', 'timestamp'], name='users_chatm_session_8309ac_idx'),
+        ),
+    ]
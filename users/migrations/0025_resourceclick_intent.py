@@ -0,0 +1,22 @@
+# Generated by Django 5.0.2 on 2026-10-17 04:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0024_chatmessage_session_timestamp_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='resourceclick',
+            name='intent',
+            field=models.CharField(blank=True, default='', max_length=20),
+        ),
+        migrations.AddIndex(
+            model_name='resourceclick',
+            index=models.Index(fields=['clicked_at'], name='users_resou_clicked_082943_idx'),
+        ),
+    ]
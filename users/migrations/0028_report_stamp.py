@@ -0,0 +1,20 @@
+# Generated by Django 5.0.2 on 2026-10-17 05:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0027_ingest_checkpoint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReportStamp',
+            fields=[
+                ('user_id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('stamp', models.BigIntegerField(default=0)),
+            ],
+        ),
+    ]
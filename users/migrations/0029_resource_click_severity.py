@@ -0,0 +1,35 @@
+# Generated by Django 5.0.2 on 2026-10-17 05:40
+
+from django.db import migrations, models
+
+# Severity by intent, which is what earlier clicks were rolled up under
+INTENT_SEVERITIES = {
+    'crisis': 'severe',
+    'anxiety': 'moderate',
+    'depression': 'moderate',
+    'stress': 'moderate',
+}
+
+
+def backfill_severity(apps, schema_editor):
+    """Earlier clicks carry no session severity; keep them in the rollup rows they were counted in"""
+    ResourceClick = apps.get_model('users', 'ResourceClick')
+    ResourceClick.objects.exclude(intent='').update(severity='mild')
+    for intent, severity in INTENT_SEVERITIES.items():
+        ResourceClick.objects.filter(intent=intent).update(severity=severity)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0028_report_stamp'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='resourceclick',
+            name='severity',
+            field=models.CharField(blank=True, default='', max_length=10),
+        ),
+        migrations.RunPython(backfill_severity, migrations.RunPython.noop),
+    ]
@@ -1,12 +1,15 @@
 # users\models.py
+from asgiref.sync import sync_to_async
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, PermissionsMixin
-from django.db import models
+from django.db import models, transaction
+from django.db.models.functions import Greatest, TruncDate
 try:
     from django.db.models import JSONField
 except ImportError:
     from django.contrib.postgres.fields import JSONField 
 from django.conf import settings
 from django.utils import timezone
+from .scoring import get_instrument
 
 class CustomUserManager(BaseUserManager):
     def create_user(self, email, name, password=None, **extra_fields):
@@ -40,6 +43,12 @@ class CustomUser(AbstractBaseUser, PermissionsMixin):
     def __str__(self):
         return self.email
 
+    def get_session_auth_hash(self):
+        # A user rebuilt from the auth cache has no password loaded, only the hash it produced
+        if 'password' not in self.__dict__ and getattr(self, '_session_auth_hash', None):
+            return self._session_auth_hash
+        return super().get_session_auth_hash()
+
 # Shared choices
 MENTAL_STATE_CHOICES = [
     ('Excellent', 'Excellent (16-20)'),
@@ -57,81 +66,84 @@ class MentalHealthTest(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='mental_health_tests')
     test_type = models.CharField(max_length=10, choices=TEST_TYPE_CHOICES, default='PHQ-9')
     score = models.IntegerField()
-    date_taken = models.DateTimeField(auto_now_add=True)
+    date_taken = models.DateTimeField(default=timezone.now)
     related_actions = models.ManyToManyField('Action', related_name='tests')
     category = models.CharField(max_length=20, choices=MENTAL_STATE_CHOICES, blank=True)
     phq9_item9_score = models.IntegerField(null=True, blank=True)  # Track suicidal thoughts for caution logic
+    # Derived from test_type/score in save() so templates and staff queries never re-run the ladder
+    severity = models.CharField(max_length=20, blank=True)
+    recommendation_type = models.CharField(max_length=20, blank=True)
+    caution = models.BooleanField(default=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'date_taken']),
+            models.Index(fields=['test_type', 'date_taken']),
+            models.Index(fields=['severity', 'test_type', 'date_taken']),
+            models.Index(fields=['recommendation_type', 'date_taken']),
+            models.Index(fields=['caution', 'date_taken']),
+        ]
 
     def save(self, *args, **kwargs):
-        # Set category based on score (legacy compatibility)
-        if self.score >= 16:
-            self.category = 'Excellent'
-        elif 11 <= self.score <= 15:
-            self.category = 'Good'
-        else:
-            self.category = 'Caution'
+        self.apply_category()
+        self.apply_severity()
         
         # Check if this is a new record
         is_new = self.pk is None
+        # An edit may move the test between rollup rows, so note where it was counted
+        previous = None if is_new else MentalHealthTest.objects.filter(pk=self.pk).first()
         
         # Create the test record first
         super().save(*args, **kwargs)
+        if previous is not None:
+            DailyTestRollup.edit_test(previous, self)
         
         # Create recommendation based on test type and score (only for new records)
         if is_new:
+            DailyTestRollup.record_test(self)
             try:
-                severity = self.get_severity()
-                recommendation_type = self.get_recommendation_type(severity)
-                
                 # Create the recommendation
                 TestRecommendation.objects.create(
                     test=self,
-                    severity=severity,
-                    recommendation_type=recommendation_type
+                    severity=self.severity,
+                    recommendation_type=self.recommendation_type
                 )
             except Exception as e:
                 # Log the error but don't fail the test creation
                 print(f"Error creating recommendation: {e}")
                 pass
 
-    def get_severity(self):
-        """Determine severity level based on test type and score using exact clinical standards"""
-        if self.test_type == 'PHQ-9':
-            # PHQ-9: 0-4 None/Minimal, 5-9 Mild, 10-14 Moderate, 15-19 Moderately Severe, 20-27 Severe
-            if 0 <= self.score <= 4:
-                return 'None/Minimal'
-            elif 5 <= self.score <= 9:
-                return 'Mild'
-            elif 10 <= self.score <= 14:
-                return 'Moderate'
-            elif 15 <= self.score <= 19:
-                return 'Moderately Severe'
-            elif 20 <= self.score <= 27:
-                return 'Severe'
-                
-        elif self.test_type == 'GAD-7':
-            # GAD-7: 0-4 Minimal, 5-9 Mild, 10-14 Moderate, 15-21 Severe
-            if 0 <= self.score <= 4:
-                return 'Minimal'
-            elif 5 <= self.score <= 9:
-                return 'Mild'
-            elif 10 <= self.score <= 14:
-                return 'Moderate'
-            elif 15 <= self.score <= 21:
-                return 'Severe'
-                
-        elif self.test_type == 'PSS':
-            # PSS-10: 0-13 Low stress, 14-26 Moderate stress, 27-40 High stress
-            if 0 <= self.score <= 13:
-                return 'Low stress'
-            elif 14 <= self.score <= 26:
-                return 'Moderate stress'
-            elif 27 <= self.score <= 40:
-                return 'High stress'
-        return 'Moderate'  # Default fallback
+    def apply_category(self):
+        """Set category based on score (legacy compatibility)"""
+        if self.score >= 16:
+            self.category = 'Excellent'
+        elif 11 <= self.score <= 15:
+            self.category = 'Good'
+        else:
+            self.category = 'Caution'
+
+    def apply_severity(self):
+        """Store severity, recommendation type and caution flag for the current score"""
+        self.severity = self.compute_severity()
+        self.recommendation_type = self.get_recommendation_type(self.severity)
+        self.caution = self.compute_caution(self.severity)
+
+    def compute_severity(self):
+        """Determine severity level from the instrument's clinical severity bands"""
+        instrument = get_instrument(self.test_type)
+        severity = instrument.severity(self.score) if instrument else None
+        return severity or 'Moderate'  # Default fallback
     
-    def get_recommendation_type(self, severity):
+    def get_severity(self):
+        """Stored severity level, computed on the fly for unsaved instances"""
+        if not self.severity:
+            self.apply_severity()
+        return self.severity
+
+    def get_recommendation_type(self, severity=None):
         """Determine recommendation type based on severity"""
+        if severity is None:
+            severity = self.get_severity()
         if severity in ['None/Minimal', 'Minimal', 'Low stress', 'Mild']:
             return 'self_care'
         elif severity in ['Moderate', 'Moderate stress', 'Moderately Severe']:
@@ -143,10 +155,8 @@ class MentalHealthTest(models.Model):
         from django.urls import reverse
         return reverse('users:test_detail', kwargs={'pk': self.pk})
 
-    def needs_caution(self):
+    def compute_caution(self, severity):
         """Determine if caution should be shown based on severity or PHQ-9 item 9"""
-        severity = self.get_severity()
-        
         # Show caution if in severe range
         if severity in ['Severe', 'High stress']:
             return True
@@ -156,6 +166,12 @@ class MentalHealthTest(models.Model):
             return True
             
         return False
+
+    def needs_caution(self):
+        """Stored caution flag"""
+        if not self.severity:
+            self.apply_severity()
+        return self.caution
     
     def get_color_class(self):
         """Get CSS color class based on severity"""
@@ -170,13 +186,199 @@ class MentalHealthTest(models.Model):
     
     def get_display_text(self):
         """Get formatted display text for score and severity"""
-        severity = self.get_severity()
         caution_text = " — Caution" if self.needs_caution() else ""
-        return f"{self.test_type}: Score {self.score} — {severity}{caution_text}"
+        return f"{self.test_type}: Score {self.score} — {self.get_severity()}{caution_text}"
 
     def __str__(self):
         return f"{self.user.email} - {self.test_type} - {self.score} ({self.category})"
 
+class DailyTestRollup(models.Model):
+    """Per-day, per-test-type aggregates so analytics never scan MentalHealthTest"""
+    date = models.DateField()
+    test_type = models.CharField(max_length=10, choices=MentalHealthTest.TEST_TYPE_CHOICES)
+    test_count = models.PositiveIntegerField(default=0)
+    score_sum = models.BigIntegerField(default=0)
+    score_sq_sum = models.BigIntegerField(default=0)
+    user_count = models.PositiveIntegerField(default=0)  # Distinct users who took this test type on this day
+    new_user_count = models.PositiveIntegerField(default=0)  # Users whose first ever test was this one
+
+    class Meta:
+        ordering = ['-date', 'test_type']
+        unique_together = ['date', 'test_type']
+
+    @classmethod
+    def record_test(cls, test):
+        """Fold a newly saved test into its day's rollup row: an insert-if-missing and one UPDATE"""
+        day = timezone.localdate(test.date_taken)
+        earlier = MentalHealthTest.objects.filter(user_id=test.user_id).exclude(pk=test.pk)
+        same_day = earlier.filter(test_type=test.test_type, date_taken__date=day)
+
+        with transaction.atomic():
+            cls.objects.bulk_create([cls(date=day, test_type=test.test_type)], ignore_conflicts=True)
+            # Whether the user is new (for the day) is decided inside the UPDATE, not by separate reads
+            cls.objects.filter(date=day, test_type=test.test_type).update(
+                test_count=models.F('test_count') + 1,
+                score_sum=models.F('score_sum') + test.score,
+                score_sq_sum=models.F('score_sq_sum') + test.score * test.score,
+                user_count=models.F('user_count') + models.Case(
+                    models.When(models.Exists(same_day), then=0), default=1
+                ),
+                new_user_count=models.F('new_user_count') + models.Case(
+                    models.When(models.Exists(earlier), then=0), default=1
+                ),
+            )
+
+    @classmethod
+    def remove_test(cls, test):
+        """Take a deleted test out of its day's rollup row; called from post_delete"""
+        row = (timezone.localdate(test.date_taken), test.test_type)
+        with transaction.atomic():
+            cls._add_scores(row, -1, test.score)
+            # If it was the user's first test, their next one now is
+            cls._recount_users([row, cls._first_test_row(test.user_id)])
+
+    @classmethod
+    def edit_test(cls, previous, test):
+        """Move an edited test's counts from the row previous (its stored state) was in to its current one"""
+        before = (timezone.localdate(previous.date_taken), previous.test_type)
+        after = (timezone.localdate(test.date_taken), test.test_type)
+        if (before, previous.score, previous.user_id) == (after, test.score, test.user_id):
+            return
+        with transaction.atomic():
+            cls._add_scores(before, -1, previous.score)
+            cls.objects.bulk_create([cls(date=after[0], test_type=after[1])], ignore_conflicts=True)
+            cls._add_scores(after, 1, test.score)
+            # The test may have become, or stopped being, its user's first
+            cls._recount_users([
+                before, after,
+                cls._first_test_row(previous.user_id, exclude=test.pk),
+                cls._first_test_row(test.user_id, exclude=test.pk),
+            ])
+
+    @classmethod
+    def _add_scores(cls, row, count, score):
+        day, test_type = row
+        cls.objects.filter(date=day, test_type=test_type).update(
+            test_count=Greatest(models.F('test_count') + count, 0),
+            score_sum=models.F('score_sum') + count * score,
+            score_sq_sum=models.F('score_sq_sum') + count * score * score,
+        )
+
+    @staticmethod
+    def _first_test_row(user_id, exclude=None):
+        """(day, test_type) of the user's first test by date, or None if they have none"""
+        first = MentalHealthTest.objects.filter(user_id=user_id).exclude(pk=exclude)\
+                                        .order_by('date_taken', 'id').values_list('date_taken', 'test_type').first()
+        return (timezone.localdate(first[0]), first[1]) if first else None
+
+    @classmethod
+    def _recount_users(cls, rows):
+        """Recompute the distinct and first-time users of rows from the tests left in them, dropping empty rows"""
+        earlier = MentalHealthTest.objects.filter(user_id=models.OuterRef('user_id')).filter(
+            models.Q(date_taken__lt=models.OuterRef('date_taken'))
+            | models.Q(date_taken=models.OuterRef('date_taken'), id__lt=models.OuterRef('id'))
+        )
+        for day, test_type in {row for row in rows if row is not None}:
+            tests = MentalHealthTest.objects.filter(test_type=test_type, date_taken__date=day)
+            rollup = cls.objects.filter(date=day, test_type=test_type)
+            rollup.update(
+                user_count=tests.values('user_id').distinct().count(),
+                new_user_count=tests.filter(~models.Exists(earlier)).count(),
+            )
+            rollup.filter(test_count=0).delete()
+
+    @classmethod
+    def rebuild(cls):
+        """Recompute every rollup row from the full test history, returning (rows, users)"""
+        # Per (day, test type) counts, score sums and distinct users in one grouped query
+        daily = MentalHealthTest.objects.annotate(day=TruncDate('date_taken'))\
+                                        .values('day', 'test_type')\
+                                        .annotate(
+                                            test_count=models.Count('id'),
+                                            score_sum=models.Sum('score'),
+                                            score_sq_sum=models.Sum(models.F('score') * models.F('score')),
+                                            user_count=models.Count('user', distinct=True),
+                                        )\
+                                        .order_by()
+
+        rollups = {}
+        for row in daily:
+            rollups[(row['day'], row['test_type'])] = cls(
+                date=row['day'],
+                test_type=row['test_type'],
+                test_count=row['test_count'],
+                score_sum=row['score_sum'] or 0,
+                score_sq_sum=row['score_sq_sum'] or 0,
+                user_count=row['user_count'],
+            )
+
+        # Attribute each user to the rollup row of their first ever test
+        seen_users = set()
+        first_tests = MentalHealthTest.objects.order_by('date_taken', 'id')\
+                                              .values_list('user_id', 'test_type', 'date_taken')
+        for user_id, test_type, date_taken in first_tests.iterator(chunk_size=2000):
+            if user_id in seen_users:
+                continue
+            seen_users.add(user_id)
+            rollups[(timezone.localdate(date_taken), test_type)].new_user_count += 1
+
+        with transaction.atomic():
+            cls.objects.all().delete()
+            cls.objects.bulk_create(rollups.values(), batch_size=500)
+        return len(rollups), len(seen_users)
+
+    @classmethod
+    def totals_by_type(cls):
+        """Return {test_type: {'count', 'avg', 'stddev', 'new_users'}} summed over all days"""
+        totals = {}
+        rows = cls.objects.values('test_type').annotate(
+            count=models.Sum('test_count'),
+            score_sum=models.Sum('score_sum'),
+            score_sq_sum=models.Sum('score_sq_sum'),
+            new_users=models.Sum('new_user_count'),
+        ).order_by()
+        for row in rows:
+            count = row['count'] or 0
+            avg = row['score_sum'] / count if count else 0
+            variance = row['score_sq_sum'] / count - avg * avg if count else 0
+            totals[row['test_type']] = {
+                'count': count,
+                'avg': avg,
+                'stddev': max(variance, 0) ** 0.5,
+                'new_users': row['new_users'] or 0,
+            }
+        return totals
+
+    @classmethod
+    def daily_counts(cls, start_date):
+        """Return {date: test count} for every day since start_date that has tests"""
+        rows = cls.objects.filter(date__gte=start_date)\
+                          .values('date')\
+                          .annotate(count=models.Sum('test_count'))\
+                          .order_by('date')
+        return {row['date']: row['count'] for row in rows}
+
+    def __str__(self):
+        return f"{self.date} - {self.test_type} ({self.test_count} tests)"
+
+class IngestCheckpoint(models.Model):
+    """How many rows of an import bulk_ingest_tests has committed, updated in the same transaction"""
+    name = models.CharField(max_length=255, unique=True)
+    rows_done = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} ({self.rows_done} rows)"
+
+class ReportStamp(models.Model):
+    """When a user's report inputs last changed; cached reports are keyed on it so every process sees writes"""
+    # Not a ForeignKey: stamps are also written from post_delete while the user is being deleted
+    user_id = models.BigIntegerField(primary_key=True)
+    stamp = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"Report stamp for user {self.user_id}"
+
 class ActionPlan(models.Model):
     category = models.CharField(max_length=20, choices=MENTAL_STATE_CHOICES, unique=True)
     title = models.CharField(max_length=100)
@@ -295,7 +497,7 @@ class MoodEntry(models.Model):
     ]
 
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='mood_entries')
-    date = models.DateField(auto_now_add=True)
+    date = models.DateField(default=timezone.localdate)
     mood = models.CharField(max_length=20, choices=MOOD_CHOICES)
     anxiety_level = models.CharField(max_length=20, choices=SYMPTOM_CHOICES)
     depression_level = models.CharField(max_length=20, choices=SYMPTOM_CHOICES)
@@ -340,13 +542,42 @@ class TestRecommendation(models.Model):
 class ChatSession(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='chat_sessions')
     test_recommendation = models.ForeignKey(TestRecommendation, on_delete=models.SET_NULL, null=True, blank=True, related_name='chat_sessions')
-    started_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(default=timezone.now)
     ended_at = models.DateTimeField(null=True, blank=True)
     distress_level = models.IntegerField(null=True, blank=True, help_text="User's self-reported distress level (1-10)")
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'ended_at']),
+        ]
     
     def __str__(self):
         return f"{self.user.email} - Chat Session {self.started_at}"
 
+    @classmethod
+    def record_turn(cls, session_id, user_id, message, reply, distress_level, now=None):
+        """
+        Store a user message, the chatbot's reply and the new distress level in one
+        transaction of two statements, returning the two messages. Returns None without
+        writing anything when the session is no longer the user's open session (e.g. it
+        was ended from another tab).
+        """
+        now = now or timezone.now()
+        with transaction.atomic():
+            updated = cls.objects.filter(id=session_id, user_id=user_id, ended_at__isnull=True)\
+                .update(distress_level=distress_level)
+            if not updated:
+                return None
+            return ChatMessage.objects.bulk_create([
+                ChatMessage(session_id=session_id, message_type='user', content=message, timestamp=now),
+                ChatMessage(session_id=session_id, message_type='system', content=reply, timestamp=now),
+            ])
+
+    @classmethod
+    async def arecord_turn(cls, *args, **kwargs):
+        """Async record_turn; the transaction runs on the thread sync ORM calls share"""
+        return await sync_to_async(cls.record_turn)(*args, **kwargs)
+
 
 class ChatMessage(models.Model):
     MESSAGE_TYPE_CHOICES = [
@@ -357,10 +588,15 @@ class ChatMessage(models.Model):
     session = models.ForeignKey(ChatSession, on_delete=models.CASCADE, related_name='messages')
     message_type = models.CharField(max_length=10, choices=MESSAGE_TYPE_CHOICES)
     content = models.TextField()
-    timestamp = models.DateTimeField(auto_now_add=True)
+    timestamp = models.DateTimeField(default=timezone.now)
     
     class Meta:
-        ordering = ['timestamp']
+        # Both messages of a turn share a timestamp; id keeps the reply after the question
+        ordering = ['timestamp', 'id']
+        indexes = [
+            # Keyset pages of a session's history; the rowid breaks timestamp ties
+            models.Index(fields=['session', 'timestamp']),
+        ]
     
     def __str__(self):
         return f"{self.session.user.email} - {self.message_type} - {self.timestamp}"
@@ -390,7 +626,59 @@ class ResourceClick(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='resource_clicks')
     resource = models.ForeignKey(Resource, on_delete=models.CASCADE, related_name='clicks')
     chat_session = models.ForeignKey(ChatSession, on_delete=models.SET_NULL, null=True, blank=True, related_name='resource_clicks')
-    clicked_at = models.DateTimeField(auto_now_add=True)
+    # The chatbot intent the sidebar was ranked for when the resource was clicked
+    intent = models.CharField(max_length=20, blank=True, default='')
+    # The chat session's severity at the time (see users/engagement.py)
+    severity = models.CharField(max_length=10, blank=True, default='')
+    clicked_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['resource', 'clicked_at']),
+            models.Index(fields=['clicked_at']),
+        ]
     
     def __str__(self):
-        return f"{self.user.email} - {self.resource.title} - {self.clicked_at}"
\ No newline at end of file
+        return f"{self.user.email} - {self.resource.title} - {self.clicked_at}"
+
+
+class ResourceEngagementRollup(models.Model):
+    """Per-day sidebar impressions and clicks of a resource, by the intent and severity it was shown for"""
+    date = models.DateField()
+    resource = models.ForeignKey(Resource, on_delete=models.CASCADE, related_name='engagement')
+    intent = models.CharField(max_length=20, blank=True, default='')
+    severity = models.CharField(max_length=10, blank=True, default='')
+    impressions = models.PositiveIntegerField(default=0)
+    clicks = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ['date', 'resource', 'intent', 'severity']
+
+    @property
+    def ctr(self):
+        return self.clicks / self.impressions if self.impressions else 0.0
+
+    @classmethod
+    def add_counts(cls, field, counts):
+        """Add {(date, resource_id, intent, severity): n} to field, creating rows as needed"""
+        with transaction.atomic():
+            cls.objects.bulk_create([
+                cls(date=date, resource_id=resource_id, intent=intent, severity=severity)
+                for date, resource_id, intent, severity in counts
+            ], ignore_conflicts=True)
+            for (date, resource_id, intent, severity), count in counts.items():
+                cls.objects.filter(date=date, resource_id=resource_id, intent=intent, severity=severity)\
+                           .update(**{field: models.F(field) + count})
+
+    def __str__(self):
+        return f"{self.date} - {self.resource_id} - {self.intent}/{self.severity} ({self.clicks}/{self.impressions})"
+
+
+class RollupWatermark(models.Model):
+    """The last source row id an incremental rollup job has folded in"""
+    name = models.CharField(max_length=50, unique=True)
+    last_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} @ {self.last_id}"
\ No newline at end of file
@@ -0,0 +1,221 @@
+# users/reports.py
+import time
+from datetime import timedelta
+from django.core.cache import cache
+from django.db.models import Avg, Count, Sum
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from meditation.models import MeditationSession
+from .models import MentalHealthTest, MoodEntry, ReportStamp
+
+REPORT_DEFAULT_DAYS = 30
+REPORT_CACHE_TIMEOUT = 60 * 60
+
+# Numeric scales used to average the categorical mood entry fields
+MOOD_SCORES = {
+    'very_happy': 10,
+    'happy': 8,
+    'neutral': 6,
+    'sad': 4,
+    'very_sad': 2,
+}
+SYMPTOM_SCORES = {
+    'none': 0,
+    'mild': 1,
+    'moderate': 2,
+    'severe': 3,
+}
+SYMPTOM_FIELDS = ['anxiety_level', 'depression_level', 'stress_level', 'energy_level']
+
+
+def get_report_range(params):
+    """Read start_date/end_date (YYYY-MM-DD) from query params, defaulting to the last 30 days"""
+    end_date = parse_date(params.get('end_date') or '') or timezone.localdate()
+    start_date = parse_date(params.get('start_date') or '') or end_date - timedelta(days=REPORT_DEFAULT_DAYS)
+    if start_date > end_date:
+        start_date, end_date = end_date, start_date
+    return start_date, end_date
+
+
+def touch_reports(user_ids):
+    """Record a write for these users so no process serves their cached reports again"""
+    stamp = time.time_ns()
+    ReportStamp.objects.bulk_create(
+        [ReportStamp(user_id=user_id, stamp=stamp) for user_id in set(user_ids)],
+        update_conflicts=True,
+        unique_fields=['user_id'],
+        update_fields=['stamp'],
+    )
+
+
+def touch_report(user_id):
+    touch_reports([user_id])
+
+
+def get_report(user, start_date, end_date):
+    """
+    Return the report context for a user and date range, cached until the user's next write.
+    The key includes the user's ReportStamp, read from the database, so a write made by any
+    process is seen even though the report itself sits in a per-process cache.
+    """
+    stamp = ReportStamp.objects.filter(user_id=user.pk).values_list('stamp', flat=True).first() or 0
+    key = f'report:{user.pk}:{stamp}:{start_date.isoformat()}:{end_date.isoformat()}'
+    report = cache.get(key)
+    if report is None:
+        report = build_report(user, start_date, end_date)
+        cache.set(key, report, REPORT_CACHE_TIMEOUT)
+    return report
+
+
+def build_report(user, start_date, end_date):
+    """Compute every report statistic with DB aggregates plus one streaming pass over mood entries"""
+    test_stats = _test_stats(user, start_date, end_date)
+    mood_stats, lifestyle_stats = _mood_and_lifestyle_stats(user, start_date, end_date)
+    meditation_stats = _meditation_stats(user, start_date, end_date)
+
+    return {
+        'start_date': start_date,
+        'end_date': end_date,
+        'test_stats': test_stats,
+        'mood_stats': mood_stats,
+        'lifestyle_stats': lifestyle_stats,
+        'meditation_stats': meditation_stats,
+        'insights': _insights(test_stats, mood_stats, lifestyle_stats, meditation_stats),
+    }
+
+
+def _test_stats(user, start_date, end_date):
+    rows = MentalHealthTest.objects.filter(
+        user=user,
+        date_taken__date__range=(start_date, end_date)
+    ).values('test_type').annotate(
+        count=Count('id'),
+        average=Avg('score'),
+        total=Sum('score'),
+    ).order_by()
+
+    by_type = {}
+    tests_taken = 0
+    score_total = 0
+    for row in rows:
+        by_type[row['test_type']] = {'count': row['count'], 'average_score': row['average']}
+        tests_taken += row['count']
+        score_total += row['total'] or 0
+
+    return {
+        'tests_taken': tests_taken,
+        'average_score': score_total / tests_taken if tests_taken else 0,
+        'by_type': by_type,
+    }
+
+
+def _mood_and_lifestyle_stats(user, start_date, end_date):
+    entries = MoodEntry.objects.filter(
+        user=user,
+        date__range=(start_date, end_date)
+    ).values_list('mood', *SYMPTOM_FIELDS, 'sleep_hours', 'exercise_minutes', 'social_interaction')
+
+    count = 0
+    mood_total = 0
+    symptom_totals = [0] * len(SYMPTOM_FIELDS)
+    sleep_total = 0
+    sleep_count = 0
+    exercise_total = 0
+    exercise_count = 0
+    social_days = 0
+
+    # One pass over the rows without materialising the queryset
+    for mood, *symptoms, sleep_hours, exercise_minutes, social_interaction in entries.iterator(chunk_size=500):
+        count += 1
+        mood_total += MOOD_SCORES.get(mood, 0)
+        for i, level in enumerate(symptoms):
+            symptom_totals[i] += SYMPTOM_SCORES.get(level, 0)
+        if sleep_hours is not None:
+            sleep_total += float(sleep_hours)
+            sleep_count += 1
+        if exercise_minutes is not None:
+            exercise_total += exercise_minutes
+            exercise_count += 1
+        if social_interaction:
+            social_days += 1
+
+    mood_stats = {
+        'entries': count,
+        'average_mood': mood_total / count if count else 0,
+    }
+    for field, total in zip(SYMPTOM_FIELDS, symptom_totals):
+        mood_stats[f'average_{field}'] = total / count if count else 0
+
+    lifestyle_stats = {
+        'sleep_quality': sleep_total / sleep_count if sleep_count else 0,
+        'exercise_rate': exercise_total / exercise_count if exercise_count else 0,
+        'social_interaction_rate': social_days / count if count else 0,
+    }
+    return mood_stats, lifestyle_stats
+
+
+def _meditation_stats(user, start_date, end_date):
+    totals = MeditationSession.objects.filter(
+        user=user,
+        date__range=(start_date, end_date)
+    ).aggregate(total_minutes=Sum('duration'), total_sessions=Count('id'))
+    return {
+        'total_minutes': totals['total_minutes'] or 0,
+        'total_sessions': totals['total_sessions'],
+    }
+
+
+def _insights(test_stats, mood_stats, lifestyle_stats, meditation_stats):
+    insights = []
+
+    if test_stats['tests_taken']:
+        insights.append(
+            f"Your average mental health score across {test_stats['tests_taken']} assessments "
+            f"was {test_stats['average_score']:.1f}."
+        )
+
+    if mood_stats['entries']:
+        average_mood = mood_stats['average_mood']
+        if average_mood >= 7:
+            insights.append(f"Your mood has been mostly positive, averaging {average_mood:.1f}/10.")
+        elif average_mood >= 5:
+            insights.append(f"Your mood has been fairly balanced, averaging {average_mood:.1f}/10.")
+        else:
+            insights.append(f"Your mood has been low, averaging {average_mood:.1f}/10. Consider reaching out for support.")
+
+        if mood_stats['average_anxiety_level'] >= 2:
+            insights.append("Your anxiety levels have been elevated. Breathing and grounding techniques may help.")
+        if mood_stats['average_depression_level'] >= 2:
+            insights.append("You've reported frequent feelings of depression. Talking to a professional can make a difference.")
+        if mood_stats['average_stress_level'] >= 2:
+            insights.append("Your stress levels have been high. Try breaking tasks into smaller steps and taking regular breaks.")
+        if mood_stats['average_energy_level'] < 1:
+            insights.append("You've reported low energy often. Regular rest and light activity can help restore energy.")
+
+        sleep = lifestyle_stats['sleep_quality']
+        if sleep and sleep < 7:
+            insights.append(f"You're averaging {sleep:.1f} hours of sleep. Most adults need 7-9 hours.")
+        elif sleep:
+            insights.append(f"You're getting a healthy {sleep:.1f} hours of sleep on average.")
+
+        exercise = lifestyle_stats['exercise_rate']
+        if exercise < 30:
+            insights.append(f"You're averaging {exercise:.0f} minutes of exercise a day. Aim for at least 30 minutes.")
+        else:
+            insights.append(f"Great job keeping up {exercise:.0f} minutes of exercise a day.")
+
+        social_rate = lifestyle_stats['social_interaction_rate']
+        if social_rate < 0.5:
+            insights.append("You've had social interaction on fewer than half of your days. Reaching out to someone can help.")
+        else:
+            insights.append(f"You've had social interaction on {social_rate * 100:.0f}% of your days.")
+
+    if meditation_stats['total_sessions']:
+        insights.append(
+            f"You completed {meditation_stats['total_sessions']} meditation sessions "
+            f"totalling {meditation_stats['total_minutes']} minutes."
+        )
+    else:
+        insights.append("Try a short meditation session to build a mindfulness habit.")
+
+    return insights
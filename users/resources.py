@@ -0,0 +1,153 @@
+# users/resources.py
+"""
+In-process catalog of chatbot resources, ranked per intent.
+
+The catalog holds every active Resource, indexed by resource_type, and for each
+chatbot intent a ranking of the resource types that suit it. Within those
+types, resources are ordered by click-through rate: clicks on the resource
+from sidebars shown for that intent, over the times it was shown in them,
+both over the last RESOURCE_RANKING_WINDOW_DAYS of engagement rollups (see
+users/engagement.py). Rates are smoothed towards a common prior, so
+resources nobody has seen or clicked yet keep their type's place instead of
+sinking.
+Crisis sidebars are never reordered by clicks: helplines stay on top.
+
+The catalog is loaded on first use, dropped by a signal whenever a Resource
+is saved or deleted, and rebuilt after RESOURCE_CATALOG_REFRESH_INTERVAL
+seconds so rankings follow new clicks (and resources changed in other
+processes show up). In between, recommendations need no queries.
+"""
+import threading
+import time
+from django.conf import settings
+from django.db.models import Sum
+from . import engagement
+from .chatbot import DEFAULT_INTENT, INTENTS
+from .models import Resource
+
+# Resource types that suit each intent, best fit first; unlisted intents get every type
+INTENT_RESOURCE_TYPES = {
+    'crisis': ['helpline', 'breathing', 'stress_management'],
+    'anxiety': ['breathing', 'stress_management', 'article', 'helpline'],
+    'depression': ['article', 'journaling', 'helpline', 'video'],
+    'stress': ['stress_management', 'breathing', 'journaling'],
+    'sleep': ['breathing', 'stress_management', 'article'],
+    'relationship': ['journaling', 'article', 'helpline'],
+    'work': ['stress_management', 'journaling', 'breathing'],
+    'mental_health': ['article', 'video', 'journaling'],
+    'breathing': ['breathing', 'stress_management'],
+    'journal': ['journaling', 'article'],
+}
+# Helplines always come first in a crisis, whatever gets clicked
+UNRANKED_INTENTS = {'crisis'}
+# Smoothing: every resource starts as if it had PRIOR_CLICKS clicks in PRIOR_IMPRESSIONS impressions
+PRIOR_CLICKS = 1
+PRIOR_IMPRESSIONS = 10
+SIDEBAR_SIZE = 5
+
+_lock = threading.Lock()
+_catalog = None
+
+
+class ResourceCatalog:
+    def __init__(self, resources, clicks, impressions):
+        """
+        resources: active Resource rows; clicks and impressions: {(intent, resource_id): count}
+        """
+        self.by_id = {resource.id: resource for resource in resources}
+        # What the sidebar and its JSON updates send for each resource
+        self.json = {resource.id: resource_json(resource) for resource in resources}
+        self.by_type = {}
+        for resource in resources:
+            self.by_type.setdefault(resource.resource_type, []).append(resource)
+        self.clicks = clicks
+        self.impressions = impressions
+        self.rankings = {
+            intent.name: self._rank(intent.name) for intent in INTENTS + [DEFAULT_INTENT]
+        }
+        self.loaded_at = time.monotonic()
+
+    def ctr(self, intent_name, resource_id):
+        """Smoothed click-through rate of a resource in the sidebar for an intent"""
+        clicks = self.clicks.get((intent_name, resource_id), 0)
+        impressions = self.impressions.get((intent_name, resource_id), 0)
+        # Clicks rolled up before their impressions were flushed cannot push the rate past 1
+        return (clicks + PRIOR_CLICKS) / (max(impressions, clicks) + PRIOR_IMPRESSIONS)
+
+    def _rank(self, intent_name):
+        types = INTENT_RESOURCE_TYPES.get(intent_name) or [choice for choice, _ in Resource.RESOURCE_TYPE_CHOICES]
+        fit = {resource_type: index for index, resource_type in enumerate(types)}
+        candidates = [resource for resource_type in types for resource in self.by_type.get(resource_type, [])]
+        if intent_name in UNRANKED_INTENTS:
+            return candidates
+        return sorted(candidates, key=lambda resource: (
+            -self.ctr(intent_name, resource.id), fit[resource.resource_type], resource.id,
+        ))
+
+    def recommend(self, intent_name, limit=SIDEBAR_SIZE):
+        """The best resources for an intent, topped up from other types if it has too few"""
+        ranked = self.rankings.get(intent_name) or self.rankings[DEFAULT_INTENT.name]
+        if len(ranked) < limit:
+            chosen = {resource.id for resource in ranked}
+            ranked = ranked + [resource for resource in self.rankings[DEFAULT_INTENT.name]
+                               if resource.id not in chosen]
+        return ranked[:limit]
+
+
+def _load():
+    window = getattr(settings, 'RESOURCE_RANKING_WINDOW_DAYS', 30)
+    clicks, impressions = {}, {}
+    rows = engagement.recent(window).exclude(intent='').values('intent', 'resource_id')\
+                                    .annotate(clicks=Sum('clicks'), impressions=Sum('impressions'))\
+                                    .order_by()
+    for row in rows:
+        key = (row['intent'], row['resource_id'])
+        clicks[key] = row['clicks']
+        impressions[key] = row['impressions']
+    resources = list(Resource.objects.filter(is_active=True).order_by('id'))
+    return ResourceCatalog(resources, clicks, impressions)
+
+
+def get_catalog():
+    """The current catalog, loading it on first use and after RESOURCE_CATALOG_REFRESH_INTERVAL seconds"""
+    catalog = _catalog
+    refresh_interval = getattr(settings, 'RESOURCE_CATALOG_REFRESH_INTERVAL', 5 * 60)
+    if catalog is None or time.monotonic() - catalog.loaded_at > refresh_interval:
+        catalog = _reload(catalog)
+    return catalog
+
+
+def _reload(stale):
+    global _catalog
+    with _lock:
+        # Another thread may have reloaded while this one waited
+        if _catalog is not None and _catalog is not stale:
+            return _catalog
+        _catalog = _load()
+        return _catalog
+
+
+def invalidate():
+    """Drop the catalog so the next request reloads it"""
+    global _catalog
+    _catalog = None
+
+
+def recommend(intent_name, limit=SIDEBAR_SIZE):
+    return get_catalog().recommend(intent_name, limit)
+
+
+def recommend_json(intent_name, limit=SIDEBAR_SIZE):
+    catalog = get_catalog()
+    return [catalog.json[resource.id] for resource in catalog.recommend(intent_name, limit)]
+
+
+def resource_json(resource):
+    return {
+        'id': resource.id,
+        'title': resource.title,
+        'description': resource.description,
+        'resource_type': resource.resource_type,
+        'type_label': resource.get_resource_type_display(),
+        'content': resource.content,
+    }
@@ -0,0 +1,136 @@
+# users/scoring.py
+"""
+Instrument registry for the standardized assessments.
+
+Each instrument declares its items, response range, reverse-scored items and
+severity bands once. Forms score a single response through score(), while bulk
+imports and re-scoring jobs pass whole batches through score_batch().
+"""
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class Instrument:
+    def __init__(self, code, name, items, max_response, severity_bands, reverse_items=()):
+        self.code = code
+        self.name = name
+        self.items = items
+        self.max_response = max_response
+        self.reverse_items = tuple(reverse_items)
+        # severity_bands is an ascending list of (highest score in band, label)
+        self.severity_bands = severity_bands
+        self.band_limits = [limit for limit, _ in severity_bands]
+        self.band_labels = [label for _, label in severity_bands]
+        self.max_score = items * max_response
+        self._reverse_index = [item - 1 for item in self.reverse_items]
+
+    @property
+    def fields(self):
+        return [f'q{i}' for i in range(1, self.items + 1)]
+
+    def validate(self, responses):
+        """Return responses as ints, raising ValueError if any answer is missing or out of range"""
+        if len(responses) != self.items:
+            raise ValueError(f'{self.code} expects {self.items} responses, got {len(responses)}')
+        values = [int(value) for value in responses]
+        for value in values:
+            if not 0 <= value <= self.max_response:
+                raise ValueError(f'{self.code} responses must be between 0 and {self.max_response}')
+        return values
+
+    def score(self, responses):
+        """Total score for one response vector, applying reverse scoring"""
+        values = self.validate(responses)
+        for i in self._reverse_index:
+            values[i] = self.max_response - values[i]
+        return sum(values)
+
+    def severity(self, score):
+        """Severity label for a total score, or None if the score is out of range"""
+        if score is None or score < 0:
+            return None
+        for limit, label in self.severity_bands:
+            if score <= limit:
+                return label
+        return None
+
+    def score_batch(self, responses):
+        """
+        Score many response vectors at once.
+        Takes an (n, items) array-like and returns (scores, severities) as lists.
+        """
+        if np is None:
+            scores = [self.score(row) for row in responses]
+            return scores, [self.severity(score) for score in scores]
+
+        matrix = np.asarray(responses, dtype=np.int16)
+        if matrix.ndim != 2 or matrix.shape[1] != self.items:
+            raise ValueError(f'{self.code} expects an (n, {self.items}) response matrix')
+        if matrix.size and (matrix.min() < 0 or matrix.max() > self.max_response):
+            raise ValueError(f'{self.code} responses must be between 0 and {self.max_response}')
+
+        if self._reverse_index:
+            matrix = matrix.copy()
+            matrix[:, self._reverse_index] = self.max_response - matrix[:, self._reverse_index]
+        scores = matrix.sum(axis=1)
+
+        # First band whose upper limit is >= the score
+        band_index = np.searchsorted(np.asarray(self.band_limits), scores, side='left')
+        labels = np.asarray(self.band_labels + [None], dtype=object)
+        return scores.tolist(), labels[band_index].tolist()
+
+    def __repr__(self):
+        return f'<Instrument {self.code}>'
+
+
+INSTRUMENTS = {
+    'PHQ-9': Instrument(
+        code='PHQ-9',
+        name='Patient Health Questionnaire-9',
+        items=9,
+        max_response=3,
+        severity_bands=[
+            (4, 'None/Minimal'),
+            (9, 'Mild'),
+            (14, 'Moderate'),
+            (19, 'Moderately Severe'),
+            (27, 'Severe'),
+        ],
+    ),
+    'GAD-7': Instrument(
+        code='GAD-7',
+        name='Generalized Anxiety Disorder-7',
+        items=7,
+        max_response=3,
+        severity_bands=[
+            (4, 'Minimal'),
+            (9, 'Mild'),
+            (14, 'Moderate'),
+            (21, 'Severe'),
+        ],
+    ),
+    'PSS': Instrument(
+        code='PSS',
+        name='Perceived Stress Scale-10',
+        items=10,
+        max_response=4,
+        reverse_items=[4, 5, 7, 8],
+        severity_bands=[
+            (13, 'Low stress'),
+            (26, 'Moderate stress'),
+            (40, 'High stress'),
+        ],
+    ),
+}
+
+# Alternate test type codes used by the assessment forms
+INSTRUMENT_ALIASES = {
+    'PSS-10': 'PSS',
+}
+
+
+def get_instrument(test_type):
+    """Look up an instrument by test type code, or return None if it is unknown"""
+    return INSTRUMENTS.get(INSTRUMENT_ALIASES.get(test_type, test_type))
@@ -0,0 +1,38 @@
+# users/signals.py
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from meditation.models import MeditationSession
+from .auth_backends import invalidate_user
+from .models import CustomUser, DailyTestRollup, MentalHealthTest, MoodEntry, Resource
+from .reports import touch_report
+from .resources import invalidate as invalidate_resource_catalog
+
+
+@receiver([post_save, post_delete], sender=MentalHealthTest)
+@receiver([post_save, post_delete], sender=MoodEntry)
+@receiver([post_save, post_delete], sender=MeditationSession)
+def invalidate_user_report(sender, instance, **kwargs):
+    """Any write to report inputs moves the user's report cache stamp forward"""
+    touch_report(instance.user_id)
+
+
+@receiver(post_delete, sender=MentalHealthTest)
+def remove_test_from_rollup(sender, instance, **kwargs):
+    """Deleting a test, directly or with its user, takes it back out of the daily rollups"""
+    DailyTestRollup.remove_test(instance)
+
+
+@receiver([post_save, post_delete], sender=Resource)
+def invalidate_resources(sender, **kwargs):
+    """Reload the resource catalog after any change to a resource"""
+    invalidate_resource_catalog()
+    # Again once committed, in case a request reloaded the old rows in the meantime
+    transaction.on_commit(invalidate_resource_catalog)
+
+
+@receiver([post_save, post_delete], sender=CustomUser)
+def invalidate_cached_user(sender, instance, **kwargs):
+    """Make the next request load the user's new state, e.g. after losing is_staff"""
+    invalidate_user(instance.pk)
+    transaction.on_commit(lambda: invalidate_user(instance.pk))
@@ -1,3 +1,1481 @@
-from django.test import TestCase
+import asyncio
+import importlib
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from asgiref.sync import iscoroutinefunction
+from io import StringIO
+from datetime import timedelta
+from django.apps import apps as django_apps
+from django.conf import settings
+from django.contrib.auth import authenticate
+from django.contrib.auth.models import Group, Permission
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import OperationalError, connection
+from django.db.models import Count, Q
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from careconnect.middleware import QueryBudgetExceeded, RequestMetricsMiddleware
+from careconnect.sessions import SessionStore, is_cookie_key
+from careconnect.testing import ConcurrentTestCase
+from games.models import Game, GameProgress, GameSession, LeaderboardEntry
+from meditation.models import MeditationSession
+from . import chat_backends, clicks, engagement, scoring
+from .auth_backends import EmailAuthBackend, UserCache, get_user_cache
+from .chat_backends import ResponseCache, get_response_cache, stream_reply
+from .clicks import ClickBuffer, ClickBufferFull
+from .ingest import bulk_ingest_tests, read_rows
+from .reports import build_report, get_report
+from .chatbot import DEFAULT_INTENT, INTENTS, MATCHER, match_intent, severity_for_level
+from .models import (
+    ChatMessage, ChatSession, CustomUser, DailyTestRollup, IngestCheckpoint, MentalHealthTest, MoodEntry, ReportStamp,
+    Resource, ResourceClick, ResourceEngagementRollup,
+)
+from .resources import get_catalog, invalidate as invalidate_catalog, recommend
+from .views import _encode_cursor, generate_chatbot_response
 
-# Create your tests here.
+
+class QueryPlanTests(TestCase):
+    """
+    Run the views (or the helpers they page through) and EXPLAIN QUERY PLAN every
+    SELECT they issue, failing if any of them scans a whole table instead of using an index.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user('plan@example.com', 'Plan', 'password')
+        cls.staff = CustomUser.objects.create_superuser('planstaff@example.com', 'Staff', 'password')
+        cls.game = Game.objects.create(
+            name='Breathing', description='', game_type='breathing', difficulty='easy', instructions=''
+        )
+        cls.resource = Resource.objects.create(
+            title='Box Breathing', description='', resource_type='breathing', content=''
+        )
+        cls.test = MentalHealthTest.objects.create(user=cls.user, test_type='GAD-7', score=12)
+        cls.session = ChatSession.objects.create(user=cls.user)
+        cls.message = ChatMessage.objects.create(session=cls.session, message_type='user', content='hello')
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def query_plan(self, sql):
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+            return [row[-1] for row in cursor.fetchall()]
+
+    def assertNoFullScans(self, run, allow=()):
+        """Call run() and check the plan of every SELECT it issues, except scans of the tables in allow"""
+        if connection.vendor != 'sqlite':
+            self.skipTest('Query plan assertions are written for SQLite')
+        with CaptureQueriesContext(connection) as ctx:
+            run()
+        selects = [query['sql'] for query in ctx.captured_queries if query['sql'].startswith('SELECT')]
+        self.assertTrue(selects, 'No SELECTs were captured')
+        for sql in selects:
+            plan = self.query_plan(sql)
+            full_scans = [
+                step for step in plan
+                if step.startswith('SCAN') and 'USING' not in step and step.split()[1] not in allow
+            ]
+            self.assertEqual(full_scans, [], f'Full table scan in plan of {sql}: {plan}')
+
+    def get(self, name, *args, **params):
+        return lambda: self.assertEqual(self.client.get(reverse(name, args=args), params).status_code, 200)
+
+    def test_test_history_queries(self):
+        self.assertNoFullScans(self.get('users:test_history'))
+
+    def test_test_history_keyset_page(self):
+        cursor = _encode_cursor(timezone.now(), self.test.id + 1)
+        self.assertNoFullScans(self.get('users:test_history_page', cursor=cursor))
+
+    def test_staff_severity_lookup(self):
+        self.client.force_login(self.staff)
+        self.assertNoFullScans(self.get(
+            'admin:users_mentalhealthtest_changelist', severity__exact='Severe', test_type__exact='GAD-7'
+        ))
+
+    def test_admin_analytics_queries(self):
+        self.client.force_login(self.staff)
+        # The all-time totals sum every rollup row, of which there is one per day and test type
+        self.assertNoFullScans(self.get('users:admin_analytics'), allow=['users_dailytestrollup'])
+
+    def test_report_queries(self):
+        start = timezone.localdate() - timedelta(days=30)
+        self.assertNoFullScans(lambda: build_report(self.user, start, timezone.localdate()))
+
+    def test_detects_full_scan(self):
+        with self.assertRaises(AssertionError):
+            self.assertNoFullScans(lambda: list(MoodEntry.objects.filter(notes='unindexed')))
+
+    def test_chatbot_queries(self):
+        session = self.client.session
+        session['chat_session_id'] = self.session.id
+        session.save()
+        use_click_buffer(self, ClickBuffer(start_thread=False))
+        # The whole active catalog is loaded once and cached
+        self.assertNoFullScans(self.get('users:chatbot'), allow=['users_resource'])
+        self.assertNoFullScans(self.get('users:chat_messages', since=self.message.id - 1))
+        cursor = _encode_cursor(timezone.now(), self.message.id + 1)
+        self.assertNoFullScans(self.get('users:chat_history_page', cursor=cursor))
+
+    def test_resource_click_queries(self):
+        use_click_buffer(self, ClickBuffer(start_thread=False))
+        url = reverse('users:resource_click', args=[self.resource.id])
+        self.assertNoFullScans(lambda: self.client.post(url, {'intent': 'stress'}), allow=['users_resource'])
+        self.assertNoFullScans(lambda: list(engagement.recent(30)))
+        self.assertNoFullScans(lambda: engagement.resource_summary(30))
+
+    def test_games_queries(self):
+        self.assertNoFullScans(self.get('games:play_game', self.game.id))
+        for period in ['all', 'day']:
+            self.assertNoFullScans(self.get('games:leaderboard', self.game.id, period=period))
+
+    def test_meditation_queries(self):
+        self.assertNoFullScans(self.get('meditation:meditation_page'))
+
+
+@override_settings(REQUEST_METRICS_ENABLED=True, REQUEST_METRICS_RAISE=True)
+class RequestMetricsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = CustomUser.objects.create_superuser('staff@example.com', 'Staff', 'password')
+
+    def setUp(self):
+        self.client.force_login(self.staff)
+
+    def test_server_timing_header_for_staff(self):
+        response = self.client.get(reverse('users:test_history'))
+        self.assertIn('sql;dur=', response['Server-Timing'])
+        self.assertIn('tpl;dur=', response['Server-Timing'])
+
+    def test_views_stay_within_query_budget(self):
+        MentalHealthTest.objects.create(user=self.staff, test_type='GAD-7', score=12)
+        for name in ['users:dashboard', 'users:test_history', 'users:admin_analytics', 'users:report']:
+            self.client.get(reverse(name))
+
+    def test_budget_exceeded_raises(self):
+        with override_settings(REQUEST_METRICS_BUDGETS={'users:test_history': 1}):
+            with self.assertRaises(QueryBudgetExceeded):
+                self.client.get(reverse('users:test_history'))
+
+    def test_async_chain_stays_async(self):
+        async def get_response(request):
+            return None
+        self.assertTrue(iscoroutinefunction(RequestMetricsMiddleware(get_response)))
+        self.assertFalse(iscoroutinefunction(RequestMetricsMiddleware(lambda request: None)))
+
+    async def test_async_requests_are_measured(self):
+        await self.async_client.aforce_login(self.staff)
+        # A sync view run through sync_to_async still has its queries and template counted
+        response = await self.async_client.get(reverse('users:test_history'))
+        self.assertNotIn('desc="0 queries"', response['Server-Timing'])
+        self.assertNotIn('tpl;dur=0.0,', response['Server-Timing'])
+
+        response = await self.async_client.post(reverse('users:chatbot_stream'), {'message': 'Hello'})
+        self.assertIn('sql;dur=', response['Server-Timing'])
+        self.assertTrue([chunk async for chunk in response.streaming_content])
+
+
+class ChatbotIntentTests(SimpleTestCase):
+    # Routing produced by the original sequential substring checks, which the matcher must keep
+    GOLDEN = [
+        ('I want to kill myself', 'crisis'),
+        ('Sometimes I think everyone would be better off dead', 'crisis'),
+        ("I've been thinking about self harm", 'crisis'),
+        ('I feel so anxious all the time', 'anxiety'),
+        ('I had a panic attack at the mall', 'anxiety'),
+        ("I'm worried about my exams", 'anxiety'),
+        ("I'm scared of the future", 'anxiety'),
+        ("I've been feeling nervous before meetings", 'anxiety'),
+        ("I'm panicking right now", 'anxiety'),
+        ('I feel depressed and empty', 'depression'),
+        ('Everything feels hopeless', 'depression'),
+        ("I'm so tired lately", 'depression'),
+        ("I can't sleep at night", 'depression'),
+        ('I have no energy to do anything', 'depression'),
+        ("I've been sleeping too much", 'depression'),
+        ('I feel worthless', 'depression'),
+        ("I've been feeling sad", 'depression'),
+        ("I'm stressed out", 'stress'),
+        ('I feel overwhelmed by everything', 'stress'),
+        ("There's so much pressure on me", 'stress'),
+        ('I think I have burnout', 'stress'),
+        ("I'm exhausted", 'stress'),
+        ("It's all too much", 'stress'),
+        ("I can't cope anymore", 'stress'),
+        ('I have insomnia', 'sleep'),
+        ('I keep staying awake until 3am', 'sleep'),
+        ('I have sleep problems', 'sleep'),
+        ('I feel lonely', 'relationship'),
+        ("I'm all alone", 'relationship'),
+        ('My relationship is falling apart', 'relationship'),
+        ("I don't have any friends", 'relationship'),
+        ('I have family problems', 'relationship'),
+        ('I feel isolated', 'relationship'),
+        ('Social situations are hard', 'relationship'),
+        ('My boss is terrible', 'work'),
+        ('I have a deadline tomorrow', 'work'),
+        ('School is hard', 'work'),
+        ('I need to study more', 'work'),
+        ('My job is draining', 'work'),
+        ('My colleague is rude', 'work'),
+        ('Work is busy', 'work'),
+        ('I have so much homework', 'work'),
+        ("I'm thinking about therapy", 'mental_health'),
+        ('How do I find counseling?', 'mental_health'),
+        ('I want to improve my mental health', 'mental_health'),
+        ('Tell me about meditation', 'mental_health'),
+        ('I want to practice mindfulness', 'mental_health'),
+        ('Self care tips?', 'mental_health'),
+        ('Hello', 'greeting'),
+        ('Hi there', 'greeting'),
+        ('hey', 'greeting'),
+        ('Good morning', 'greeting'),
+        ('Good evening!', 'greeting'),
+        ('How should I breathe?', 'breathing'),
+        ('I want to journal', 'journal'),
+        ('I like writing', 'journal'),
+        ('I want to express myself', 'journal'),
+        ('I have a lot of thoughts', 'journal'),
+        ('I want to share my feelings', 'journal'),
+        ("I'm feeling better today", 'positive'),
+        ('Thanks, that helps', 'positive'),
+        ('Thank you so much', 'positive'),
+        ("I'm happy today", 'positive'),
+        ("I'm grateful for my family", 'positive'),
+        ('I went for a walk', 'default'),
+        ('What is the weather?', 'default'),
+        ('ok', 'default'),
+        ('', 'default'),
+        ('Let me know', 'default'),
+    ]
+    # Substring matching found 'hi' inside 'with', 'this', 'think', 'nothing' and 'which'
+    FIXED = [
+        ('Can you help me with breathing exercises?', 'breathing'),
+        ('This is fine', 'default'),
+        ('I think so', 'default'),
+        ('Nothing really', 'default'),
+        ('Which one?', 'default'),
+    ]
+
+    def test_golden_routing(self):
+        for message, intent in self.GOLDEN + self.FIXED:
+            with self.subTest(message=message):
+                self.assertEqual(match_intent(message).name, intent)
+
+    def test_overlapping_keywords_resolve_by_priority(self):
+        # 'tired' is both a depression and a sleep keyword
+        self.assertEqual(MATCHER.find("I'm tired"), {'depression', 'sleep'})
+        self.assertEqual(match_intent("I'm tired").name, 'depression')
+        # A longer keyword does not hide a shorter one starting at the same word
+        self.assertEqual(MATCHER.find('I would be better off dead'), {'crisis', 'positive'})
+        self.assertEqual(MATCHER.find("I've been sleeping too much"), {'depression', 'stress'})
+
+    def test_word_boundaries(self):
+        self.assertEqual(match_intent('Thanks so much').name, 'positive')
+        self.assertEqual(match_intent('I keep panicking').name, 'anxiety')
+        self.assertEqual(match_intent('HI!').name, 'greeting')
+        self.assertEqual(match_intent('I can\u2019t sleep').name, 'depression')
+
+    def test_every_keyword_routes_to_its_intent(self):
+        for intent in INTENTS:
+            for keyword in intent.keywords + intent.whole_words:
+                with self.subTest(keyword=keyword):
+                    self.assertIn(intent.name, MATCHER.find(f'well, {keyword}.'))
+
+
+class ChatbotTurnTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user('chat@example.com', 'Chat', 'password')
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def post(self, message):
+        return self.client.post(reverse('users:chatbot'), {'message': message},
+                                HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+
+    def test_turn_is_two_statements(self):
+        self.post('Hello')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.post("I'm so stressed")
+        self.assertEqual(response.json()['severity'], 'moderate')
+        # Everything else is the session and user lookups done by middleware
+        chat_queries = [query['sql'] for query in queries if 'users_chat' in query['sql']]
+        self.assertEqual(len(chat_queries), 2, chat_queries)
+
+        session = ChatSession.objects.get(user=self.user)
+        self.assertEqual(session.distress_level, match_intent("I'm so stressed").distress_level)
+        self.assertEqual(
+            list(session.messages.values_list('message_type', 'content')[:3]),
+            [('user', 'Hello'), ('system', match_intent('Hello').message), ('user', "I'm so stressed")],
+        )
+
+    def test_session_ended_elsewhere(self):
+        self.post('Hello')
+        first = ChatSession.objects.get(user=self.user)
+        ChatSession.objects.filter(id=first.id).update(ended_at=timezone.now())
+
+        self.post('Hello again')
+        current = ChatSession.objects.get(user=self.user, ended_at__isnull=True)
+        self.assertNotEqual(current.id, first.id)
+        self.assertEqual(first.messages.count(), 2)
+        self.assertEqual(current.messages.count(), 2)
+        self.assertEqual(self.client.session['chat_session_id'], current.id)
+
+    def test_end_session_starts_a_new_one(self):
+        self.post('Hello')
+        self.client.post(reverse('users:end_chat_session'))
+        response = self.client.get(reverse('users:chatbot'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(ChatSession.objects.filter(user=self.user).count(), 2)
+        self.assertEqual(len(response.context['chat_messages']), 0)
+
+    def test_record_turn_rejects_ended_session(self):
+        session = ChatSession.objects.create(user=self.user, ended_at=timezone.now())
+        self.assertFalse(ChatSession.record_turn(session.id, self.user.id, 'Hi', 'Hello!', 3))
+        self.assertFalse(session.messages.exists())
+
+
+class TestHistoryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user('tests@example.com', 'Tests', 'password')
+        start = timezone.now() - timedelta(days=1)
+        MentalHealthTest.objects.bulk_create([
+            MentalHealthTest(user=cls.user, test_type=['PHQ-9', 'GAD-7'][i % 2], score=i % 20, severity='Mild',
+                             date_taken=start + timedelta(minutes=i // 2))
+            for i in range(45)
+        ])
+        cls.ids = list(MentalHealthTest.objects.filter(user=cls.user).order_by('-date_taken', '-id')
+                       .values_list('id', flat=True))
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def test_pages_walk_through_every_test_once(self):
+        response = self.client.get(reverse('users:test_history'))
+        self.assertEqual(response.context['total_tests'], 45)
+        self.assertEqual(response.context['phq9_tests'], 23)
+        seen = [test.id for test in response.context['tests']]
+        self.assertEqual(len(seen), 20)
+        cursor = response.context['next_cursor']
+        while cursor:
+            data = self.client.get(reverse('users:test_history_page'), {'cursor': cursor}).json()
+            self.assertEqual(data['status'], 'success')
+            seen += [test['id'] for test in data['tests']]
+            cursor = data['next_cursor']
+        self.assertEqual(seen, self.ids)
+
+    def test_page_json_fields(self):
+        data = self.client.get(reverse('users:test_history_page')).json()
+        test = MentalHealthTest.objects.get(id=data['tests'][0]['id'])
+        self.assertEqual(data['tests'][0]['url'], test.get_absolute_url())
+        self.assertEqual(data['tests'][0]['severity'], test.get_severity())
+        self.assertEqual(data['tests'][0]['date_taken'], test.date_taken.isoformat())
+
+    def test_invalid_cursors_are_rejected(self):
+        huge = '9' * 30
+        for cursor in ['nope', '12_x', f'{huge}_1', f'1_{huge}']:
+            response = self.client.get(reverse('users:test_history_page'), {'cursor': cursor})
+            self.assertEqual(response.status_code, 400, cursor)
+
+
+@override_settings(REQUEST_METRICS_ENABLED=True, REQUEST_METRICS_RAISE=True)
+class ChatHistoryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user('history@example.com', 'History', 'password')
+        cls.session = ChatSession.objects.create(user=cls.user)
+        start = timezone.now() - timedelta(hours=1)
+        ChatMessage.objects.bulk_create([
+            ChatMessage(session=cls.session, message_type='user' if i % 2 == 0 else 'system',
+                        content=f'message {i}', timestamp=start + timedelta(seconds=i // 2))
+            for i in range(75)
+        ])
+        cls.ids = list(cls.session.messages.values_list('id', flat=True))
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def test_initial_load_is_capped(self):
+        response = self.client.get(reverse('users:chatbot'))
+        messages = response.context['chat_messages']
+        self.assertEqual([message.id for message in messages], self.ids[-30:])
+        self.assertEqual(response.context['last_message_id'], self.ids[-1])
+        self.assertIsNotNone(response.context['history_cursor'])
+
+    def test_history_pages_walk_back_to_the_start(self):
+        cursor = self.client.get(reverse('users:chatbot')).context['history_cursor']
+        seen = self.ids[-30:]
+        while cursor:
+            data = self.client.get(reverse('users:chat_history_page'), {'cursor': cursor}).json()
+            seen = [message['id'] for message in data['messages']] + seen
+            cursor = data['next_cursor']
+        self.assertEqual(seen, self.ids)
+
+    def test_invalid_cursor(self):
+        cursor = self.client.get(reverse('users:chatbot')).context['history_cursor']
+        for bad in ['nope', f"{'9' * 30}_1"]:
+            response = self.client.get(reverse('users:chat_history_page'), {'cursor': bad})
+            self.assertEqual(response.status_code, 400, bad)
+        self.assertEqual(self.client.get(reverse('users:chat_history_page'), {'cursor': cursor}).status_code, 200)
+
+    def test_poll_returns_only_newer_messages(self):
+        url = reverse('users:chat_messages')
+        data = self.client.get(url, {'since': self.ids[-1]}).json()
+        self.assertEqual(data['messages'], [])
+
+        response = self.client.post(reverse('users:chatbot'), {'message': 'Hello'},
+                                    HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        data = self.client.get(url, {'since': self.ids[-1]}).json()
+        self.assertEqual([message['message_type'] for message in data['messages']], ['user', 'system'])
+        self.assertEqual(data['messages'][0]['content'], 'Hello')
+        self.assertEqual(response.json()['last_message_id'], data['messages'][-1]['id'])
+        self.assertFalse(data['has_more'])
+
+    def test_poll_is_paged(self):
+        data = self.client.get(reverse('users:chat_messages'), {'since': 0}).json()
+        self.assertEqual([message['id'] for message in data['messages']], self.ids[:30])
+        self.assertTrue(data['has_more'])
+        self.assertEqual(self.client.get(reverse('users:chat_messages'), {'since': 'x'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('users:chat_messages'), {'since': '9' * 30}).status_code, 400)
+
+
+class ChatbotStreamTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user('stream@example.com', 'Stream', 'password')
+
+    async def stream(self, message):
+        """POST a message to the streaming endpoint and return its (event, data) pairs"""
+        response = await self.async_client.post(reverse('users:chatbot_stream'), {'message': message})
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        body = b''.join([chunk async for chunk in response.streaming_content]).decode()
+        events = []
+        for block in body.strip().split('\n\n'):
+            event, data = block.split('\n')
+            events.append((event.removeprefix('event: '), json.loads(data.removeprefix('data: '))))
+        return events
+
+    async def test_streams_reply_and_stores_turn(self):
+        await self.async_client.aforce_login(self.user)
+        events = await self.stream("I'm so stressed")
+        intent = match_intent("I'm so stressed")
+
+        self.assertGreater(len(events), 2)
+        self.assertEqual(''.join(data['text'] for event, data in events if event == 'delta'), intent.message)
+        event, done = events[-1]
+        self.assertEqual(event, 'done')
+        self.assertEqual(done['severity'], intent.severity)
+
+        session = await ChatSession.objects.aget(user=self.user)
+        self.assertEqual(session.distress_level, intent.distress_level)
+        messages = [(m.message_type, m.content) async for m in session.messages.all()]
+        self.assertEqual(messages, [('user', "I'm so stressed"), ('system', intent.message)])
+        self.assertEqual(done['last_message_id'], await session.messages.order_by('-id').values_list('id', flat=True).afirst())
+
+    async def test_requires_login(self):
+        response = await self.async_client.post(reverse('users:chatbot_stream'), {'message': 'Hello'})
+        self.assertEqual(response.status_code, 302)
+
+    @override_settings(CHATBOT_CANNED_DELAY=0.01)
+    async def test_concurrent_streams_share_one_thread(self):
+        await self.async_client.aforce_login(self.user)
+        words = len([text async for text in chat_backends.CannedBackend().stream('Hello', match_intent('Hello'))])
+        start = time.perf_counter()
+        replies = await asyncio.gather(*[self.stream('Hello') for _ in range(200)])
+        elapsed = time.perf_counter() - start
+        self.assertTrue(all(events[-1][0] == 'done' for events in replies))
+        # One after another the replies would take 200 * words * 10ms
+        self.assertLess(elapsed, 200 * words * 0.01 / 10)
+        self.assertEqual(await ChatMessage.objects.filter(session__user=self.user).acount(), 400)
+
+    @override_settings(CHATBOT_BACKEND='openai', CHATBOT_OPENAI_BASE_URL='http://127.0.0.1:9/v1',
+                       CHATBOT_BACKEND_TIMEOUT=1)
+    async def test_unreachable_backend_falls_back_to_canned_reply(self):
+        intent = match_intent('I feel lonely')
+        with self.assertLogs('users.chat_backends', 'ERROR'):
+            reply = ''.join([text async for text in stream_reply('I feel lonely', intent)])
+        self.assertEqual(reply, intent.message)
+
+    async def test_disconnect_closes_backend_stream(self):
+        closed = []
+
+        class SlowBackend:
+            cacheable = False
+
+            async def stream(self, message, intent, context=None):
+                try:
+                    while True:
+                        yield 'word '
+                        await asyncio.sleep(0.01)
+                finally:
+                    closed.append(True)
+
+        chat_backends._backend = SlowBackend()
+        try:
+            reply = stream_reply('Hello', match_intent('Hello'))
+            self.assertEqual(await reply.__anext__(), 'word ')
+            await reply.aclose()
+            self.assertEqual(closed, [True])
+
+            # Crisis messages never reach the configured backend
+            crisis = match_intent('I want to kill myself')
+            self.assertEqual(''.join([text async for text in stream_reply('I want to kill myself', crisis)]),
+                             crisis.message)
+        finally:
+            chat_backends._backend = None
+
+
+class ChatbotResponseCacheTests(SimpleTestCase):
+    class CountingBackend:
+        cacheable = True
+
+        def __init__(self):
+            self.calls = []
+
+        async def stream(self, message, intent, context=None):
+            self.calls.append((intent.name, context))
+            yield f'{intent.name} '
+            yield f'{context}'
+
+    def setUp(self):
+        self.backend = chat_backends._backend = self.CountingBackend()
+        self.addCleanup(setattr, chat_backends, '_backend', None)
+        get_response_cache().clear()
+
+    def reply(self, message, context=None):
+        async def collect():
+            return ''.join([text async for text in stream_reply(message, match_intent(message), context)])
+        return asyncio.run(collect())
+
+    def test_repeated_message_and_context_hit_the_cache(self):
+        self.assertEqual(self.reply("I'm anxious", 'mild'), 'anxiety mild')
+        self.assertEqual(self.reply("i'm  ANXIOUS!", 'mild'), 'anxiety mild')
+        self.assertEqual(self.reply("I'm anxious", 'severe'), 'anxiety severe')
+        self.assertEqual(self.backend.calls, [('anxiety', 'mild'), ('anxiety', 'severe')])
+        self.assertEqual(get_response_cache().stats()['hits'], 1)
+        self.assertEqual(get_response_cache().stats()['misses'], 2)
+
+    def test_replies_are_not_shared_across_different_messages(self):
+        # A generated reply may echo what its user disclosed
+        self.reply("I'm anxious about my divorce hearing", 'mild')
+        self.reply('I had a panic attack', 'mild')
+        self.assertEqual(self.backend.calls, [('anxiety', 'mild'), ('anxiety', 'mild')])
+        self.assertEqual(get_response_cache().stats()['hits'], 0)
+
+    def test_crisis_bypasses_cache_and_backend(self):
+        crisis = match_intent('I want to kill myself')
+        self.assertEqual(self.reply('I want to kill myself'), crisis.message)
+        self.assertEqual(self.reply('I want to kill myself'), crisis.message)
+        self.assertEqual(self.backend.calls, [])
+        self.assertEqual(get_response_cache().stats()['size'], 0)
+        self.assertEqual(get_response_cache().stats()['misses'], 0)
+
+    def test_lru_and_ttl_eviction(self):
+        cache = ResponseCache(max_size=2, ttl=60)
+        cache.set('a', ['1'])
+        cache.set('b', ['2'])
+        cache.get('a')
+        cache.set('c', ['3'])
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), ['1'])
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+        expired = ResponseCache(ttl=0)
+        expired.set('a', ['1'])
+        self.assertIsNone(expired.get('a'))
+
+    def test_canned_replies_are_precomputed(self):
+        for intent in INTENTS + [DEFAULT_INTENT]:
+            self.assertEqual(''.join(intent.chunks), intent.message)
+        self.assertIs(generate_chatbot_response('Hello'), match_intent('Hello').response)
+
+    def test_severity_for_level(self):
+        for intent in INTENTS:
+            self.assertEqual(severity_for_level(intent.distress_level), intent.severity)
+        self.assertIsNone(severity_for_level(None))
+
+
+class ResourceCatalogTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user('resources@example.com', 'Resources', 'password')
+        cls.breathing = Resource.objects.create(title='Box Breathing', description='', resource_type='breathing',
+                                                content='Breathe in for 4 seconds')
+        cls.grounding = Resource.objects.create(title='Grounding', description='', resource_type='stress_management',
+                                                content='Name 5 things you can see')
+        cls.article = Resource.objects.create(title='Understanding Anxiety', description='', resource_type='article',
+                                              content='https://example.com/anxiety')
+        cls.video = Resource.objects.create(title='Guided Relaxation', description='', resource_type='video',
+                                            content='https://example.com/video')
+
+    def setUp(self):
+        invalidate_catalog()
+        self.addCleanup(invalidate_catalog)
+
+    def test_steady_state_needs_no_queries(self):
+        get_catalog()
+        with self.assertNumQueries(0):
+            self.assertEqual(recommend('anxiety')[0], self.breathing)
+            recommend('default')
+
+    def test_ranked_by_type_fit_then_click_through(self):
+        self.assertEqual(recommend('anxiety'), [self.breathing, self.grounding, self.article, self.video])
+        # Topped up from other types when an intent suits too few
+        self.assertEqual(recommend('breathing', limit=3), [self.breathing, self.grounding, self.article])
+
+        for _ in range(3):
+            session = ChatSession.objects.create(user=self.user)
+            ResourceClick.objects.create(user=self.user, resource=self.article, chat_session=session, intent='anxiety')
+        engagement.roll_up_clicks()
+        # Rankings only move when the catalog is rebuilt
+        self.assertEqual(recommend('anxiety')[0], self.breathing)
+        invalidate_catalog()
+        self.assertEqual(recommend('anxiety')[0], self.article)
+        self.assertEqual(recommend('stress')[0], self.grounding)
+
+        ResourceClick.objects.create(user=self.user, resource=self.breathing, chat_session=session, intent='crisis')
+        engagement.roll_up_clicks()
+        helpline = Resource.objects.create(title='Lifeline', description='', resource_type='helpline', content='988')
+        self.assertEqual(recommend('crisis')[0], helpline)
+
+    def test_resources_shown_often_but_never_clicked_sink(self):
+        today = timezone.localdate()
+        ResourceEngagementRollup.add_counts('impressions', {(today, self.breathing.id, 'anxiety', 'moderate'): 100})
+        self.assertEqual(recommend('anxiety')[:2], [self.grounding, self.article])
+
+    def test_saving_a_resource_reloads_the_catalog(self):
+        get_catalog()
+        Resource.objects.filter(id=self.breathing.id).update(is_active=False)
+        self.assertIn(self.breathing, recommend('anxiety'))
+        self.breathing.is_active = False
+        self.breathing.save()
+        self.assertNotIn(self.breathing, recommend('anxiety'))
+
+    @override_settings(RESOURCE_CATALOG_REFRESH_INTERVAL=0)
+    def test_catalog_is_rebuilt_periodically(self):
+        catalog = get_catalog()
+        time.sleep(0.001)
+        self.assertIsNot(get_catalog(), catalog)
+
+    def test_sidebar_and_clicks_use_the_intent(self):
+        buffer = use_click_buffer(self, ClickBuffer(start_thread=False))
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('users:chatbot'))
+        self.assertEqual(response.context['intent'], 'default')
+        self.assertEqual(len(response.context['resources']), 4)
+
+        data = self.client.post(reverse('users:chatbot'), {'message': "I'm so stressed"},
+                                HTTP_X_REQUESTED_WITH='XMLHttpRequest').json()
+        self.assertEqual(data['intent'], 'stress')
+        self.assertEqual(data['resources'][0]['id'], self.grounding.id)
+        self.assertEqual(self.client.get(reverse('users:chatbot')).context['intent'], 'stress')
+
+        self.client.post(reverse('users:resource_click', args=[self.grounding.id]), {'intent': 'stress'})
+        self.client.post(reverse('users:resource_click', args=[self.grounding.id]), {'intent': 'bogus'})
+        self.assertEqual(buffer.flush(), 2)
+        self.assertEqual(list(ResourceClick.objects.values_list('intent', flat=True).order_by('id')), ['stress', ''])
+
+
+def use_click_buffer(test, buffer):
+    """Make buffer the one resource_click uses for the rest of the test"""
+    previous, clicks._buffer = clicks._buffer, buffer
+
+    def restore():
+        clicks._buffer = previous
+        buffer.close()
+    test.addCleanup(restore)
+    return buffer
+
+
+def dead_pid():
+    """The pid of a process that has already exited"""
+    process = subprocess.Popen([sys.executable, '-c', ''])
+    process.wait()
+    return process.pid
+
+
+class ClickBufferTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user('clicks@example.com', 'Clicks', 'password')
+        cls.resource = Resource.objects.create(title='Box Breathing', description='', resource_type='breathing',
+                                               content='Breathe in for 4 seconds')
+
+    def test_clicks_are_written_in_one_batch(self):
+        buffer = ClickBuffer(start_thread=False)
+        for _ in range(50):
+            buffer.add(self.user.id, self.resource.id, intent='anxiety')
+        self.assertFalse(ResourceClick.objects.exists())
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(buffer.flush(), 50)
+        self.assertEqual(sum('INSERT' in query['sql'] for query in queries), 1)
+        self.assertEqual(ResourceClick.objects.filter(intent='anxiety').count(), 50)
+        self.assertEqual(buffer.flush(), 0)
+
+    def test_batch_size_and_interval_make_a_flush_due(self):
+        buffer = ClickBuffer(batch_size=3, interval_ms=20, start_thread=False)
+        buffer.add(self.user.id, self.resource.id)
+        self.assertFalse(buffer._due())
+        time.sleep(0.03)
+        self.assertTrue(buffer._due())
+        buffer.flush()
+        for _ in range(3):
+            buffer.add(self.user.id, self.resource.id)
+        self.assertTrue(buffer._due())
+
+    def test_full_buffer_pushes_back(self):
+        buffer = use_click_buffer(self, ClickBuffer(max_size=2, block_ms=5, start_thread=False))
+        buffer.add(self.user.id, self.resource.id)
+        buffer.add(self.user.id, self.resource.id)
+        with self.assertRaises(ClickBufferFull):
+            buffer.add(self.user.id, self.resource.id)
+
+        self.client.force_login(self.user)
+        response = self.client.post(reverse('users:resource_click', args=[self.resource.id]))
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '1')
+
+        buffer.flush()
+        response = self.client.post(reverse('users:resource_click', args=[self.resource.id]))
+        self.assertEqual(response.json()['status'], 'success')
+        self.assertEqual(len(buffer.pending), 1)
+
+    @override_settings(CLICK_BUFFER_ENABLED=False)
+    def test_unbuffered_clicks_are_written_immediately(self):
+        self.client.force_login(self.user)
+        self.client.post(reverse('users:resource_click', args=[self.resource.id]))
+        self.assertEqual(ResourceClick.objects.count(), 1)
+
+    def test_spooled_clicks_survive_a_crash(self):
+        spool_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, spool_dir)
+        crashed = ClickBuffer(spool_dir=spool_dir, start_thread=False)
+        crashed.add(self.user.id, self.resource.id, intent='stress')
+        crashed.add(self.user.id, self.resource.id, intent='sleep')
+        crashed._spool.close()
+        # As if the process died before writing: its spool is left under a pid that no longer runs
+        left_behind = crashed.spool_path.replace(f'-{os.getpid()}.', f'-{dead_pid()}.')
+        os.replace(crashed.spool_path, left_behind)
+
+        buffer = ClickBuffer(spool_dir=spool_dir, start_thread=False)
+        self.assertFalse(os.path.exists(left_behind))
+        self.assertEqual(len(buffer.pending), 2)
+        buffer.add(self.user.id, self.resource.id, intent='work')
+        buffer.close()
+        self.assertEqual(sorted(ResourceClick.objects.values_list('intent', flat=True)), ['sleep', 'stress', 'work'])
+        self.assertEqual(os.listdir(spool_dir), [])
+
+    def test_restart_with_the_same_pid_recovers_its_spools(self):
+        spool_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, spool_dir)
+        crashed = ClickBuffer(spool_dir=spool_dir, start_thread=False)
+        crashed.add(self.user.id, self.resource.id, intent='stress')
+        crashed._spool.close()
+        # A batch the old process had moved aside but not written, under the name the next flush would use
+        with open(f'{crashed.spool_path}.1.flushing', 'w') as handle:
+            handle.write(json.dumps({'user_id': self.user.id, 'resource_id': self.resource.id,
+                                     'chat_session_id': None, 'intent': 'sleep',
+                                     'clicked_at': timezone.now().isoformat()}) + '\n')
+
+        # Containers often restart with the same pid
+        buffer = ClickBuffer(spool_dir=spool_dir, start_thread=False)
+        self.assertEqual(sorted(click['intent'] for click in buffer.pending), ['sleep', 'stress'])
+        buffer.add(self.user.id, self.resource.id, intent='work')
+        buffer.flush()
+        buffer.close()
+        self.assertEqual(sorted(ResourceClick.objects.values_list('intent', flat=True)), ['sleep', 'stress', 'work'])
+        self.assertEqual(os.listdir(spool_dir), [])
+
+    def test_recovered_clicks_already_written_are_not_duplicated(self):
+        spool_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, spool_dir)
+        crashed = ClickBuffer(spool_dir=spool_dir, start_thread=False)
+        crashed.add(self.user.id, self.resource.id, intent='stress')
+        crashed.add(self.user.id, self.resource.id, intent='sleep')
+        # Died after the batch committed but before its spool was deleted
+        crashed._write(crashed.pending)
+        crashed._spool.close()
+
+        buffer = ClickBuffer(spool_dir=spool_dir, start_thread=False)
+        self.assertEqual(len(buffer.pending), 2)
+        self.assertEqual(buffer.flush(), 0)
+        self.assertEqual(ResourceClick.objects.count(), 2)
+        buffer.close()
+        self.assertEqual(os.listdir(spool_dir), [])
+
+
+class ClickBufferFlushTests(ConcurrentTestCase):
+    """The flusher thread writes on its own connection, so these tests need committed data"""
+
+    def setUp(self):
+        super().setUp()
+        self.user = CustomUser.objects.create_user('flusher@example.com', 'Flusher', 'password')
+        self.resource = Resource.objects.create(title='Grounding', description='', resource_type='stress_management',
+                                                content='Name 5 things you can see')
+
+    def test_flusher_writes_after_the_interval_and_on_close(self):
+        buffer = ClickBuffer(batch_size=1000, interval_ms=20)
+        buffer.add(self.user.id, self.resource.id)
+        deadline = time.monotonic() + 5
+        while not ResourceClick.objects.exists() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(ResourceClick.objects.count(), 1)
+
+        buffer.interval = 60
+        buffer.add(self.user.id, self.resource.id)
+        buffer.close()
+        self.assertEqual(ResourceClick.objects.count(), 2)
+        self.assertFalse(buffer._thread.is_alive())
+
+    def test_clicks_on_deleted_resources_are_dropped(self):
+        gone = Resource.objects.create(title='Old', description='', resource_type='article', content='')
+        buffer = ClickBuffer(start_thread=False)
+        buffer.add(self.user.id, self.resource.id)
+        buffer.add(self.user.id, gone.id)
+        gone.delete()
+        with self.assertLogs('users.clicks', 'WARNING'):
+            self.assertEqual(buffer.flush(), 1)
+        self.assertEqual(list(ResourceClick.objects.values_list('resource_id', flat=True)), [self.resource.id])
+
+    def test_clicks_saved_before_a_failed_fallback_are_not_written_twice(self):
+        gone = Resource.objects.create(title='Old', description='', resource_type='article', content='')
+        buffer = ClickBuffer(start_thread=False)
+        start = timezone.now()
+        for i, resource in enumerate([self.resource, gone, self.resource]):
+            buffer.add(self.user.id, resource.id, clicked_at=start + timedelta(seconds=i))
+        gone.delete()
+
+        # The database goes away after the first row of the per-row fallback is saved
+        save, calls = ResourceClick.save, []
+
+        def flaky_save(click, *args, **kwargs):
+            calls.append(click.resource_id)
+            if len(calls) == 3:
+                raise OperationalError('database is locked')
+            return save(click, *args, **kwargs)
+        ResourceClick.save = flaky_save
+        try:
+            with self.assertLogs('users.clicks', 'WARNING'), self.assertRaises(OperationalError):
+                buffer.flush()
+        finally:
+            ResourceClick.save = save
+
+        with self.assertLogs('users.clicks', 'WARNING'):
+            self.assertEqual(buffer.flush(), 1)
+        self.assertEqual(ResourceClick.objects.count(), 2)
+
+
+class EngagementRollupTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user('engagement@example.com', 'Engagement', 'password')
+        cls.breathing = Resource.objects.create(title='Box Breathing', description='', resource_type='breathing',
+                                                content='Breathe in for 4 seconds')
+        cls.article = Resource.objects.create(title='Understanding Anxiety', description='', resource_type='article',
+                                              content='https://example.com/anxiety')
+
+    def setUp(self):
+        invalidate_catalog()
+        self.addCleanup(invalidate_catalog)
+
+    def click(self, resource, intent='anxiety', days_ago=0, severity='moderate'):
+        return ResourceClick.objects.create(user=self.user, resource=resource, intent=intent, severity=severity,
+                                            clicked_at=timezone.now() - timedelta(days=days_ago))
+
+    def rollup(self, resource, intent='anxiety', days_ago=0, severity='moderate'):
+        return ResourceEngagementRollup.objects.get(
+            date=timezone.localdate() - timedelta(days=days_ago), resource=resource, intent=intent, severity=severity,
+        )
+
+    def test_only_clicks_past_the_watermark_are_rolled_up(self):
+        for _ in range(3):
+            self.click(self.breathing)
+        self.click(self.breathing, days_ago=2)
+        self.click(self.article, intent='', severity='')
+        summary = engagement.roll_up_clicks(batch_size=2)
+        self.assertEqual((summary['clicks'], summary['batches']), (5, 3))
+        self.assertEqual(self.rollup(self.breathing).clicks, 3)
+        self.assertEqual(self.rollup(self.breathing, days_ago=2).clicks, 1)
+        self.assertEqual(self.rollup(self.article, intent='', severity='').clicks, 1)
+
+        self.assertEqual(engagement.roll_up_clicks()['clicks'], 0)
+        latest = self.click(self.breathing)
+        summary = engagement.roll_up_clicks()
+        self.assertEqual((summary['clicks'], summary['watermark']), (1, latest.id))
+        self.assertEqual(self.rollup(self.breathing).clicks, 4)
+
+        ResourceEngagementRollup.add_counts('impressions', {
+            (timezone.localdate(), self.breathing.id, 'anxiety', 'moderate'): 8,
+        })
+        engagement.rebuild_clicks()
+        row = self.rollup(self.breathing)
+        self.assertEqual((row.clicks, row.impressions, row.ctr), (4, 8, 0.5))
+
+    def test_sidebar_renders_count_as_impressions(self):
+        buffer = use_click_buffer(self, ClickBuffer(start_thread=False))
+        self.client.force_login(self.user)
+        self.client.get(reverse('users:chatbot'))
+        self.client.post(reverse('users:chatbot'), {'message': "I'm feeling anxious"},
+                         HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.client.post(reverse('users:resource_click', args=[self.breathing.id]),
+                         {'intent': 'anxiety', 'severity': 'moderate'})
+        self.assertFalse(ResourceEngagementRollup.objects.exists())
+
+        self.assertEqual(buffer.flush(), 1)
+        engagement.roll_up_clicks()
+        # Before the first turn the session has no severity
+        self.assertEqual(self.rollup(self.breathing, intent='default', severity='').impressions, 1)
+        row = self.rollup(self.breathing)
+        self.assertEqual((row.impressions, row.clicks), (1, 1))
+
+    def test_severity_comes_from_the_chat_session(self):
+        buffer = use_click_buffer(self, ClickBuffer(start_thread=False))
+        # Scored 'Moderately Severe', which the recommendation created with the test keeps as its severity
+        test = MentalHealthTest.objects.create(user=self.user, test_type='PHQ-9', score=17)
+        ChatSession.objects.create(user=self.user, test_recommendation=test.recommendations.get())
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(reverse('users:chatbot')).context['sidebar_severity'], 'moderate')
+        # A sleep question is mild; the sidebar it brings back is shown, and clicked, at that severity
+        data = self.client.post(reverse('users:chatbot'), {'message': 'I have insomnia'},
+                                HTTP_X_REQUESTED_WITH='XMLHttpRequest').json()
+        self.assertEqual((data['intent'], data['sidebar_severity']), ('sleep', 'mild'))
+
+        url = reverse('users:resource_click', args=[self.breathing.id])
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(url, {'intent': 'sleep', 'severity': data['sidebar_severity']})
+        self.assertFalse([query for query in queries if 'users_chatsession' in query['sql']])
+        self.client.post(url, {'intent': 'sleep', 'severity': 'Moderately Severe'})
+
+        buffer.flush()
+        engagement.roll_up_clicks()
+        self.assertEqual(self.rollup(self.breathing, intent='default', severity='moderate').impressions, 1)
+        self.assertEqual(self.rollup(self.breathing, intent='sleep', severity='mild').clicks, 1)
+        self.assertEqual(list(ResourceClick.objects.order_by('id').values_list('severity', flat=True)),
+                         ['mild', ''])
+
+    @override_settings(CLICK_BUFFER_ENABLED=False)
+    def test_unbuffered_impressions_are_written_immediately(self):
+        clicks.record_impressions([self.breathing, {'id': self.article.id}], 'anxiety', 'moderate')
+        self.assertEqual(self.rollup(self.breathing).impressions, 1)
+        self.assertEqual(self.rollup(self.article).impressions, 1)
+
+    def test_staff_dashboard_reads_the_rollups(self):
+        ResourceEngagementRollup.add_counts('impressions', {
+            (timezone.localdate(), self.breathing.id, 'anxiety', 'moderate'): 10,
+            (timezone.localdate(), self.article.id, 'anxiety', 'moderate'): 10,
+            (timezone.localdate() - timedelta(days=45), self.article.id, 'anxiety', 'moderate'): 10,
+        })
+        self.click(self.article)
+        engagement.roll_up_clicks()
+
+        self.client.force_login(CustomUser.objects.create_superuser('analyst@example.com', 'Analyst', 'password'))
+        response = self.client.get(reverse('users:admin_analytics'))
+        summary = response.context['resource_engagement']
+        self.assertEqual([row['resource_id'] for row in summary], [self.article.id, self.breathing.id])
+        self.assertEqual((summary[0]['impressions'], summary[0]['clicks'], summary[0]['ctr']), (10, 1, 0.1))
+        self.assertEqual(response.context['severity_engagement'],
+                         [('moderate', {'impressions': 20, 'clicks': 1, 'ctr': 0.05})])
+        self.assertContains(response, 'Understanding Anxiety')
+
+
+class ScoringTests(SimpleTestCase):
+    def test_pss_reverse_scores_positive_items(self):
+        pss = scoring.get_instrument('PSS')
+        # Items 4, 5, 7 and 8 count 4 - answer
+        self.assertEqual(pss.score([0] * 10), 16)
+        self.assertEqual(pss.score([4] * 10), 24)
+        self.assertEqual(pss.score([4, 4, 4, 0, 0, 4, 0, 0, 4, 4]), 40)
+        self.assertEqual(pss.severity(pss.score([4, 4, 4, 0, 0, 4, 0, 0, 4, 4])), 'High stress')
+
+    def test_pss_10_is_an_alias(self):
+        self.assertIs(scoring.get_instrument('PSS-10'), scoring.INSTRUMENTS['PSS'])
+        self.assertIsNone(scoring.get_instrument('PHQ-2'))
+
+    def test_severity_bands_and_validation(self):
+        phq9 = scoring.get_instrument('PHQ-9')
+        self.assertEqual([phq9.severity(score) for score in [0, 4, 5, 27, 28, -1]],
+                         ['None/Minimal', 'None/Minimal', 'Mild', 'Severe', None, None])
+        with self.assertRaises(ValueError):
+            phq9.score([1] * 8)
+        with self.assertRaises(ValueError):
+            phq9.score([4] * 9)
+
+    def test_score_batch_matches_score(self):
+        rng = random.Random(7)
+        for instrument in scoring.INSTRUMENTS.values():
+            responses = [[rng.randint(0, instrument.max_response) for _ in range(instrument.items)]
+                         for _ in range(200)]
+            expected = ([instrument.score(row) for row in responses],
+                        [instrument.severity(instrument.score(row)) for row in responses])
+            self.assertEqual(instrument.score_batch(responses), expected, instrument.code)
+
+            # And without numpy
+            numpy, scoring.np = scoring.np, None
+            try:
+                self.assertEqual(instrument.score_batch(responses), expected, instrument.code)
+            finally:
+                scoring.np = numpy
+
+
+class TestSeverityTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user('severity@example.com', 'Severity', 'password')
+
+    def test_get_severity_computes_when_nothing_is_stored(self):
+        unsaved = MentalHealthTest(user=self.user, test_type='GAD-7', score=12)
+        with self.assertNumQueries(0):
+            self.assertEqual(unsaved.get_severity(), 'Moderate')
+        self.assertEqual(unsaved.recommendation_type, 'chatbot')
+
+        test = MentalHealthTest.objects.create(user=self.user, test_type='PSS', score=30)
+        MentalHealthTest.objects.filter(id=test.id).update(severity='')
+        self.assertEqual(MentalHealthTest.objects.get(id=test.id).get_severity(), 'High stress')
+        # Unknown instruments fall back to Moderate
+        self.assertEqual(MentalHealthTest(test_type='XYZ', score=1).get_severity(), 'Moderate')
+
+    def test_backfill_fills_missing_severities_in_chunks(self):
+        tests = [
+            MentalHealthTest.objects.create(user=self.user, test_type='PHQ-9', score=22, phq9_item9_score=2),
+            MentalHealthTest.objects.create(user=self.user, test_type='GAD-7', score=3),
+            MentalHealthTest.objects.create(user=self.user, test_type='PSS', score=20),
+        ]
+        MentalHealthTest.objects.update(severity='', recommendation_type='', caution=False)
+
+        out = StringIO()
+        call_command('backfill_test_severity', '--chunk-size', '2', stdout=out)
+        self.assertIn('Updated 2 tests', out.getvalue())
+        self.assertIn('Successfully backfilled 3 tests', out.getvalue())
+        self.assertEqual(
+            list(MentalHealthTest.objects.order_by('id').values_list('severity', 'recommendation_type', 'caution')),
+            [('Severe', 'counselor', True), ('Minimal', 'self_care', False), ('Moderate stress', 'chatbot', False)],
+        )
+
+        # Only blank severities are touched unless --all is given
+        MentalHealthTest.objects.filter(id=tests[1].id).update(severity='Severe')
+        call_command('backfill_test_severity', stdout=StringIO())
+        self.assertEqual(MentalHealthTest.objects.get(id=tests[1].id).severity, 'Severe')
+        call_command('backfill_test_severity', '--all', stdout=StringIO())
+        self.assertEqual(MentalHealthTest.objects.get(id=tests[1].id).severity, 'Minimal')
+
+
+class DailyTestRollupTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [CustomUser.objects.create_user(f'rollup{i}@example.com', f'Rollup {i}', 'password')
+                     for i in range(3)]
+
+    def rows(self):
+        return sorted(DailyTestRollup.objects.values_list(
+            'date', 'test_type', 'test_count', 'score_sum', 'score_sq_sum', 'user_count', 'new_user_count'
+        ))
+
+    def test_incremental_totals_match_a_rebuild(self):
+        now = timezone.now()
+        for i, (user, test_type, days_ago) in enumerate([
+            (0, 'PHQ-9', 2), (0, 'PHQ-9', 2), (0, 'GAD-7', 2), (0, 'PHQ-9', 0),
+            (1, 'GAD-7', 1), (1, 'GAD-7', 0), (2, 'PSS', 0), (2, 'PHQ-9', 0), (2, 'PSS', 0),
+        ]):
+            MentalHealthTest.objects.create(user=self.users[user], test_type=test_type, score=i + 3,
+                                            date_taken=now - timedelta(days=days_ago))
+        incremental = self.rows()
+        self.assertEqual(len(incremental), 6)
+        DailyTestRollup.rebuild()
+        self.assertEqual(self.rows(), incremental)
+
+    def test_deletes_and_edits_match_a_rebuild(self):
+        now = timezone.now()
+        tests = [
+            MentalHealthTest.objects.create(user=self.users[user], test_type=test_type, score=i + 3,
+                                            date_taken=now - timedelta(days=days_ago))
+            for i, (user, test_type, days_ago) in enumerate([
+                (0, 'PHQ-9', 2), (0, 'PHQ-9', 2), (0, 'GAD-7', 1), (1, 'GAD-7', 1), (1, 'PSS', 0), (2, 'PSS', 0),
+            ])
+        ]
+        tests[1].score = 20
+        tests[1].save()
+        # User 1's first test moves to today, and user 0's first test is deleted
+        tests[3].test_type, tests[3].date_taken = 'PHQ-9', now
+        tests[3].save()
+        tests[0].delete()
+        # The cascade deletes all of user 2's tests at once, before any post_delete runs
+        self.users[2].delete()
+
+        incremental = self.rows()
+        DailyTestRollup.rebuild()
+        self.assertEqual(self.rows(), incremental)
+
+    def test_pss_migration_counts_users_of_both_forms_once(self):
+        normalize_pss = importlib.import_module('users.migrations.0020_normalize_pss_test_type').normalize_pss
+        for test_type in ['PSS-10', 'PSS']:
+            MentalHealthTest.objects.create(user=self.users[0], test_type=test_type, score=20)
+        normalize_pss(django_apps, None)
+        row = DailyTestRollup.objects.get()
+        self.assertEqual((row.test_type, row.test_count, row.user_count, row.new_user_count), ('PSS', 2, 1, 1))
+
+    def test_record_test_is_one_upsert(self):
+        test = MentalHealthTest(user=self.users[0], test_type='GAD-7', score=9)
+        # Skip save(), which records the test itself
+        super(MentalHealthTest, test).save()
+        # Savepoint, insert-if-missing, UPDATE, release
+        with self.assertNumQueries(4):
+            DailyTestRollup.record_test(test)
+        row = DailyTestRollup.objects.get(test_type='GAD-7')
+        self.assertEqual((row.test_count, row.score_sum, row.user_count, row.new_user_count), (1, 9, 1, 1))
+
+
+class ReportCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user('report@example.com', 'Report', 'password')
+
+    def setUp(self):
+        cache.clear()
+
+    def report(self):
+        today = timezone.localdate()
+        return get_report(self.user, today - timedelta(days=30), today)
+
+    def mood_entry(self):
+        return MoodEntry(user=self.user, mood='happy', anxiety_level='mild', depression_level='none',
+                         stress_level='mild', energy_level='moderate')
+
+    def test_writes_to_report_inputs_invalidate_the_cached_report(self):
+        self.assertEqual(self.report()['test_stats']['tests_taken'], 0)
+        with self.assertNumQueries(1):
+            self.report()
+
+        MentalHealthTest.objects.create(user=self.user, test_type='GAD-7', score=12)
+        self.assertEqual(self.report()['test_stats']['tests_taken'], 1)
+
+        entry = self.mood_entry()
+        entry.save()
+        self.assertEqual(self.report()['mood_stats']['entries'], 1)
+        entry.delete()
+        self.assertEqual(self.report()['mood_stats']['entries'], 0)
+
+        MeditationSession.add_sitting(self.user.id, 10, timezone.localdate())
+        self.assertEqual(self.report()['meditation_stats']['total_minutes'], 10)
+        MeditationSession.add_sitting(self.user.id, 5, timezone.localdate())
+        self.assertEqual(self.report()['meditation_stats']['total_minutes'], 15)
+
+    def test_writes_from_other_processes_are_seen(self):
+        self.assertEqual(self.report()['mood_stats']['entries'], 0)
+        # Another worker's write: no signal runs here, only the stamp in the database moves
+        MoodEntry.objects.bulk_create([self.mood_entry()])
+        ReportStamp.objects.update_or_create(user_id=self.user.id, defaults={'stamp': time.time_ns()})
+        self.assertEqual(self.report()['mood_stats']['entries'], 1)
+
+
+class BulkIngestTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user('ingest@example.com', 'Ingest', 'password')
+
+    def rows(self, count):
+        return [{'email': 'Ingest@example.com', 'test_type': 'GAD-7', 'score': str(i % 22)} for i in range(count)]
+
+    def test_bad_rows_are_reported_and_skipped(self):
+        rows = self.rows(2) + [
+            {'user_id': str(self.user.id), 'test_type': 'PHQ-9', 'responses': [1] * 9},
+            {'email': 'ingest@example.com', 'test_type': 'XYZ', 'score': '3'},
+            {'user_id': '999999', 'test_type': 'GAD-7', 'score': '3'},
+            {'user_id': 'abc', 'test_type': 'GAD-7', 'score': '3'},
+            {'email': 'nobody@example.com', 'test_type': 'GAD-7', 'score': '3'},
+            {'email': 'ingest@example.com', 'test_type': 'GAD-7', 'score': '99'},
+        ]
+        result = bulk_ingest_tests(rows, chunk_size=100)
+        self.assertEqual(result.created, 3)
+        self.assertEqual(result.skipped, 5)
+        self.assertEqual([line for line, _ in result.errors], [4, 5, 6, 7, 8])
+        self.assertIn("Unknown user '999999'", result.errors[1][1])
+        self.assertEqual(MentalHealthTest.objects.filter(user=self.user).count(), 3)
+        self.assertEqual(MentalHealthTest.objects.get(test_type='PHQ-9').score, 9)
+
+    def test_rows_that_are_not_objects_are_reported_and_skipped(self):
+        handle, path = tempfile.mkstemp(suffix='.jsonl')
+        self.addCleanup(os.remove, path)
+        with os.fdopen(handle, 'w') as jsonl_file:
+            for line in [
+                {'email': 'ingest@example.com', 'test_type': 'GAD-7', 'score': 5},
+                [], 'x',
+                {'email': 'ingest@example.com', 'test_type': 'GAD-7', 'score': 5, 'date_taken': 20240101},
+                {'email': 5, 'test_type': 'GAD-7', 'score': 5},
+            ]:
+                jsonl_file.write(json.dumps(line) + '\n')
+            jsonl_file.write('{"email": \n')
+
+        result = bulk_ingest_tests(read_rows(path), chunk_size=100)
+        self.assertEqual((result.created, result.skipped), (1, 5))
+        self.assertEqual([line for line, _ in result.errors], [2, 3, 4, 5, 6])
+        self.assertIn('Expected a JSON object, got list', result.errors[0][1])
+        self.assertIn('Invalid date_taken 20240101', result.errors[2][1])
+        self.assertIn('Invalid JSON', result.errors[4][1])
+
+    def test_resume_skips_committed_rows(self):
+        rows = self.rows(10)
+
+        def crash_after_first_chunk(result):
+            raise RuntimeError('killed')
+
+        with self.assertRaises(RuntimeError):
+            bulk_ingest_tests(iter(rows), chunk_size=4, checkpoint='import-1', progress=crash_after_first_chunk)
+        self.assertEqual(MentalHealthTest.objects.count(), 4)
+        self.assertEqual(IngestCheckpoint.objects.get(name='import-1').rows_done, 4)
+
+        result = bulk_ingest_tests(iter(rows), chunk_size=4, checkpoint='import-1')
+        self.assertEqual(result.resumed_from, 4)
+        self.assertEqual(result.created, 6)
+        self.assertEqual(MentalHealthTest.objects.count(), 10)
+        self.assertEqual(IngestCheckpoint.objects.get(name='import-1').rows_done, 10)
+
+    def test_checkpoint_rolls_back_with_its_chunk(self):
+        rows = self.rows(3)
+        original = MentalHealthTest.objects.bulk_create
+
+        def fail(*args, **kwargs):
+            raise RuntimeError('disk full')
+
+        MentalHealthTest.objects.bulk_create = fail
+        try:
+            with self.assertRaises(RuntimeError):
+                bulk_ingest_tests(rows, chunk_size=3, checkpoint='import-2')
+        finally:
+            MentalHealthTest.objects.bulk_create = original
+        self.assertFalse(IngestCheckpoint.objects.filter(name='import-2').exists())
+
+    def test_command_imports_csv_and_resumes(self):
+        handle, path = tempfile.mkstemp(suffix='.csv')
+        self.addCleanup(os.remove, path)
+        with os.fdopen(handle, 'w') as csv_file:
+            csv_file.write('email,test_type,score\n')
+            csv_file.write('ingest@example.com,GAD-7,5\n' * 3)
+            csv_file.write('nobody@example.com,GAD-7,5\n')
+
+        out = StringIO()
+        call_command('bulk_ingest_tests', path, '--chunk-size', '2', stdout=out)
+        self.assertIn('Successfully imported 3 tests, skipped 1', out.getvalue())
+        self.assertIn("Row 4: Unknown user 'nobody@example.com'", out.getvalue())
+        self.assertEqual(DailyTestRollup.objects.get().test_count, 3)
+
+        out = StringIO()
+        call_command('bulk_ingest_tests', path, stdout=out)
+        self.assertIn('Resumed after 4 rows', out.getvalue())
+        self.assertEqual(MentalHealthTest.objects.count(), 3)
+
+
+class CachedUserBackendTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = CustomUser.objects.create_user('cached-staff@example.com', 'Staff', 'password', is_staff=True)
+
+    def setUp(self):
+        get_user_cache().clear()
+        self.backend = EmailAuthBackend()
+
+    def test_authenticates_by_email_or_username(self):
+        self.assertEqual(authenticate(None, email='cached-staff@example.com', password='password'), self.staff)
+        self.assertEqual(authenticate(None, username='cached-staff@example.com', password='password'), self.staff)
+        self.assertIsNone(authenticate(None, email='cached-staff@example.com', password='wrong'))
+        self.assertIsNone(authenticate(None, email='nobody@example.com', password='password'))
+
+        response = self.client.post(reverse('users:login'), {'email': 'cached-staff@example.com', 'password': 'password'})
+        self.assertRedirects(response, reverse('users:dashboard'), fetch_redirect_response=False)
+
+    def test_warm_requests_resolve_the_user_without_queries(self):
+        self.assertEqual(self.backend.get_user(self.staff.id), self.staff)
+        with self.assertNumQueries(0):
+            first = self.backend.get_user(self.staff.id)
+            second = self.backend.get_user(str(self.staff.id))
+        self.assertEqual((first.email, first.is_staff), (self.staff.email, True))
+        # Never the same object twice, so per-request state such as _perm_cache stays per request
+        self.assertIsNot(first, second)
+        self.assertFalse(first._state.adding)
+
+        self.client.force_login(self.staff)
+        self.client.get(reverse('users:dashboard'))
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('users:dashboard'))
+        self.assertFalse([query for query in queries if '"users_customuser"' in query['sql']])
+
+    def test_saving_a_user_takes_effect_on_the_next_request(self):
+        self.client.force_login(self.staff)
+        self.assertEqual(self.client.get(reverse('users:admin_analytics')).status_code, 200)
+        self.staff.is_staff = False
+        self.staff.save()
+        self.assertEqual(self.client.get(reverse('users:admin_analytics')).status_code, 302)
+
+        self.staff.is_staff = True
+        self.staff.save()
+        self.assertEqual(self.client.get(reverse('users:admin_analytics')).status_code, 200)
+        self.staff.is_active = False
+        self.staff.save()
+        self.assertIsNone(self.backend.get_user(self.staff.id))
+
+    def test_permissions_are_not_cached(self):
+        self.assertFalse(self.backend.get_user(self.staff.id).has_perm('users.view_resource'))
+        group = Group.objects.create(name='Editors')
+        group.permissions.add(Permission.objects.get(codename='view_resource'))
+        self.staff.groups.add(group)
+        self.assertTrue(self.backend.get_user(self.staff.id).has_perm('users.view_resource'))
+
+    def test_deleted_users_are_not_served(self):
+        user = CustomUser.objects.create_user('leaving@example.com', 'Leaving', 'password')
+        self.backend.get_user(user.id)
+        user_id = user.id
+        user.delete()
+        self.assertIsNone(self.backend.get_user(user_id))
+
+    @override_settings(AUTH_USER_CACHE_SIZE=0, AUTH_USER_CACHE_ALIAS='default')
+    def test_shared_tier(self):
+        self.addCleanup(cache.clear)
+        self.backend.get_user(self.staff.id)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.backend.get_user(self.staff.id).email, self.staff.email)
+        self.assertEqual(get_user_cache().stats()['shared_hits'], 1)
+        self.staff.name = 'Renamed'
+        self.staff.save()
+        self.assertEqual(self.backend.get_user(self.staff.id).name, 'Renamed')
+
+    @override_settings(AUTH_USER_CACHE_ALIAS='default')
+    def test_password_hash_is_never_cached(self):
+        self.addCleanup(cache.clear)
+        self.backend.get_user(self.staff.id)
+        version, values = cache.get(UserCache.key(self.staff.id))
+        self.assertNotIn('password', values)
+        self.assertNotIn(self.staff.password, repr(get_user_cache()._entries))
+
+        with self.assertNumQueries(0):
+            user = self.backend.get_user(self.staff.id)
+            self.assertEqual(user.get_session_auth_hash(), self.staff.get_session_auth_hash())
+        with self.assertNumQueries(1):
+            self.assertTrue(user.check_password('password'))
+        user.set_password('changed')
+        self.assertNotEqual(user.get_session_auth_hash(), self.staff.get_session_auth_hash())
+
+    @override_settings(AUTH_USER_CACHE_ALIAS='default')
+    def test_saves_in_other_processes_reach_the_local_tier(self):
+        self.addCleanup(cache.clear)
+        self.assertTrue(self.backend.get_user(self.staff.id).is_staff)
+        CustomUser.objects.filter(pk=self.staff.id).update(is_staff=False)
+        # What post_save does in the process that saved the user
+        UserCache(alias='default').delete(self.staff.id)
+        with self.assertNumQueries(1):
+            self.assertFalse(self.backend.get_user(self.staff.id).is_staff)
+
+    @override_settings(AUTH_USER_CACHE_TTL=0)
+    def test_entries_expire(self):
+        self.backend.get_user(self.staff.id)
+        with self.assertNumQueries(1):
+            self.backend.get_user(self.staff.id)
+
+    @override_settings(AUTH_USER_CACHE_ENABLED=False)
+    def test_cache_can_be_disabled(self):
+        self.backend.get_user(self.staff.id)
+        with self.assertNumQueries(1):
+            self.backend.get_user(self.staff.id)
+
+
+class SessionStorageTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user('sessions@example.com', 'Sessions', 'password')
+
+    def test_anonymous_sessions_live_in_the_cookie(self):
+        session = SessionStore()
+        session['theme'] = 'calm'
+        session.save()
+        self.assertTrue(is_cookie_key(session.session_key))
+        self.assertFalse(Session.objects.exists())
+        with self.assertNumQueries(0):
+            self.assertEqual(SessionStore(session.session_key)['theme'], 'calm')
+
+        tampered = SessionStore(session.session_key[:-1] + 'x')
+        self.assertEqual(dict(tampered.items()), {})
+        self.assertIsNone(tampered.session_key)
+
+    def test_landing_page_needs_no_queries(self):
+        self.client.get(reverse('landpage'))
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(reverse('landpage')).status_code, 200)
+
+    def test_login_moves_the_session_to_a_new_server_key(self):
+        session = self.client.session
+        session['theme'] = 'calm'
+        session.save()
+        self.client.cookies[settings.SESSION_COOKIE_NAME] = session.session_key
+
+        self.client.post(reverse('users:login'), {'email': 'sessions@example.com', 'password': 'password'})
+        key = self.client.cookies[settings.SESSION_COOKIE_NAME].value
+        self.assertFalse(is_cookie_key(key))
+        self.assertTrue(Session.objects.filter(session_key=key).exists())
+        self.assertEqual(self.client.session['theme'], 'calm')
+
+        # Read from the session cache, not django_session
+        self.client.get(reverse('users:dashboard'))
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(reverse('users:dashboard')).status_code, 200)
+        self.assertFalse([query for query in queries if 'django_session' in query['sql']])
+
+        session = SessionStore(key)
+        session.flush()
+        self.assertFalse(Session.objects.filter(session_key=key).exists())
+        self.assertFalse(SessionStore(key).exists(key))
+
+    @override_settings(SESSION_COOKIE_MAX_SIZE=100)
+    def test_sessions_too_big_for_the_cookie_go_to_the_server(self):
+        notes = os.urandom(100).hex()  # Signed cookies are compressed, so nothing repetitive
+        session = SessionStore()
+        session['notes'] = notes
+        session.save()
+        self.assertFalse(is_cookie_key(session.session_key))
+        self.assertEqual(SessionStore(session.session_key)['notes'], notes)
+
+    def test_purge_deletes_expired_sessions_in_chunks(self):
+        past, future = timezone.now() - timedelta(days=1), timezone.now() + timedelta(days=1)
+        for i in range(5):
+            Session.objects.create(session_key=f'expired{i:025d}', session_data='', expire_date=past)
+        Session.objects.create(session_key='live' + '0' * 28, session_data='', expire_date=future)
+        out = StringIO()
+        call_command('purge_expired_sessions', chunk_size=2, stdout=out)
+        self.assertIn('Purged 5 expired sessions in 3 chunks', out.getvalue())
+        self.assertEqual(list(Session.objects.values_list('session_key', flat=True)), ['live' + '0' * 28])
+
+
+class BenchmarkViewsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_superuser('bench@example.com', 'Bench', 'password')
+        MentalHealthTest.objects.create(user=cls.user, test_type='GAD-7', score=12)
+        Resource.objects.create(title='Box Breathing', description='', resource_type='breathing', content='')
+        Game.objects.create(name='Breathing', description='', game_type='breathing', difficulty='easy', instructions='')
+
+    def counts(self):
+        models = [MentalHealthTest, MeditationSession, ChatSession, ChatMessage, ResourceClick,
+                  ResourceEngagementRollup, GameSession, GameProgress, Session]
+        return {model.__name__: model.objects.count() for model in models}
+
+    def test_writes_are_rolled_back(self):
+        before = self.counts()
+        with tempfile.TemporaryDirectory() as scratch:
+            output = os.path.join(scratch, 'baseline.json')
+            call_command('benchmark_views', email=self.user.email, iterations=2, output=output, stdout=StringIO())
+            with open(output) as handle:
+                results = json.load(handle)['results']
+        self.assertEqual(results['meditation:save_session']['status'], [200])
+        self.assertEqual(results['users:resource_click']['status'], [200])
+        self.assertEqual(self.counts(), before)
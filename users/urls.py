@@ -12,6 +12,7 @@ urlpatterns = [
     path('dashboard/', views.dashboard, name='dashboard'),
     path('mental-health-test/', views.mental_health_test, name='mental_health_test'),
     path('test-history/', views.test_history, name='test_history'),
+    path('test-history/page/', views.test_history_page, name='test_history_page'),
     path('test-detail/<int:pk>/', views.test_detail, name='test_detail'),
     path('mood-tracking/', views.mood_tracking, name='mood_tracking'),
     path('mood-history/', views.mood_history, name='mood_history'),
@@ -19,6 +20,9 @@ urlpatterns = [
     path('admin-analytics/', views.admin_analytics, name='admin_analytics'),
     # Chatbot and resource routes
     path('chatbot/', views.chatbot, name='chatbot'),
+    path('chatbot/stream/', views.chatbot_stream, name='chatbot_stream'),
+    path('chatbot/messages/', views.chat_messages, name='chat_messages'),
+    path('chatbot/history/', views.chat_history_page, name='chat_history_page'),
     path('resource-click/<int:resource_id>/', views.resource_click, name='resource_click'),
     path('end-chat-session/', views.end_chat_session, name='end_chat_session'),
 ]
\ No newline at end of file
@@ -4,13 +4,22 @@ from django.contrib.auth import login, authenticate
 from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib import messages
 from django.utils import timezone
-from datetime import timedelta
+from datetime import datetime, timedelta, timezone as dt_timezone
 import json
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views.decorators.http import require_POST
+from django.contrib.auth.views import redirect_to_login
+from asgiref.sync import sync_to_async
+from .chat_backends import stream_reply, uses_response_cache
+from .chatbot import SEVERITIES, match_intent, severity_for_level
+from .clicks import ClickBufferFull, record_click, record_impressions
+from .engagement import resource_summary, severity_for_session, severity_summary
 from .forms import CustomUserCreationForm, CustomLoginForm, MoodEntryForm, MentalHealthTestForm, PHQ9Form, GAD7Form, PSS10Form
-from .models import CustomUser, MentalHealthTest, MoodEntry, ActionPlan, TestRecommendation, ChatSession, ChatMessage, Resource, ResourceClick
-from django.db.models import Count, Avg, Q
-from django.db.models.functions import TruncDate, TruncMonth
+from .models import CustomUser, MentalHealthTest, DailyTestRollup, MoodEntry, ActionPlan, TestRecommendation, ChatSession, ChatMessage, Resource
+from .reports import get_report, get_report_range
+from .resources import get_catalog, recommend, recommend_json
+from django.db.models import Count, Q
+from django.db.models.functions import TruncMonth
 
 def landpage_view(request):
     """View for the landing page"""
@@ -34,7 +43,7 @@ def mental_health_test(request):
             form = PHQ9Form(request.POST)
         elif test_type == 'GAD-7':
             form = GAD7Form(request.POST)
-        elif test_type == 'PSS-10':
+        elif test_type in ('PSS', 'PSS-10'):
             form = PSS10Form(request.POST)
         else:
             messages.error(request, 'Invalid test type selected.')
@@ -49,10 +58,10 @@ def mental_health_test(request):
                 if test_type == 'PHQ-9':
                     phq9_item9_score = int(form.cleaned_data.get('q9', 0))
                 
-                # Create test record
+                # Create test record under the canonical instrument code ('PSS', not 'PSS-10')
                 test = MentalHealthTest.objects.create(
                     user=request.user,
-                    test_type=test_type,
+                    test_type=form.instrument_code,
                     score=score,
                     phq9_item9_score=phq9_item9_score
                 )
@@ -69,7 +78,7 @@ def mental_health_test(request):
             form = PHQ9Form()
         elif test_type == 'GAD-7':
             form = GAD7Form()
-        elif test_type == 'PSS-10':
+        elif test_type in ('PSS', 'PSS-10'):
             form = PSS10Form()
         else:
             messages.error(request, 'Invalid test type.')
@@ -79,6 +88,7 @@ def mental_health_test(request):
     test_type_display = {
         'PHQ-9': 'PHQ-9 (Depression Screening)',
         'GAD-7': 'GAD-7 (Anxiety Screening)', 
+        'PSS': 'PSS-10 (Perceived Stress Scale)',
         'PSS-10': 'PSS-10 (Perceived Stress Scale)'
     }.get(test_type, test_type)
     
@@ -122,77 +132,130 @@ def dashboard(request):
     """User dashboard view"""
     return render(request, 'users/dashboard.html')
 
+TEST_HISTORY_PAGE_SIZE = 20
+# Only the columns the history table renders
+TEST_HISTORY_FIELDS = ['id', 'test_type', 'score', 'date_taken', 'severity', 'caution', 'phq9_item9_score']
+CURSOR_EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+# Largest id SQLite (and a bigint column) can hold
+MAX_CURSOR_ID = 2 ** 63 - 1
+
+def _encode_cursor(moment, pk):
+    micros = (moment - CURSOR_EPOCH) // timedelta(microseconds=1)
+    return f"{micros}_{pk}"
+
+def _decode_cursor(cursor):
+    """(datetime, id) from a keyset cursor, raising ValueError if it is malformed"""
+    micros, _, id_str = cursor.partition('_')
+    if not micros.isdigit() or not id_str.isdigit() or int(id_str) > MAX_CURSOR_ID:
+        raise ValueError('Invalid cursor')
+    try:
+        return CURSOR_EPOCH + timedelta(microseconds=int(micros)), int(id_str)
+    except OverflowError:
+        # Past datetime.max
+        raise ValueError('Invalid cursor')
+
+def _test_history_page(user, cursor=None):
+    """
+    Return (tests, next_cursor) for one page of a user's history, newest first.
+    Pages are keyset paginated on (date_taken, id) so deep pages cost the same as the first.
+    """
+    tests = MentalHealthTest.objects.filter(user=user).only(*TEST_HISTORY_FIELDS)
+    if cursor:
+        date_taken, pk = _decode_cursor(cursor)
+        tests = tests.filter(
+            Q(date_taken__lt=date_taken) | Q(date_taken=date_taken, id__lt=pk)
+        )
+
+    page = list(tests.order_by('-date_taken', '-id')[:TEST_HISTORY_PAGE_SIZE + 1])
+    next_cursor = None
+    if len(page) > TEST_HISTORY_PAGE_SIZE:
+        page = page[:TEST_HISTORY_PAGE_SIZE]
+        next_cursor = _encode_cursor(page[-1].date_taken, page[-1].id)
+    return page, next_cursor
+
 @login_required
 def test_history(request):
     """View for displaying mental health test history"""
-    tests = MentalHealthTest.objects.filter(user=request.user).order_by('-date_taken')
-    total_tests = tests.count()
-    
-    # Count tests by type
-    phq9_tests = tests.filter(test_type='PHQ-9').count()
-    gad7_tests = tests.filter(test_type='GAD-7').count()
-    pss_tests = tests.filter(test_type='PSS').count()
+    # Count tests by type in a single conditional aggregate
+    counts = MentalHealthTest.objects.filter(user=request.user).aggregate(
+        total_tests=Count('id'),
+        phq9_tests=Count('id', filter=Q(test_type='PHQ-9')),
+        gad7_tests=Count('id', filter=Q(test_type='GAD-7')),
+        pss_tests=Count('id', filter=Q(test_type='PSS')),
+    )
+    tests, next_cursor = _test_history_page(request.user)
     
     return render(request, 'users/test_history.html', {
         'tests': tests,
-        'total_tests': total_tests,
-        'phq9_tests': phq9_tests,
-        'gad7_tests': gad7_tests,
-        'pss_tests': pss_tests
+        'next_cursor': next_cursor,
+        **counts
+    })
+
+@login_required
+def test_history_page(request):
+    """JSON endpoint returning the next page of test history for infinite scroll"""
+    try:
+        tests, next_cursor = _test_history_page(request.user, request.GET.get('cursor'))
+    except ValueError:
+        return JsonResponse({'status': 'error', 'message': 'Invalid cursor'}, status=400)
+
+    return JsonResponse({
+        'status': 'success',
+        'tests': [
+            {
+                'id': test.id,
+                'test_type': test.test_type,
+                'score': test.score,
+                'display_text': test.get_display_text(),
+                'severity': test.get_severity(),
+                'caution': test.needs_caution(),
+                'color_class': test.get_color_class(),
+                'date_taken': test.date_taken.isoformat(),
+                'url': test.get_absolute_url(),
+            }
+            for test in tests
+        ],
+        'next_cursor': next_cursor,
     })
 
 @staff_member_required
 def admin_analytics(request):
-    # Get all tests
-    all_tests = MentalHealthTest.objects.all()
+    # Read pre-aggregated daily rollups instead of scanning every test
+    totals = DailyTestRollup.totals_by_type()
+    empty = {'count': 0, 'avg': 0, 'new_users': 0}
+    phq9 = totals.get('PHQ-9', empty)
+    gad7 = totals.get('GAD-7', empty)
+    pss = totals.get('PSS', empty)
     
     # Count tests by type
-    total_tests = all_tests.count()
-    phq9_count = all_tests.filter(test_type='PHQ-9').count()
-    gad7_count = all_tests.filter(test_type='GAD-7').count()
-    pss_count = all_tests.filter(test_type='PSS').count()
+    total_tests = sum(row['count'] for row in totals.values())
+    phq9_count = phq9['count']
+    gad7_count = gad7['count']
+    pss_count = pss['count']
     
     # Calculate average scores
-    phq9_avg = all_tests.filter(test_type='PHQ-9').aggregate(Avg('score'))['score__avg'] or 0
-    gad7_avg = all_tests.filter(test_type='GAD-7').aggregate(Avg('score'))['score__avg'] or 0
-    pss_avg = all_tests.filter(test_type='PSS').aggregate(Avg('score'))['score__avg'] or 0
+    phq9_avg = phq9['avg']
+    gad7_avg = gad7['avg']
+    pss_avg = pss['avg']
     
     # User statistics
     total_users = CustomUser.objects.count()
-    active_users = CustomUser.objects.filter(mentalhealthtest__isnull=False).distinct().count()
+    active_users = sum(row['new_users'] for row in totals.values())
     tests_per_user = total_tests / total_users if total_users > 0 else 0
     
     # Tests over time (last 30 days)
-    thirty_days_ago = timezone.now() - timedelta(days=30)
-    tests_by_day = all_tests.filter(date_taken__gte=thirty_days_ago)\
-                          .annotate(date=TruncDate('date_taken'))\
-                          .values('date')\
-                          .annotate(count=Count('id'))\
-                          .order_by('date')
+    end_date = timezone.localdate()
+    current_date = end_date - timedelta(days=30)
+    tests_by_day = DailyTestRollup.daily_counts(current_date)
     
-    # Prepare data for time series chart
+    # Prepare data for time series chart, filling in days without tests
     dates = []
     counts = []
-    
-    # Create a complete date range for the last 30 days
-    current_date = thirty_days_ago.date()
-    end_date = timezone.now().date()
-    date_dict = {}
-    
     while current_date <= end_date:
-        date_dict[current_date.isoformat()] = 0
+        dates.append(current_date.isoformat())
+        counts.append(tests_by_day.get(current_date, 0))
         current_date += timedelta(days=1)
     
-    # Fill in actual counts
-    for entry in tests_by_day:
-        date_str = entry['date'].isoformat()
-        date_dict[date_str] = entry['count']
-    
-    # Convert to lists for the chart
-    for date_str, count in date_dict.items():
-        dates.append(date_str)
-        counts.append(count)
-    
     context = {
         'total_tests': total_tests,
         'phq9_count': phq9_count,
@@ -206,6 +269,9 @@ def admin_analytics(request):
         'tests_per_user': tests_per_user,
         'time_labels': json.dumps(dates),
         'time_data': json.dumps(counts),
+        # Sidebar resource engagement over the same 30 days, from the rollups
+        'resource_engagement': resource_summary(30)[:10],
+        'severity_engagement': sorted(severity_summary(30).items()),
     }
     
     return render(request, 'users/admin_analytics.html', context)
@@ -234,16 +300,8 @@ def mood_tracking(request):
 @login_required
 def report(request):
     """View for generating reports based on user data"""
-    # Get user's mental health tests
-    tests = MentalHealthTest.objects.filter(user=request.user).order_by('-date_taken')
-    
-    # Get user's mood entries
-    mood_entries = MoodEntry.objects.filter(user=request.user).order_by('-date')
-    
-    return render(request, 'users/report.html', {
-        'tests': tests,
-        'mood_entries': mood_entries
-    })
+    start_date, end_date = get_report_range(request.GET)
+    return render(request, 'users/report.html', get_report(request.user, start_date, end_date))
 
 @login_required
 def test_detail(request, pk):
@@ -255,7 +313,7 @@ def test_detail(request, pk):
         test=test,
         defaults={
             'severity': test.get_severity(),
-            'recommendation_type': test.get_recommendation_type()
+            'recommendation_type': test.recommendation_type
         }
     )
     
@@ -295,63 +353,249 @@ def test_detail(request, pk):
         'recommendation': recommendation
     })
 
+# The user's open ChatSession id, kept in their session so chat turns skip the lookup
+CHAT_SESSION_KEY = 'chat_session_id'
+# Messages rendered with the chatbot page, and per history page or poll
+CHAT_HISTORY_PAGE_SIZE = 30
+CHAT_MESSAGE_FIELDS = ['id', 'message_type', 'content', 'timestamp']
+
+
+def _active_chat_session_id(request, create=True):
+    """The id of the user's open chat session, starting one if needed (unless create is False)"""
+    session_id = request.session.get(CHAT_SESSION_KEY)
+    if session_id is None:
+        session_id = ChatSession.objects.filter(user=request.user, ended_at__isnull=True)\
+            .values_list('id', flat=True).first()
+        if session_id is None:
+            if not create:
+                return None
+            session_id = ChatSession.objects.create(user=request.user).id
+        request.session[CHAT_SESSION_KEY] = session_id
+    return session_id
+
+
 @login_required
 def chatbot(request):
-    # Get or create a chat session
-    active_session = ChatSession.objects.filter(user=request.user, ended_at__isnull=True).first()
-    if not active_session:
-        active_session = ChatSession.objects.create(user=request.user)
-
     # Handle message submission
     if request.method == 'POST':
         message_content = request.POST.get('message')
         if message_content:
-            # Create user message
-            ChatMessage.objects.create(
-                session=active_session,
-                message_type='user',
-                content=message_content
-            )
-            
-            # Generate and create system response
-            response = generate_chatbot_response(message_content, active_session)
-            ChatMessage.objects.create(
-                session=active_session,
-                message_type='system',
-                content=response['message']
-            )
-            
+            # Store both messages and the distress level as one turn
+            response = generate_chatbot_response(message_content)
+            turn = (request.user.id, message_content, response['message'], response['distress_level'])
+            created = ChatSession.record_turn(_active_chat_session_id(request), *turn)
+            if created is None:
+                # The cached session was ended elsewhere; continue in the user's current one
+                del request.session[CHAT_SESSION_KEY]
+                created = ChatSession.record_turn(_active_chat_session_id(request), *turn) or []
+
             # Return JSON response for AJAX
             if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+                # The turn just set the session's distress level to this one
+                sidebar_severity = severity_for_level(response['distress_level'])
                 return JsonResponse({
                     'status': 'success',
                     'message': response['message'],
-                    'severity': response.get('severity', 'mild')
+                    'severity': response.get('severity', 'mild'),
+                    # Lets the page poll for newer messages without refetching this turn
+                    'last_message_id': max((message.id for message in created), default=None),
+                    'intent': response['intent'],
+                    'sidebar_severity': sidebar_severity,
+                    'resources': _sidebar_json(response['intent'], sidebar_severity)
                 })
-    
-    # Get chat history for this session
-    messages = active_session.messages.all()
-    # Get relevant resources to display
-    resources = Resource.objects.filter(is_active=True)[:5]
+
+    sessions = ChatSession.objects.select_related('test_recommendation')
+    active_session = sessions.filter(
+        id=_active_chat_session_id(request), user=request.user, ended_at__isnull=True
+    ).first()
+    if active_session is None:
+        del request.session[CHAT_SESSION_KEY]
+        active_session = sessions.get(id=_active_chat_session_id(request))
+
+    # Only the latest messages; older ones are loaded on demand from chat_history_page
+    messages, history_cursor = _chat_history_page(active_session.id)
+    # Resources ranked for what the user last talked about, from the in-process catalog
+    last_user_message = next((message.content for message in reversed(messages)
+                              if message.message_type == 'user'), '')
+    intent_name = match_intent(last_user_message).name
+    resources = recommend(intent_name)
+    sidebar_severity = severity_for_session(active_session)
+    record_impressions(resources, intent_name, sidebar_severity)
     return render(request, 'users/chatbot.html', {
         'session': active_session,
-        'messages': messages,
+        # Not 'messages', which base.html renders as flash messages
+        'chat_messages': messages,
+        'history_cursor': history_cursor,
+        'last_message_id': max((message.id for message in messages), default=0),
+        'intent': intent_name,
+        # Sent back with clicks, so they are counted at the severity the sidebar was shown at
+        'sidebar_severity': sidebar_severity,
         'resources': resources
     })
 
+def _sidebar_json(intent_name, severity):
+    """The sidebar resources for an intent as JSON, counted as impressions at the session's severity"""
+    resources = recommend_json(intent_name)
+    record_impressions(resources, intent_name, severity)
+    return resources
+
+async def _aactive_chat_session_id(request, user):
+    """Async _active_chat_session_id, using the async ORM for the lookup"""
+    # Loading the Django session is a database read with no async API yet
+    session_id = await sync_to_async(request.session.get)(CHAT_SESSION_KEY)
+    if session_id is None:
+        session_id = await _aopen_chat_session_id(user)
+        request.session[CHAT_SESSION_KEY] = session_id
+    return session_id
+
+async def _aopen_chat_session_id(user):
+    session_id = await ChatSession.objects.filter(user=user, ended_at__isnull=True)\
+        .values_list('id', flat=True).afirst()
+    if session_id is None:
+        session_id = (await ChatSession.objects.acreate(user=user)).id
+    return session_id
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+async def _chat_event_stream(user, session_id, message):
+    """Server-Sent Events for one turn: 'delta' per reply chunk, then 'done' once the turn is stored"""
+    intent = match_intent(message)
+    context = None
+    if intent.name != 'crisis' and uses_response_cache():
+        # Model replies vary with the session's severity so far, and are cached on it
+        level = await ChatSession.objects.filter(id=session_id).values_list('distress_level', flat=True).afirst()
+        context = severity_for_level(level)
+    parts = []
+    # A disconnect cancels this generator mid-iteration; the backend stream is closed
+    # with it and the unfinished turn is not stored
+    async for text in stream_reply(message, intent, context):
+        parts.append(text)
+        yield _sse('delta', {'text': text})
+
+    turn = (user.id, message, ''.join(parts), intent.distress_level)
+    created = await ChatSession.arecord_turn(session_id, *turn)
+    if created is None:
+        # The cached session was ended elsewhere. The response has started, so the cache
+        # is left for the next regular chatbot request to correct
+        created = await ChatSession.arecord_turn(await _aopen_chat_session_id(user), *turn) or []
+    sidebar_severity = severity_for_level(intent.distress_level)
+    yield _sse('done', {
+        'severity': intent.severity,
+        'last_message_id': max((chat_message.id for chat_message in created), default=None),
+        'intent': intent.name,
+        'sidebar_severity': sidebar_severity,
+        # The catalog may need loading, which is a sync database read
+        'resources': await sync_to_async(_sidebar_json)(intent.name, sidebar_severity),
+    })
+
+@require_POST
+async def chatbot_stream(request):
+    """Async chatbot turn that streams the reply as Server-Sent Events"""
+    user = await request.auser()
+    if not user.is_authenticated:
+        return redirect_to_login(request.get_full_path())
+    message = request.POST.get('message', '').strip()
+    if not message:
+        return JsonResponse({'status': 'error', 'message': 'Message is required'}, status=400)
+
+    session_id = await _aactive_chat_session_id(request, user)
+    response = StreamingHttpResponse(_chat_event_stream(user, session_id, message),
+                                     content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Stop proxies such as nginx from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+def _chat_history_page(session_id, cursor=None):
+    """
+    Return (messages, older_cursor) for the CHAT_HISTORY_PAGE_SIZE messages before cursor,
+    or the latest ones, oldest first. Keyset paginated on (timestamp, id) like test history.
+    """
+    messages = ChatMessage.objects.filter(session_id=session_id).only(*CHAT_MESSAGE_FIELDS)
+    if cursor:
+        timestamp, pk = _decode_cursor(cursor)
+        messages = messages.filter(Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, id__lt=pk))
+
+    page = list(messages.order_by('-timestamp', '-id')[:CHAT_HISTORY_PAGE_SIZE + 1])
+    older_cursor = None
+    if len(page) > CHAT_HISTORY_PAGE_SIZE:
+        page = page[:CHAT_HISTORY_PAGE_SIZE]
+        older_cursor = _encode_cursor(page[-1].timestamp, page[-1].id)
+    page.reverse()
+    return page, older_cursor
+
+def _chat_message_json(message):
+    return {
+        'id': message.id,
+        'message_type': message.message_type,
+        'content': message.content,
+        'timestamp': message.timestamp.isoformat(),
+    }
+
+@login_required
+def chat_messages(request):
+    """JSON endpoint returning the open session's messages newer than ?since=<message id>, for polling"""
+    since = request.GET.get('since', '0')
+    if not since.isdigit() or int(since) > MAX_CURSOR_ID:
+        return JsonResponse({'status': 'error', 'message': 'Invalid since'}, status=400)
+
+    messages = []
+    session_id = _active_chat_session_id(request, create=False)
+    if session_id is not None:
+        messages = list(ChatMessage.objects.filter(session_id=session_id, id__gt=int(since))
+                        .only(*CHAT_MESSAGE_FIELDS).order_by('id')[:CHAT_HISTORY_PAGE_SIZE + 1])
+
+    return JsonResponse({
+        'status': 'success',
+        'messages': [_chat_message_json(message) for message in messages[:CHAT_HISTORY_PAGE_SIZE]],
+        # More are waiting; poll again straight away
+        'has_more': len(messages) > CHAT_HISTORY_PAGE_SIZE,
+    })
+
+@login_required
+def chat_history_page(request):
+    """JSON endpoint returning the page of the open session's messages before ?cursor="""
+    session_id = _active_chat_session_id(request, create=False)
+    if session_id is None:
+        return JsonResponse({'status': 'success', 'messages': [], 'next_cursor': None})
+    try:
+        messages, next_cursor = _chat_history_page(session_id, request.GET.get('cursor'))
+    except ValueError:
+        return JsonResponse({'status': 'error', 'message': 'Invalid cursor'}, status=400)
+
+    return JsonResponse({
+        'status': 'success',
+        'messages': [_chat_message_json(message) for message in messages],
+        'next_cursor': next_cursor,
+    })
+
 @login_required
 def resource_click(request, resource_id):
     """Track when a user clicks on a resource"""
     if request.method == 'POST':
-        resource = get_object_or_404(Resource, id=resource_id)
-        active_session = ChatSession.objects.filter(user=request.user, ended_at__isnull=True).first()
-        
-        # Record the click
-        ResourceClick.objects.create(
-            user=request.user,
-            resource=resource,
-            chat_session=active_session
-        )
+        catalog = get_catalog()
+        # Active resources are all in the catalog; only others need a lookup
+        resource = catalog.by_id.get(resource_id) or get_object_or_404(Resource, id=resource_id)
+        intent_name = request.POST.get('intent', '')
+        # The severity the sidebar was rendered at, so the click needs no session lookup
+        severity = request.POST.get('severity', '')
+
+        chat_session_id = _active_chat_session_id(request, create=False)
+
+        # Buffered and written in batches; see users/clicks.py
+        try:
+            record_click(
+                user_id=request.user.id,
+                resource_id=resource.id,
+                chat_session_id=chat_session_id,
+                intent=intent_name if intent_name in catalog.rankings else '',
+                severity=severity if severity in SEVERITIES else '',
+            )
+        except ClickBufferFull:
+            response = JsonResponse({'status': 'error', 'message': 'Too many clicks, try again shortly'}, status=429)
+            response['Retry-After'] = '1'
+            return response
         
         return JsonResponse({'status': 'success'})
     
@@ -361,6 +605,7 @@ def resource_click(request, resource_id):
 def end_chat_session(request):
     """End the current chat session"""
     if request.method == 'POST':
+        request.session.pop(CHAT_SESSION_KEY, None)
         active_session = ChatSession.objects.filter(user=request.user, ended_at__isnull=True).first()
         if active_session:
             active_session.ended_at = timezone.now()
@@ -369,137 +614,10 @@ def end_chat_session(request):
 
     return JsonResponse({'status': 'error'}, status=400)
 
-def generate_chatbot_response(message, session):
+def generate_chatbot_response(message):
     """Generate dynamic chatbot response based on user message content"""
-    message_lower = message.lower()
-    
-    # Crisis intervention - immediate response
-    crisis_keywords = ['suicide', 'kill myself', 'end my life', 'want to die', 'hurt myself', 'self harm', 'better off dead']
-    if any(keyword in message_lower for keyword in crisis_keywords):
-        session.distress_level = 10
-        session.save()
-        return {
-            'message': "I'm very concerned about what you've shared. Your life has value and there are people who want to help right now. Please reach out immediately:\n\n **Crisis Resources:**\n• National Suicide Prevention Lifeline: **988**\n• Crisis Text Line: Text **HOME to 741741**\n• Emergency Services: **911**\n\nYou don't have to go through this alone. Would you like me to help you find local mental health resources?",
-            'severity': 'severe'
-        }
-    
-    # Anxiety-related responses
-    anxiety_keywords = ['anxious', 'panic', 'worried', 'nervous', 'scared', 'fear', 'anxiety attack', 'panic attack']
-    if any(keyword in message_lower for keyword in anxiety_keywords):
-        session.distress_level = 7
-        session.save()
-        return {
-            'message': "I understand you're feeling anxious. Anxiety can be overwhelming, but there are effective ways to manage it:\n\n **Try this breathing technique:**\n• Breathe in for 4 counts\n• Hold for 4 counts\n• Breathe out for 6 counts\n• Repeat 5 times\n\n **Grounding technique (5-4-3-2-1):**\n• 5 things you can see\n• 4 things you can touch\n• 3 things you can hear\n• 2 things you can smell\n• 1 thing you can taste\n\nWould you like me to guide you through one of these techniques?",
-            'severity': 'moderate'
-        }
-    
-    # Depression-related responses
-    depression_keywords = ['depressed', 'sad', 'hopeless', 'empty', 'worthless', 'tired', 'no energy', 'can\'t sleep', 'sleeping too much']
-    if any(keyword in message_lower for keyword in depression_keywords):
-        session.distress_level = 6
-        session.save()
-        return {
-            'message': "I hear that you're going through a difficult time. Depression can make everything feel harder, but you're not alone in this:\n\n **Small steps that can help:**\n• Try to maintain a regular sleep schedule\n• Get some sunlight or fresh air if possible\n• Reach out to a trusted friend or family member\n• Consider gentle movement like a short walk\n• Practice self-compassion - be kind to yourself\n\n **Professional support:** If these feelings persist, talking to a mental health professional can be very helpful.\n\nWhat feels most manageable for you right now?",
-            'severity': 'moderate'
-        }
-    
-    # Stress-related responses
-    stress_keywords = ['stressed', 'overwhelmed', 'pressure', 'burnout', 'exhausted', 'too much', 'can\'t cope']
-    if any(keyword in message_lower for keyword in stress_keywords):
-        session.distress_level = 5
-        session.save()
-        return {
-            'message': "Stress can feel overwhelming, but there are ways to manage it effectively:\n\n⚡ **Quick stress relief:**\n• Take 5 deep breaths\n• Do a 2-minute body scan\n• Step outside for fresh air\n• Listen to calming music\n\n📝 **Longer-term strategies:**\n• Break large tasks into smaller steps\n• Set boundaries and say no when needed\n• Practice regular self-care\n• Consider time management techniques\n\nWhat's contributing most to your stress right now? Sometimes talking through it can help.",
-            'severity': 'moderate'
-        }
-    
-    # Sleep-related responses
-    sleep_keywords = ['can\'t sleep', 'insomnia', 'tired', 'exhausted', 'sleep problems', 'staying awake']
-    if any(keyword in message_lower for keyword in sleep_keywords):
-        session.distress_level = 4
-        session.save()
-        return {
-            'message': "Sleep problems can really affect how we feel. Here are some strategies that might help:\n\n🌙 **Sleep hygiene tips:**\n• Keep a consistent sleep schedule\n• Avoid screens 1 hour before bed\n• Create a relaxing bedtime routine\n• Keep your bedroom cool and dark\n• Avoid caffeine after 2 PM\n\n🧘 **Relaxation techniques:**\n• Progressive muscle relaxation\n• Guided meditation\n• Deep breathing exercises\n• Gentle stretching\n\nHow long have you been having trouble sleeping?",
-            'severity': 'mild'
-        }
-    
-    # Relationship/social issues
-    relationship_keywords = ['lonely', 'alone', 'relationship', 'friends', 'family problems', 'isolated', 'social']
-    if any(keyword in message_lower for keyword in relationship_keywords):
-        session.distress_level = 4
-        session.save()
-        return {
-            'message': "Relationships and social connections are so important for our wellbeing. It sounds like this is on your mind:\n\n🤝 **Building connections:**\n• Reach out to one person today, even briefly\n• Join activities or groups that interest you\n• Practice active listening in conversations\n• Be patient with yourself - relationships take time\n\n💭 **If you're feeling lonely:**\n• Remember that many people feel this way\n• Consider volunteering or helping others\n• Try online communities with shared interests\n• Professional counseling can help with social skills\n\nWhat kind of connection are you looking for right now?",
-            'severity': 'mild'
-        }
-    
-    # Work/school stress
-    work_keywords = ['work', 'job', 'school', 'study', 'exam', 'deadline', 'boss', 'colleague', 'performance']
-    if any(keyword in message_lower for keyword in work_keywords):
-        session.distress_level = 4
-        session.save()
-        return {
-            'message': "Work and school stress is very common. Let's think about some strategies:\n\n📊 **Managing workload:**\n• Prioritize tasks by importance and urgency\n• Break large projects into smaller steps\n• Take regular breaks (even 5-10 minutes helps)\n• Communicate with supervisors about realistic expectations\n\n⚖️ **Work-life balance:**\n• Set boundaries between work and personal time\n• Practice saying no to non-essential tasks\n• Make time for activities you enjoy\n• Consider if perfectionism is adding pressure\n\nWhat aspect of work/school is most challenging for you?",
-            'severity': 'mild'
-        }
-    
-    # General mental health awareness
-    mental_health_keywords = ['therapy', 'counseling', 'mental health', 'wellbeing', 'self care', 'meditation', 'mindfulness']
-    if any(keyword in message_lower for keyword in mental_health_keywords):
-        session.distress_level = 2
-        session.save()
-        return {
-            'message': "It's wonderful that you're thinking about your mental health! Taking care of your mental wellbeing is just as important as physical health:\n\n🌱 **Self-care basics:**\n• Regular exercise (even light walking)\n• Nutritious meals and staying hydrated\n• Adequate sleep (7-9 hours for most adults)\n• Social connections and support\n\n🧘 **Mental wellness practices:**\n• Mindfulness and meditation\n• Journaling or creative expression\n• Setting healthy boundaries\n• Professional therapy when needed\n\nWhat aspect of mental health would you like to explore further?",
-            'severity': 'mild'
-        }
-    
-    # Greeting responses
-    greeting_keywords = ['hello', 'hi', 'hey', 'good morning', 'good afternoon', 'good evening']
-    if any(keyword in message_lower for keyword in greeting_keywords):
-        session.distress_level = 1
-        session.save()
-        return {
-            'message': "Hello! I'm glad you're here. I'm your mental health support assistant, and I'm here to listen and help in whatever way I can.\n\n💙 **I can help with:**\n• Stress and anxiety management\n• Coping strategies and techniques\n• Information about mental health resources\n• Just being someone to talk to\n\nWhat's on your mind today? Feel free to share whatever you're comfortable with.",
-            'severity': 'mild'
-        }
-    
-    # Breathing exercises
-    breathing_keywords = ['breathing', 'breathe', 'breath']
-    if any(keyword in message_lower for keyword in breathing_keywords):
-        session.distress_level = 3
-        session.save()
-        return {
-            'message': "Great choice! Breathing exercises are very effective for managing stress and anxiety.\n\n🌬️ **4-7-8 Breathing:**\n1. Breathe in through your nose for 4 counts\n2. Hold your breath for 7 counts\n3. Exhale through your mouth for 8 counts\n4. Repeat 3-4 times\n\n📦 **Box Breathing:**\n1. Breathe in for 4 counts\n2. Hold for 4 counts\n3. Breathe out for 4 counts\n4. Hold for 4 counts\n\nTry whichever feels more comfortable for you.",
-            'severity': 'mild'
-        }
-
-    # Journaling requests
-    journal_keywords = ['journal', 'writing', 'write', 'express', 'thoughts', 'feelings']
-    if any(keyword in message_lower for keyword in journal_keywords):
-        session.distress_level = 3
-        session.save()
-        return {
-            'message': "Journaling is an excellent way to process your thoughts and emotions. Here are some prompts to get you started:\n\n📝 **Daily Reflection:**\n• How am I feeling right now?\n• What's one thing that went well today?\n• What's challenging me, and how can I address it?\n\n🙏 **Gratitude Practice:**\n• Write down 3 things you're grateful for\n• Include why each one matters to you\n\n🧩 **Problem-Solving:**\n• Describe a current challenge\n• List 3 possible solutions\n• Choose one small step to try",
-            'severity': 'mild'
-        }
-
-    # Positive/gratitude responses
-    positive_keywords = ['better', 'good', 'happy', 'grateful', 'thank']
-    if any(keyword in message_lower for keyword in positive_keywords):
-        session.distress_level = 1
-        session.save()
-        return {
-            'message': "I'm so glad to hear you're feeling better! It's wonderful that you're taking care of your mental health.\n\n✨ **To Maintain Positive Momentum:**\n• Continue the practices that are helping\n• Notice and celebrate small wins\n• Build a toolkit of coping strategies\n• Stay connected with supportive people\n\nWhat's been most helpful for you recently?",
-            'severity': 'mild'
-        }
-
-    # Default supportive response
-    session.distress_level = 2
-    session.save()
-    return {
-        'message': "Thank you for sharing that with me. I'm here to listen and support you through whatever you're experiencing.\n\n🤗 **Remember:**\n• Your feelings are valid\n• It's okay to not be okay sometimes\n• Seeking help is a sign of strength\n• You don't have to face challenges alone\n\nIs there something specific you'd like to talk about or explore? I'm here to help in whatever way feels most useful to you right now.",
-        'severity': 'mild'
-    }
+    # Precomputed per intent at import; read-only
+    return match_intent(message).response
 
 @login_required
 def mood_history(request):